@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import json
+import time
+
+from listening.prescreen import build_term_stats, prescreen_answer
+
+# Бенчмарк локальной предпроверки ответов.
+# Выборка — JSONL, по строке на ответ: {"transcript": "...", "answer": "...", "correct": true/false},
+# где "correct" — вердикт LLM. Строки без "correct" можно разметить через OpenAI флагом --label.
+#
+#   python -m listening.benchmark_prescreen sample.jsonl
+#   python -m listening.benchmark_prescreen unlabeled.jsonl --label labeled.jsonl
+
+
+def load_sample(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def label_sample(items: list, out_path: str) -> list:
+    # Импорт здесь, чтобы сам бенчмарк не требовал ключей OpenAI и Supabase
+    from listening.check_answer import grade_with_llm
+    from listening.passages import select_passages
+    from services.llm_gateway import llm
+
+    with open(out_path, "w", encoding="utf-8") as f_out:
+        for item in items:
+            if "correct" not in item:
+                context = select_passages(None, item["transcript"], item["answer"])
+                item["correct"] = bool((await grade_with_llm(context, item["answer"])).get("correct", False))
+            f_out.write(json.dumps(item, ensure_ascii=False) + "\n")
+    await llm.close()
+    return items
+
+
+def run_benchmark(items: list) -> dict:
+    decided = 0
+    agreed = 0
+    reasons = {}
+    elapsed = 0.0
+
+    for item in items:
+        stats = build_term_stats(item["transcript"])
+        start = time.perf_counter()
+        result = prescreen_answer(item["answer"], item["transcript"], stats)
+        elapsed += time.perf_counter() - start
+
+        if result is None:
+            continue
+        decided += 1
+        reasons[result["reason"]] = reasons.get(result["reason"], 0) + 1
+        if result["correct"] == bool(item["correct"]):
+            agreed += 1
+
+    total = len(items)
+    return {
+        "total": total,
+        "llm_calls_avoided": decided,
+        "avoided_ratio": decided / total if total else 0.0,
+        "agreement_on_decided": agreed / decided if decided else 0.0,
+        "reasons": reasons,
+        "avg_prescreen_ms": elapsed / total * 1000 if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк локальной предпроверки listening-ответов")
+    parser.add_argument("sample", help="JSONL с transcript, answer и вердиктом LLM в correct")
+    parser.add_argument("--label", metavar="OUT", help="Разметить строки без correct через OpenAI и сохранить в OUT")
+    args = parser.parse_args()
+
+    items = load_sample(args.sample)
+    if args.label:
+        items = asyncio.run(label_sample(items, args.label))
+
+    missing = [item for item in items if "correct" not in item]
+    if missing:
+        parser.error(f"{len(missing)} строк без поля correct — запустите с --label")
+
+    report = run_benchmark(items)
+    print(f"Ответов в выборке:        {report['total']}")
+    print(f"Решено без LLM:           {report['llm_calls_avoided']} ({report['avoided_ratio']:.1%})")
+    print(f"Совпадение с LLM:         {report['agreement_on_decided']:.1%}")
+    print(f"Причины:                  {report['reasons']}")
+    print(f"Среднее время проверки:   {report['avg_prescreen_ms']:.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,34 @@
 import os
 import json
+import logging
 import re
-import openai
+import hashlib
 from supabase import create_client
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 from typing import List
 
+from listening.prescreen import prescreen_answer
+from listening.passages import select_passages
+from listening.comprehension import grade_against_references, format_references
+from services.llm_gateway import llm, LLMError
+from services.single_flight import flights
+from services.admission import admit
+from services.logs import sampled
+from services.storage import storage
+from services.responses import FastJSONResponse
+
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-openai.api_key = OPENAI_API_KEY
 
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 class AnswerRequest(BaseModel):
@@ -37,104 +46,124 @@ def fix_broken_json(response_text: str) -> str:
         return fixed_json
     return ""
 
-@router.post("/check_answer")
+# Проверка одного ответа через OpenAI.
+# context — не вся транскрипция, а релевантные ответу фрагменты (listening/passages.py),
+# при наличии — вместе с эталонными вопросами и ответами (listening/comprehension.py)
+async def grade_with_llm(context: str, answer: str, context_title: str = "Подкаст мәтіні") -> dict:
+    # Строгий Prompt для OpenAI (только JSON)
+    system_prompt = (
+        "Сен тек JSON форматында жауап беретін көмекшісің. "
+        "Қазақ тілінде сөйлейсің. Артық мәтін немесе түсініктеме жазба. "
+        "Тек JSON форматында жауап қайтар. "
+        "JSON форматы: {\"correct\": true/false, \"feedback\": \"...\"}.\n"
+        "feedback ішінде пайдаланушы жауабы неге дұрыс емес екенін түсіндіріп, "
+        "подкаст мазмұнына негізделген кішкентай подсказка бер.\n"
+    "Егер JSON бере алмасаң, осы форматта қайтар: {\"correct\": false, \"feedback\": \"\"}."
+    )
+
+    user_prompt = (
+        f"{context_title}:\n{context}\n\n"
+        f"Пайдаланушы жауабы: {answer}\n"
+        "Осы жауап дұрыс па, әлде толық емес пе? "
+        "JSON форматында жауап бер: {\"correct\": false, \"feedback\": \"Жауап толық емес. Мысалы, ...\"}"
+    )
+
+
+    # Отправляем запрос в OpenAI
+    try:
+        raw_text = await llm.chat(
+            "gpt-4o-mini",
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            max_tokens=100,
+            temperature=0
+        )
+    except LLMError as e:
+        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+
+    logger.debug("Ответ GPT", extra=sampled(raw=raw_text))  # Логируем реальный ответ от GPT
+
+    # Пытаемся распарсить JSON
+    try:
+        result = json.loads(raw_text)
+    except json.JSONDecodeError:
+        # Если JSON сломан пробую исправить
+        fixed = fix_broken_json(raw_text)
+        if fixed:
+            try:
+                result = json.loads(fixed)
+            except:
+                result = {"correct": False, "feedback": ""}
+        else:
+            result = {"correct": False, "feedback": ""}
+
+    return result
+
+@router.post("/check_answer", dependencies=[Depends(admit("check_answer", "openai"))])
 async def check_answer(request: AnswerRequest):
     # Проверяем, есть ли 3 ответа
     if len(request.answers) != 3:
         raise HTTPException(status_code=400, detail="Нужно 3 ответа")
 
-    # Получаем последние 3 транскрипции пользователя
-    data_resp = (
-        supabase.from_("user_transcripts")
-        .select("id, podcast_title, transcript, topic, created_at")
-        .eq("user_id", request.user_id)
-        .eq("topic", request.topic)
-        .order("created_at", desc=True)  # Берем последние 3
-        .limit(3)
-        .execute()
+    # Повторная отправка тех же ответов, пока идёт проверка, ждёт её результат,
+    # а не проверяет (и не вызывает LLM) заново
+    answers_hash = hashlib.sha256(json.dumps(request.answers, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return await flights.do(
+        ("check_answer", request.user_id, request.topic, answers_hash),
+        lambda: evaluate_answers(request)
     )
 
-    transcripts = [
-        (item["id"], item["podcast_title"], item["transcript"])
-        for item in data_resp.data
-    ]
+async def evaluate_answers(request: AnswerRequest):
+
+    # Получаем последние 3 транскрипции пользователя
+    transcripts = await storage.latest_transcripts(
+        request.user_id, request.topic,
+        ("id", "podcast_title", "transcript", "term_stats", "questions", "topic", "created_at")
+    )
 
     if len(transcripts) == 0:
         raise HTTPException(status_code=404, detail="Нет ни одного подкаста по теме")
 
 
     evaluation_results = []
+    results = []
 
     for i in range(3):
-        transcript_id, podcast_title, transcript = transcripts[i]
+        item = transcripts[i]
+        transcript_id, podcast_title, transcript = item["id"], item["podcast_title"], item["transcript"]
+        questions = item.get("questions") or []
         answer = request.answers[i]
 
-        print(f"\n--- Проверка ответа #{i+1} ---")
-        print(f"[{i}] transcript_id: {transcript_id}")
-        print(f"[{i}] podcast_title: {podcast_title}")
-        print(f"[{i}] user_answer: {answer}")
-        
-
-
-        # Строгий Prompt для OpenAI (только JSON)
-        system_prompt = (
-            "Сен тек JSON форматында жауап беретін көмекшісің. "
-            "Қазақ тілінде сөйлейсің. Артық мәтін немесе түсініктеме жазба. "
-            "Тек JSON форматында жауап қайтар. "
-            "JSON форматы: {\"correct\": true/false, \"feedback\": \"...\"}.\n"
-            "feedback ішінде пайдаланушы жауабы неге дұрыс емес екенін түсіндіріп, "
-            "подкаст мазмұнына негізделген кішкентай подсказка бер.\n"
-        "Егер JSON бере алмасаң, осы форматта қайтар: {\"correct\": false, \"feedback\": \"\"}."
-        )
-
-        user_prompt = (
-            f"Подкаст мәтіні:\n{transcript[:1000]}\n\n"  # максимум 1000 символов, чтоб токены не съесть
-            f"Пайдаланушы жауабы: {answer}\n"
-            "Осы жауап дұрыс па, әлде толық емес пе? "
-            "JSON форматында жауап бер: {\"correct\": false, \"feedback\": \"Жауап толық емес. Мысалы, ...\"}"
-        )
-
-        print(f"[{i}] system_prompt: {system_prompt[:100]}...")
-
-
-        # Отправляем запрос в OpenAI
-        try:
-            gpt_response = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=100,  
-                temperature=0
-            )
-        except openai.error.OpenAIError as e:
-            raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
-
-        raw_text = gpt_response["choices"][0]["message"]["content"]
-        print(f"GPT raw: {raw_text}")  # Логируем реальный ответ от GPT
-
-        # Пытаемся распарсить JSON
-        try:
-            result = json.loads(raw_text)
-        except json.JSONDecodeError:
-            # Если JSON сломан пробую исправить
-            fixed = fix_broken_json(raw_text)
-            if fixed:
-                try:
-                    result = json.loads(fixed)
-                except:
-                    result = {"correct": False, "feedback": ""}
+        # Очевидные случаи решаем локально, без запроса к OpenAI
+        result = prescreen_answer(answer, transcript, item.get("term_stats"))
+        if result is None:
+            # Сверяем с эталонными ответами, сгенерированными при транскрипции
+            result = grade_against_references(answer, questions)
+
+        if result is not None:
+            grader = result["reason"]
+        else:
+            # В промпт всегда идут релевантные ответу фрагменты в пределах CONTEXT_BUDGET символов:
+            # ответ может быть о части подкаста, которой нет в эталонных вопросах
+            context = select_passages(transcript_id, transcript, answer)
+            if questions:
+                grader = "llm_references"
+                # Эталоны — поверх фрагментов, как подсказка о главных мыслях
+                context = f"{format_references(questions)}\n\nПодкаст мәтіні:\n{context}"
+                result = await grade_with_llm(context, answer, context_title="Подкаст сұрақтары мен жауаптары")
             else:
-                result = {"correct": False, "feedback": ""}
+                grader = "llm_passages"
+                result = await grade_with_llm(context, answer)
 
         correct = result.get("correct", False)
         feedback = result.get("feedback", "")
-        print(f"[{i}] Parsed result => correct: {correct}, feedback: {feedback}")
-
+        logger.debug("Проверка ответа", extra=sampled(
+            index=i, transcript_id=transcript_id, grader=grader, correct=correct, answer=answer, feedback=feedback
+        ))
 
-        # Обновляем `success` ТОЛЬКО у последних 3 записей
-        supabase.from_("user_transcripts").update({"success": correct}).eq("id", transcript_id).execute()
+        results.append((transcript_id, correct))
 
         evaluation_results.append({
             "podcast_title": podcast_title,
@@ -142,5 +171,30 @@ async def check_answer(request: AnswerRequest):
             "success": correct
         })
 
+    # Обновляем `success` ТОЛЬКО у последних 3 записей
+    await storage.set_transcript_results(results)
+
+    # Обновляем серию верных ответов для /unlock_card (транскрипции шли от новых к старым)
+    supabase.rpc("record_listening_results", {
+        "p_user_id": request.user_id,
+        "p_results": [item["success"] for item in reversed(evaluation_results)]
+    }).execute()
+
     # 5. Возвращаем JSON-ответ
-    return JSONResponse({"evaluations": evaluation_results})
+    return FastJSONResponse({"evaluations": evaluation_results})
+
+
+# Вопросы на понимание по последним подкастам темы (без эталонных ответов)
+@router.get("/questions")
+async def get_questions(user_id: str, topic: str):
+    transcripts = await storage.latest_transcripts(user_id, topic, ("podcast_title", "questions"))
+
+    return {
+        "podcasts": [
+            {
+                "podcast_title": item["podcast_title"],
+                "questions": [q["question"] for q in item.get("questions") or []]
+            }
+            for item in transcripts
+        ]
+    }
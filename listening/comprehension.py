@@ -0,0 +1,121 @@
+import json
+import logging
+
+from listening.prescreen import content_terms, tokenize
+from services.llm_gateway import llm, LLMError
+from services.logs import fields
+
+# Вопросы на понимание подкаста с эталонными ответами и ключевыми фактами.
+# Генерируются один раз при транскрипции и хранятся в user_transcripts.questions,
+# а /check_answer сравнивает ответ с ними локально.
+
+logger = logging.getLogger(__name__)
+
+QUESTIONS_COUNT = 3
+FACT_MATCH = 0.6       # Доля слов факта, которые должны быть в ответе, чтобы факт засчитался
+ANSWER_MATCH = 0.67    # Доля фактов вопроса, при которой ответ считается верным
+TRANSCRIPT_CHARS = 6000
+
+FEEDBACK_CORRECT = "Дұрыс! Жауабыңыз подкаст мазмұнына сәйкес келеді."
+
+SYSTEM_PROMPT = (
+    "You write listening comprehension questions for English learners. "
+    "Reply with JSON only, no extra text."
+)
+
+
+def build_prompt(transcript: str) -> str:
+    return (
+        f"Podcast transcript:\n{transcript[:TRANSCRIPT_CHARS]}\n\n"
+        f"Write {QUESTIONS_COUNT} short questions about the main ideas of this podcast. "
+        "For each give a one-sentence reference answer and 2-4 key facts "
+        "(short phrases of 1-4 words taken from the podcast) that a correct answer must mention.\n"
+        'JSON format: {"questions": [{"question": "...", "answer": "...", "key_facts": ["...", "..."]}]}'
+    )
+
+
+def parse_questions(raw_text: str) -> list:
+    try:
+        data = json.loads(raw_text[raw_text.find("{"):raw_text.rfind("}") + 1])
+    except ValueError:
+        return []
+    if not isinstance(data, dict):
+        return []
+
+    questions = []
+    for item in data.get("questions", []):
+        if not isinstance(item, dict) or not item.get("question") or not item.get("answer"):
+            continue
+        facts = [str(fact) for fact in item.get("key_facts", []) if str(fact).strip()]
+        questions.append({
+            "question": str(item["question"]),
+            "answer": str(item["answer"]),
+            "key_facts": facts[:4],
+        })
+    return questions[:QUESTIONS_COUNT]
+
+
+async def generate_questions(transcript: str) -> list:
+    """Генерирует вопросы по транскрипции. При ошибке возвращает [] —
+    тогда /check_answer проверяет ответ по самой транскрипции."""
+    try:
+        raw_text = await llm.chat(
+            "gpt-4o-mini",
+            [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": build_prompt(transcript)}
+            ],
+            max_tokens=500,
+            temperature=0
+        )
+    except LLMError as e:
+        logger.warning("Ошибка генерации вопросов", extra=fields(error=str(e)))
+        return []
+
+    return parse_questions(raw_text)
+
+
+def stem(term: str) -> str:
+    # Грубый стемминг, чтобы "farmers" совпадало с "farmer", а "rising" с "rise"
+    for suffix in ("ing", "ed", "ly", "s"):
+        if len(term) > len(suffix) + 2 and term.endswith(suffix):
+            term = term[:-len(suffix)]
+            break
+    return term[:-1] if len(term) > 3 and term.endswith("e") else term
+
+
+def stems(text: str) -> set:
+    return {stem(term) for term in content_terms(tokenize(text))}
+
+
+def fact_covered(fact: str, answer_stems: set) -> bool:
+    fact_stems = stems(fact)
+    if not fact_stems:
+        return False
+    return len(fact_stems & answer_stems) / len(fact_stems) >= FACT_MATCH
+
+
+def grade_against_references(answer: str, questions: list):
+    """Засчитывает ответ, если он покрывает ключевые факты хотя бы одного вопроса.
+    Возвращает None, если локально решить нельзя и нужна проверка в LLM."""
+    answer_stems = stems(answer)
+    if not questions or not answer_stems:
+        return None
+
+    for item in questions:
+        facts = item.get("key_facts") or [item["answer"]]
+        covered = sum(1 for fact in facts if fact_covered(fact, answer_stems))
+        if covered / len(facts) >= ANSWER_MATCH:
+            return {"correct": True, "feedback": FEEDBACK_CORRECT, "reason": "reference_match"}
+    return None
+
+
+def format_references(questions: list) -> str:
+    """Эталонные вопросы и ответы для промпта LLM — поверх фрагментов транскрипции."""
+    lines = []
+    for number, item in enumerate(questions, start=1):
+        lines.append(f"{number}. Q: {item['question']}")
+        lines.append(f"   A: {item['answer']}")
+        if item.get("key_facts"):
+            lines.append(f"   Key facts: {', '.join(item['key_facts'])}")
+    return "\n".join(lines)
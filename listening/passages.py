@@ -0,0 +1,128 @@
+import math
+from collections import Counter, OrderedDict
+
+from listening.prescreen import SENTENCE_RE, content_terms, tokenize
+from services.metrics import cache_requests
+
+# Выбор релевантных фрагментов транскрипции для промпта проверки ответа.
+# Транскрипция режется на фрагменты по предложениям и индексируется
+# инвертированным индексом в памяти процесса при сохранении;
+# при проверке берём top-k фрагментов по BM25 в пределах бюджета символов.
+
+CHUNK_CHARS = 400        # Примерный размер фрагмента
+CONTEXT_BUDGET = 1000    # Столько символов транскрипции максимум уходит в промпт
+TOP_K = 3
+MAX_INDEXES = 1000       # Сколько проиндексированных транскрипций держим в памяти
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def split_chunks(transcript: str, chunk_chars: int = CHUNK_CHARS) -> list:
+    """Режет транскрипцию на фрагменты из целых предложений длиной около chunk_chars."""
+    chunks = []
+    current = ""
+    start = 0
+    for match in SENTENCE_RE.finditer(transcript + "."):
+        sentence = transcript[start:match.end()].strip()
+        start = match.end()
+        if not sentence:
+            continue
+        if current and len(current) + len(sentence) + 1 > chunk_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        chunks.append(current)
+
+    # Слишком длинные «предложения» (транскрипция без пунктуации) режем по длине
+    result = []
+    for chunk in chunks:
+        while len(chunk) > chunk_chars * 2:
+            cut = chunk.rfind(" ", 0, chunk_chars)
+            cut = cut if cut > 0 else chunk_chars
+            result.append(chunk[:cut].strip())
+            chunk = chunk[cut:].strip()
+        if chunk:
+            result.append(chunk)
+    return result
+
+
+class TranscriptIndex:
+    """Инвертированный индекс фрагментов одной транскрипции: терм -> {номер фрагмента: tf}."""
+
+    def __init__(self, transcript: str):
+        self.chunks = split_chunks(transcript)
+        self.postings = {}
+        self.lengths = []
+        for chunk_id, chunk in enumerate(self.chunks):
+            terms = Counter(content_terms(tokenize(chunk)))
+            self.lengths.append(sum(terms.values()))
+            for term, freq in terms.items():
+                self.postings.setdefault(term, {})[chunk_id] = freq
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def search(self, query: str) -> list:
+        """Номера фрагментов, отсортированные по убыванию BM25."""
+        n_chunks = len(self.chunks)
+        scores = {}
+        for term in set(content_terms(tokenize(query))):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_chunks - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, freq in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / (self.avg_length or 1))
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * freq * (BM25_K1 + 1) / (freq + norm)
+        return sorted(scores, key=lambda chunk_id: (-scores[chunk_id], chunk_id))
+
+
+_indexes = OrderedDict()
+
+
+def index_transcript(transcript_id: str, transcript: str) -> TranscriptIndex:
+    """Индексирует транскрипцию (вызывается при сохранении в user_transcripts)."""
+    index = TranscriptIndex(transcript)
+    _indexes[transcript_id] = index
+    _indexes.move_to_end(transcript_id)
+    while len(_indexes) > MAX_INDEXES:
+        _indexes.popitem(last=False)
+    return index
+
+
+def get_index(transcript_id, transcript: str) -> TranscriptIndex:
+    # После рестарта или в другом воркере индекса нет — строим его заново из текста
+    if transcript_id is None:
+        return TranscriptIndex(transcript)
+    index = _indexes.get(transcript_id)
+    if index is None:
+        cache_requests.inc("transcript_index", "miss")
+        return index_transcript(transcript_id, transcript)
+    cache_requests.inc("transcript_index", "hit")
+    _indexes.move_to_end(transcript_id)
+    return index
+
+
+def select_passages(transcript_id, transcript: str, answer: str,
+                    top_k: int = TOP_K, budget: int = CONTEXT_BUDGET) -> str:
+    """Собирает до top_k самых релевантных ответу фрагментов в пределах budget символов,
+    сохраняя их исходный порядок. Если ничего не нашлось — начало транскрипции."""
+    if len(transcript) <= budget:
+        return transcript
+
+    index = get_index(transcript_id, transcript)
+    selected = []
+    used = 0
+    for chunk_id in index.search(answer):
+        chunk = index.chunks[chunk_id]
+        if used + len(chunk) > budget:
+            continue
+        selected.append(chunk_id)
+        used += len(chunk) + 5
+        if len(selected) >= top_k:
+            break
+
+    if not selected:
+        return transcript[:budget]
+    return "\n...\n".join(index.chunks[chunk_id] for chunk_id in sorted(selected))
@@ -1,21 +1,37 @@
 import os
 import asyncio
+import logging
 import aiohttp
 from uuid import uuid4
 from langdetect import detect
 from supabase import create_client
 from dotenv import load_dotenv
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Depends
 import html
 
+from listening.prescreen import build_term_stats
+from listening.passages import index_transcript
+from listening.comprehension import generate_questions
+from services.single_flight import flights
+from services.admission import admit
+from services.db_budget import detached
+from services.resilience import upstream, client_timeout, UpstreamError, UpstreamUnavailable
+from services.logs import fields, sampled
+from services.cassettes import cassette, body_size, body_placeholder
+from services.profile_cache import profiles
+
 load_dotenv()
 DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY")
 LISTEN_API_KEY = os.getenv("LISTEN_API_KEY")
+# Адреса внешних API можно переопределить (локальные заглушки в loadtest)
+DEEPGRAM_URL = os.getenv("DEEPGRAM_URL", "https://api.deepgram.com/v1/listen")
+LISTENNOTES_SEARCH_URL = os.getenv("LISTENNOTES_SEARCH_URL", "https://listen-api.listennotes.com/api/v2/search")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 MAX_DURATION_SEC = 15 * 60  # 15 минут
 
@@ -28,22 +44,22 @@ async def validate_podcast(item, session, user_level, seen_titles):
         audio_url = item.get("audio", "").strip()
 
         if title in seen_titles:
-            print(f"⏩ Дубликат: {title}", flush=True)
+            logger.debug("⏩ Подкаст пропущен", extra=sampled(reason="duplicate", title=title))
             return None
         seen_titles.add(title)
 
         if duration > MAX_DURATION_SEC:
-            print(f"⏩ Пропущен (длина > 15 мин): {title}", flush=True)
+            logger.debug("⏩ Подкаст пропущен", extra=sampled(reason="too_long", title=title, duration=duration))
             return None
 
         language = detect(description) if description else "en"
         if language != "en":
-            print(f"⏩ Пропущен (не en): {title}", flush=True)
+            logger.debug("⏩ Подкаст пропущен", extra=sampled(reason="not_en", title=title, language=language))
             return None
 
         must_have_keywords = ["learn", "study", "practice", "lesson", "english"]
         if not any(word in description.lower() for word in must_have_keywords):
-            print(f"⏩ Пропущен (нет ключевых слов): {title}", flush=True)
+            logger.debug("⏩ Подкаст пропущен", extra=sampled(reason="no_keywords", title=title))
             return None
 
         blacklist = [
@@ -51,11 +67,11 @@ async def validate_podcast(item, session, user_level, seen_titles):
             "travel blog", "holiday planner", "tourism podcast"
         ]
         if any(bad in title.lower() or bad in description.lower() for bad in blacklist):
-            print(f"⏩ Пропущен (blacklist): {title}", flush=True)
+            logger.debug("⏩ Подкаст пропущен", extra=sampled(reason="blacklist", title=title))
             return None
 
         if not audio_url:
-            print(f"⛔️ Пропущен (нет audio_url): {title}", flush=True)
+            logger.debug("⛔️ Подкаст пропущен", extra=sampled(reason="no_audio_url", title=title))
             return None
 
         # Проверка аудиофайла
@@ -65,15 +81,19 @@ async def validate_podcast(item, session, user_level, seen_titles):
             "Range": "bytes=0-1"
         }
 
-        async with session.get(audio_url, headers=audio_headers, allow_redirects=True) as audio_resp:
-            if audio_resp.status >= 400:
-                print(f"❌ Аудиофайл недоступен ({audio_resp.status}): {audio_url}", flush=True)
-                return None
+        async def probe():
+            async with session.get(audio_url, headers=audio_headers, allow_redirects=True) as audio_resp:
+                return {"status": audio_resp.status, "content_type": audio_resp.headers.get("Content-Type", "")}
+
+        audio = await cassette.intercept("http", "audio_probe", {"url": audio_url}, probe)
+        if audio["status"] >= 400:
+            logger.debug("❌ Аудиофайл недоступен", extra=sampled(status=audio["status"], audio_url=audio_url))
+            return None
 
-            content_type = audio_resp.headers.get("Content-Type", "")
-            if not content_type.startswith("audio"):
-                print(f"⛔️ Пропущен (не audio Content-Type): {audio_url} — {content_type}", flush=True)
-                return None
+        content_type = audio["content_type"]
+        if not content_type.startswith("audio"):
+            logger.debug("⛔️ Подкаст пропущен", extra=sampled(reason="not_audio", audio_url=audio_url, content_type=content_type))
+            return None
 
         return {
             "title": title,
@@ -84,13 +104,13 @@ async def validate_podcast(item, session, user_level, seen_titles):
         }
 
     except Exception as e:
-        print(f"⚠️ Ошибка при обработке подкаста: {e}", flush=True)
+        logger.warning("⚠️ Ошибка при обработке подкаста", extra=fields(error=str(e)))
         return None
 
 # 🚀 Основная функция
 async def fetch_podcasts(user_level, topic=None):
     query = f"Learn English {topic}" if topic else "Learn English"
-    url = "https://listen-api.listennotes.com/api/v2/search"
+    url = LISTENNOTES_SEARCH_URL
     headers = {"X-ListenAPI-Key": LISTEN_API_KEY}
     params = {
         "q": query,
@@ -102,26 +122,31 @@ async def fetch_podcasts(user_level, topic=None):
         "only_in": "title,description",
     }
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                if response.status != 200:
-                    raise HTTPException(status_code=500, detail=f"Ошибка ListenNotes API: {await response.text()}")
-
-                data = await response.json()
-                seen_titles = set()
-
-                # Параллельно валидируем все эпизоды
-                tasks = [
-                    validate_podcast(item, session, user_level, seen_titles)
-                    for item in data.get("results", [])
-                ]
-                results = await asyncio.gather(*tasks)
-                podcasts = [p for p in results if p is not None]
-
-                print(f"🔎 Найдено {len(podcasts)} подходящих подкастов", flush=True)
-                return podcasts[:3]
+    async def search(session):
+        async with session.get(url, headers=headers, params=params) as response:
+            if response.status != 200:
+                raise UpstreamError(f"Ошибка ListenNotes API: {await response.text()}")
+            return await response.json()
 
+    try:
+        async with aiohttp.ClientSession(timeout=client_timeout("listennotes")) as session:
+            # Дедлайн, breaker и bulkhead; если ListenNotes недоступен — последний удачный результат поиска
+            data = await upstream("listennotes").call(lambda: search(session), cache_key=query)
+            seen_titles = set()
+
+            # Параллельно валидируем все эпизоды
+            tasks = [
+                validate_podcast(item, session, user_level, seen_titles)
+                for item in data.get("results", [])
+            ]
+            results = await asyncio.gather(*tasks)
+            podcasts = [p for p in results if p is not None]
+
+            logger.info("🔎 Найдены подходящие подкасты", extra=fields(found=len(podcasts), query=query))
+            return podcasts[:3]
+
+    except (UpstreamError, UpstreamUnavailable) as e:
+        raise HTTPException(status_code=500, detail=str(e))
     except aiohttp.ClientError as e:
         raise HTTPException(status_code=500, detail=f"Ошибка подключения к ListenNotes API: {str(e)}")
     except asyncio.TimeoutError:
@@ -136,85 +161,106 @@ async def transcribe_audio(audio_url: str) -> str:
     headers = {"Authorization": f"Token {DEEPGRAM_API_KEY}"}
     params = {"model": "general", "tier": "base", "language": "en"}
 
-    print(f"Начинаем скачивание аудиофайла: {audio_url}", flush=True)
+    logger.debug("Скачивание аудиофайла", extra=sampled(audio_url=audio_url))
 
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(audio_url, headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
-                "Accept": "*/*",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive",
-            }) as audio_resp:
-
-                if audio_resp.status != 200:
-                    print(f"Ошибка загрузки аудиофайла: {await audio_resp.text()}", flush=True)
-                    return ""
-
-                print(f"Аудиофайл загружен, отправка в Deepgram...", flush=True)
-                content_type = audio_resp.headers.get("Content-Type", "")
-                if not content_type.startswith("audio"):
-                    print(f"⚠️ Не аудиофайл! Получен Content-Type: {content_type}")
-                    return ""
-
-                audio_data = await audio_resp.read()
-
-                async with session.post("https://api.deepgram.com/v1/listen", headers=headers, params=params, data=audio_data) as resp:
+        async with aiohttp.ClientSession(timeout=client_timeout("deepgram")) as session:
+            async def download() -> bytes:
+                async with session.get(audio_url, headers={
+                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+                    "Accept": "*/*",
+                    "Accept-Encoding": "gzip, deflate, br",
+                    "Connection": "keep-alive",
+                }) as audio_resp:
+
+                    if audio_resp.status != 200:
+                        logger.warning("Ошибка загрузки аудиофайла", extra=fields(status=audio_resp.status, audio_url=audio_url))
+                        return b""
+
+                    content_type = audio_resp.headers.get("Content-Type", "")
+                    if not content_type.startswith("audio"):
+                        logger.warning("⚠️ Не аудиофайл", extra=fields(audio_url=audio_url, content_type=content_type))
+                        return b""
+
+                    return await audio_resp.read()
+
+            audio_data = await cassette.intercept(
+                "http", "audio", {"url": audio_url}, download, encode=body_size, decode=body_placeholder
+            )
+            if not audio_data:
+                return ""
+
+            async def send_to_deepgram():
+                async with session.post(DEEPGRAM_URL, headers=headers, params=params, data=audio_data) as resp:
                     if resp.status != 200:
-                        print(f"Ошибка Deepgram API: {await resp.text()}")
-                        return ""
+                        raise UpstreamError(f"Ошибка Deepgram API: {await resp.text()}")
+                    return await resp.json()
 
-                    result = await resp.json()
-    except aiohttp.ClientError as e:
-        print(f"Ошибка сети при транскрипции: {str(e)}")
+            result = await upstream("deepgram").call(send_to_deepgram, request={"audio_url": audio_url, **params})
+    except (UpstreamError, UpstreamUnavailable) as e:
+        logger.warning("Ошибка Deepgram", extra=fields(error=str(e)))
+        return ""
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Ошибка сети при транскрипции", extra=fields(error=str(e)))
         return ""
 
-    print(f"Транскрипция получена!")
+    logger.debug("Транскрипция получена", extra=sampled(audio_url=audio_url))
     return result.get("results", {}).get("channels", [{}])[0].get("alternatives", [{}])[0].get("transcript", "")
 
 async def process_podcasts(user_id: str, topic: str, podcasts: list):
-    print(f"Проверка транскрипции для user_id={user_id}, topic={topic}", flush=True)
-
     existing_transcripts = supabase.from_("user_transcripts").select("topic").eq("user_id", user_id).execute()
     existing_topics = {t["topic"].lower() for t in existing_transcripts.data}
 
     if topic.lower() in existing_topics:
-        print(f"Транскрипция уже существует для user_id={user_id}, topic={topic}. Пропускаем обработку.", flush=True)
+        logger.info("Транскрипция уже существует, пропускаем", extra=fields(user_id=user_id, topic=topic))
         return
 
-    print(f"🎙 Начало транскрипции подкастов: {len(podcasts)} шт.", flush=True)
+    logger.info("🎙 Начало транскрипции подкастов", extra=fields(user_id=user_id, topic=topic, count=len(podcasts)))
 
     for podcast in podcasts:
         transcript = await transcribe_audio(podcast["audio_url"])
         if transcript.strip():
-            print(f"Сохранение транскрипции подкаста: {podcast['title']}", flush=True)
+            # Вопросы на понимание генерируем один раз здесь, а не при каждой проверке ответа
+            questions = await generate_questions(transcript)
+            transcript_id = str(uuid4())
             supabase.from_("user_transcripts").insert({
-                "id": str(uuid4()),
+                "id": transcript_id,
                 "user_id": user_id,
                 "podcast_title": podcast["title"],
                 "transcript": transcript,
+                "term_stats": build_term_stats(transcript),
+                "questions": questions,
                 "topic": topic,
                 "created_at": "now()"
             }).execute()
+            index_transcript(transcript_id, transcript)
         else:
-            print(f"Ошибка: транскрипция пустая для {podcast['title']} или произошла ошибка", flush=True)
+            logger.warning("Транскрипция пустая или произошла ошибка", extra=fields(title=podcast["title"]))
 
-@router.get("/podcasts")
+@router.get("/podcasts", dependencies=[Depends(admit("podcasts", "listennotes"))])
 async def get_podcasts(user_id: str, topic: str = Query(None)):
     try:
-        response = supabase.from_("users_progress").select("level").eq("user_id", user_id).single().execute()
-        if not response.data:
+        user_level = await profiles.get_level(user_id)
+        if not user_level:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-        user_level = response.data["level"]
-        podcasts = await fetch_podcasts(user_level, topic)
+        # Одинаковый поиск (уровень + тема) от разных запросов — один вызов ListenNotes
+        podcasts = await flights.do(
+            ("podcasts", user_level, (topic or "").lower()),
+            lambda: fetch_podcasts(user_level, topic)
+        )
 
         if not podcasts:
             return {"message": "Подкасты не найдены.", "podcasts": []}
 
-        print(f"Запуск транскрипции в фоне для user_id={user_id}, topic={topic}", flush=True)
-        asyncio.create_task(process_podcasts(user_id, topic, podcasts))
+        # Повторный запрос, пока транскрипция этой темы ещё идёт, не запускает вторую
+        with detached():
+            started = flights.launch(
+                ("transcribe", user_id, (topic or "").lower()),
+                lambda: process_podcasts(user_id, topic, podcasts)
+            )
+        logger.info("Транскрипция в фоне", extra=fields(user_id=user_id, topic=topic, started=started))
 
         return {"podcasts": podcasts, "transcription_status": "Транскрипция запущена!"}
     except Exception as e:
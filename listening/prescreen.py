@@ -0,0 +1,140 @@
+import math
+import re
+from collections import Counter
+
+# Локальная предварительная проверка ответов по listening:
+# очевидные случаи (пустой ответ, одно слово, ответ без смысловых слов, набор букв)
+# решаем сразу, без запроса к OpenAI. Ответ своими словами может почти не совпадать
+# с текстом подкаста по словам — такие ответы локально не отклоняем, их проверяет LLM.
+# Дословная копия из подкаста сама по себе не засчитывается: её сверяют с эталонами или LLM.
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+SENTENCE_RE = re.compile(r"[.!?]+")
+NORMALIZE_RE = re.compile(r"[^a-z0-9]+")
+# Три одинаковые буквы подряд или пять согласных подряд — не похоже на английское слово
+GIBBERISH_RE = re.compile(r"([a-z])\1\1|[bcdfghjklmnpqrstvwxz]{5,}")
+
+STOPWORDS = frozenset("""
+a an the and or but if so of to in on at by for with from as is are was were be been being
+am do does did have has had it its this that these those i you he she we they me him her us them
+my your his our their not no yes there here what which who whom when where why how can could
+will would shall should may might must just very too also than then about into over up down out
+""".split())
+
+# Параметр насыщения BM25 (вся транскрипция — один документ, поэтому b не нужен)
+BM25_K1 = 1.2
+
+MIN_ANSWER_WORDS = 2   # Меньше — считаем ответ слишком коротким
+MIN_COPY_WORDS = 6     # С какой длины совпадение с подкастом считаем дословной копией
+MIN_WORDLIKE = 0.5     # Ниже этой доли похожих на слова термов ответ считается набором букв
+HIGH_OVERLAP = 0.9     # Выше (вместе с HIGH_BM25) — ответ точно по содержанию
+HIGH_BM25 = 0.6
+
+FEEDBACK_EMPTY = "Жауап бос. Подкастты тыңдап, негізгі ойын өз сөзіңізбен жазыңыз."
+FEEDBACK_TOO_SHORT = "Жауап тым қысқа. Подкастта не туралы айтылғанын толығырақ жазыңыз."
+FEEDBACK_GIBBERISH = "Жауапты түсіну мүмкін емес. Подкаст туралы ағылшын тілінде өз сөзіңізбен жазыңыз."
+FEEDBACK_CORRECT = "Дұрыс! Жауабыңыз подкаст мазмұнына сәйкес келеді."
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.lower())
+
+
+def content_terms(tokens: list) -> list:
+    return [t for t in tokens if t not in STOPWORDS and len(t) > 1]
+
+
+def normalize(text: str) -> str:
+    return NORMALIZE_RE.sub(" ", text.lower()).strip()
+
+
+def build_term_stats(transcript: str) -> dict:
+    """Статистика термов транскрипции, хранится в user_transcripts.term_stats.
+    Предложения используются как документы для IDF в BM25."""
+    sentences = [s for s in SENTENCE_RE.split(transcript) if s.strip()]
+    tf = Counter()
+    df = Counter()
+    for sentence in sentences:
+        terms = content_terms(tokenize(sentence))
+        tf.update(terms)
+        df.update(set(terms))
+
+    return {
+        "tf": dict(tf),
+        "df": dict(df),
+        "length": sum(tf.values()),
+        "sentences": len(sentences),
+    }
+
+
+def overlap_score(answer_terms: set, stats: dict) -> float:
+    """Доля уникальных термов ответа, встречающихся в транскрипции."""
+    if not answer_terms:
+        return 0.0
+    tf = stats["tf"]
+    return sum(1 for t in answer_terms if t in tf) / len(answer_terms)
+
+
+def bm25_score(answer_terms: set, stats: dict) -> float:
+    """BM25 ответа против всей транскрипции, нормированный в [0, 1]
+    относительно максимально возможного веса этих же термов.
+    IDF считается по предложениям, поэтому редкие, но центральные для подкаста
+    слова весят больше служебных повторов."""
+    if not answer_terms:
+        return 0.0
+    tf, df = stats["tf"], stats["df"]
+    n_docs = max(stats.get("sentences", 1), 1)
+
+    score = 0.0
+    max_score = 0.0
+    for term in answer_terms:
+        idf = math.log(1 + (n_docs - df.get(term, 0) + 0.5) / (df.get(term, 0) + 0.5))
+        freq = tf.get(term, 0)
+        score += idf * freq * (BM25_K1 + 1) / (freq + BM25_K1)
+        max_score += idf * (BM25_K1 + 1)
+    return score / max_score if max_score else 0.0
+
+
+def looks_like_word(term: str, stats: dict) -> bool:
+    if term in stats["tf"] or term.isdigit():
+        return True
+    return any(vowel in term for vowel in "aeiouy") and not GIBBERISH_RE.search(term)
+
+
+def is_copied(answer: str, transcript: str) -> bool:
+    """Ответ целиком состоит из предложений, скопированных из транскрипции."""
+    normalized_transcript = normalize(transcript)
+    sentences = [normalize(s) for s in SENTENCE_RE.split(answer)]
+    sentences = [s for s in sentences if s]
+    return bool(sentences) and all(s in normalized_transcript for s in sentences)
+
+
+def prescreen_answer(answer: str, transcript: str, stats: dict = None):
+    """Возвращает {"correct", "feedback", "reason"} для очевидных случаев
+    или None, если ответ нужно отправить на проверку в LLM."""
+    tokens = tokenize(answer or "")
+    if not tokens:
+        return {"correct": False, "feedback": FEEDBACK_EMPTY, "reason": "empty"}
+    if len(tokens) < MIN_ANSWER_WORDS:
+        return {"correct": False, "feedback": FEEDBACK_TOO_SHORT, "reason": "too_short"}
+
+    if stats is None:
+        stats = build_term_stats(transcript)
+
+    answer_terms = set(content_terms(tokens))
+    if not answer_terms:
+        return {"correct": False, "feedback": FEEDBACK_TOO_SHORT, "reason": "no_content"}
+    wordlike = sum(1 for term in answer_terms if looks_like_word(term, stats))
+    if wordlike / len(answer_terms) < MIN_WORDLIKE:
+        return {"correct": False, "feedback": FEEDBACK_GIBBERISH, "reason": "gibberish"}
+
+    # Скопированный кусок подкаста совпадает с ним по словам полностью —
+    # по совпадению его не засчитываем, решают эталоны или LLM
+    if len(tokens) >= MIN_COPY_WORDS and is_copied(answer, transcript):
+        return None
+
+    overlap = overlap_score(answer_terms, stats)
+    if overlap >= HIGH_OVERLAP and bm25_score(answer_terms, stats) >= HIGH_BM25:
+        return {"correct": True, "feedback": FEEDBACK_CORRECT, "reason": "high_overlap"}
+
+    return None
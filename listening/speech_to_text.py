@@ -2,13 +2,21 @@ import os
 import asyncio
 import aiohttp
 from uuid import uuid4
+from datetime import datetime, timedelta, timezone
 from supabase import create_client
 from dotenv import load_dotenv
 from fastapi import APIRouter, HTTPException
 
+from listening.prescreen import build_term_stats
+from listening.passages import index_transcript
+from listening.comprehension import generate_questions
+from services.resilience import upstream, client_timeout, UpstreamError, UpstreamUnavailable
+from services.cassettes import cassette, body_size, body_placeholder
+
 
 load_dotenv()
 DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY")
+DEEPGRAM_URL = os.getenv("DEEPGRAM_URL", "https://api.deepgram.com/v1/listen")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
@@ -16,45 +24,108 @@ supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 router = APIRouter()
 
-async def transcribe_audio(audio_url: str) -> str:
+# Сколько подкастов одновременно скачиваем и отправляем в Deepgram
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", 3))
+
+async def transcribe_audio(audio_url: str, session: aiohttp.ClientSession) -> str:
     """Асинхронно расшифровывает аудио через Deepgram."""
     headers = {"Authorization": f"Token {DEEPGRAM_API_KEY}"}
     params = {"model": "general", "tier": "base", "language": "en"}
-    
-    async with aiohttp.ClientSession() as session:
+
+    async def download() -> bytes:
         async with session.get(audio_url) as audio_resp:
             if audio_resp.status != 200:
                 raise HTTPException(status_code=500, detail=f"Ошибка загрузки аудиофайла: {await audio_resp.text()}")
-            
-            audio_data = await audio_resp.read()
-            async with session.post("https://api.deepgram.com/v1/listen", headers=headers, params=params, data=audio_data) as resp:
-                if resp.status != 200:
-                    raise HTTPException(status_code=500, detail=f"Ошибка Deepgram API: {await resp.text()}")
-                
-                result = await resp.json()
-    
+
+            return await audio_resp.read()
+
+    audio_data = await cassette.intercept(
+        "http", "audio", {"url": audio_url}, download, encode=body_size, decode=body_placeholder
+    )
+
+    async def send_to_deepgram():
+        async with session.post(DEEPGRAM_URL, headers=headers, params=params, data=audio_data) as resp:
+            if resp.status != 200:
+                raise UpstreamError(f"Ошибка Deepgram API: {await resp.text()}")
+            return await resp.json()
+
+    # Дедлайн, breaker и общий лимит одновременных запросов к Deepgram
+    result = await upstream("deepgram").call(send_to_deepgram, request={"audio_url": audio_url, **params})
+
     return result.get("results", {}).get("channels", [{}])[0].get("alternatives", [{}])[0].get("transcript", "")
 
+async def transcribe_one(podcast: dict, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore) -> dict:
+    """Транскрибирует один подкаст и возвращает его статус вместо исключения."""
+    title = podcast.get("title", "")
+    audio_url = podcast.get("audio_url")
+    if not audio_url:
+        return {"title": title, "status": "error", "error": "Нет audio_url"}
+
+    async with semaphore:
+        try:
+            transcript = await transcribe_audio(audio_url, session)
+        except HTTPException as e:
+            return {"title": title, "status": "error", "error": e.detail}
+        except (UpstreamError, UpstreamUnavailable) as e:
+            return {"title": title, "status": "error", "error": str(e)}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return {"title": title, "status": "error", "error": f"Ошибка сети: {str(e)}"}
+
+    if not transcript.strip():
+        return {"title": title, "status": "empty"}
+
+    # Вопросы на понимание генерируем один раз при транскрипции
+    questions = await generate_questions(transcript)
+    return {"title": title, "status": "ok", "transcript": transcript, "questions": questions}
+
 async def process_podcasts(user_id: str, podcasts: list, topic: str):
-    """Обрабатывает список подкастов: транскрибирует и сохраняет в Supabase."""
-    tasks = [transcribe_audio(podcast["audio_url"]) for podcast in podcasts]
-    transcripts = await asyncio.gather(*tasks)
-    
-    for podcast, transcript in zip(podcasts, transcripts):
-        supabase.from_("user_transcripts").insert({
+    """Пакетно транскрибирует подкасты (не больше TRANSCRIBE_CONCURRENCY одновременно)
+    и сохраняет успешные транскрипции в Supabase одной вставкой."""
+    semaphore = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=TRANSCRIBE_CONCURRENCY * 2)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout("deepgram")) as session:
+        results = await asyncio.gather(*[
+            transcribe_one(podcast, session, semaphore) for podcast in podcasts
+        ])
+
+    # Одна вставка дала бы всем строкам одно now(), а читатели (check_answer, /questions)
+    # сопоставляют ответы с подкастами по порядку created_at — метки строго растут по порядку подкастов
+    saved_at = datetime.now(timezone.utc)
+    successful = [result for result in results if result["status"] == "ok"]
+    rows = [
+        {
             "id": str(uuid4()),
             "user_id": user_id,
-            "podcast_title": podcast["title"],
-            "transcript": transcript,
-            "topic": topic,  
-            "created_at": "now()"
-        }).execute()
-    
-    return {"message": "Транскрипции сохранены!"}
+            "podcast_title": result["title"],
+            "transcript": result["transcript"],
+            "term_stats": build_term_stats(result["transcript"]),
+            "questions": result["questions"],
+            "topic": topic,
+            "created_at": (saved_at + timedelta(milliseconds=number)).isoformat()
+        }
+        for number, result in enumerate(successful)
+    ]
+
+    # Одна многострочная вставка вместо insert на каждый подкаст
+    if rows:
+        supabase.from_("user_transcripts").insert(rows).execute()
+        for row in rows:
+            index_transcript(row["id"], row["transcript"])
+
+    return {
+        "message": "Транскрипции сохранены!" if rows else "Ни одну транскрипцию сохранить не удалось",
+        "saved": len(rows),
+        "results": [
+            {key: value for key, value in result.items() if key not in ("transcript", "questions")}
+            for result in results
+        ]
+    }
 
 @router.post("/transcribe_podcasts")
 async def transcribe_podcasts(user_id: str, topic: str, podcasts: list):
-    """Запускает транскрипцию подкастов и сохраняет в Supabase."""
+    """Запускает транскрипцию подкастов и сохраняет в Supabase.
+    Ошибка одного подкаста не отменяет остальные — статус возвращается по каждому."""
     try:
         return await process_podcasts(user_id, podcasts, topic)
     except Exception as e:
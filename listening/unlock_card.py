@@ -2,8 +2,12 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from supabase import create_client, Client
 import os
+import logging
 from dotenv import load_dotenv
 
+from services.logs import fields
+from services.profile_cache import profiles
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -12,10 +16,14 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # Указываем максимальный `unlocked_level`
 MAX_UNLOCK_LEVEL = 3  # Не уйдет выше 3
 
+# Сколько верных ответов подряд нужно для новой карточки
+REQUIRED_STREAK = 3
+
 
 class UnlockRequest(BaseModel):
     user_id: str
@@ -23,49 +31,42 @@ class UnlockRequest(BaseModel):
 @router.post("/unlock_card")
 async def unlock_new_card(request: UnlockRequest):
     try:
-        # Получаем текущий `unlocked_level`
-        user_progress = supabase.from_("users_progress").select("level, unlocked_level").eq("user_id", request.user_id).single().execute()
-        
-        if not user_progress.data:
-            raise HTTPException(status_code=404, detail="Пайдаланушы табылған жоқ.")
-        
-        user_level = user_progress.data["level"]
-        unlocked_level = user_progress.data["unlocked_level"]
-
-        print(f"Пользователь: {request.user_id} | Уровень: {user_level} | Открытый уровень: {unlocked_level}")
-
-        
-        if unlocked_level >= MAX_UNLOCK_LEVEL:
+        # Все карточки уже открыты — по кэшу профиля отвечаем без обращения к БД.
+        # Только если профиль уже в кэше: загрузка ради проверки стоила бы лишнего запроса перед RPC
+        profile = profiles.peek(request.user_id)
+        if profile and profile["unlocked_level"] >= MAX_UNLOCK_LEVEL:
             return {"message": f"Сіз барлық карточкаларды аштыңыз! ({MAX_UNLOCK_LEVEL})"}
 
-        # Получаются последние 3 `success`
-        response = (
-            supabase.from_("user_transcripts")
-            .select("success")
-            .eq("user_id", request.user_id)
-            .order("created_at", desc=True)
-            .limit(3)
-            .execute()
-        )
-        
-        success_values = [item["success"] for item in response.data]
+        # Проверка серии и открытие карточки — один атомарный вызов в БД
+        # (функция unlock_next_card, sql/003_listening_success_streak.sql)
+        response = supabase.rpc("unlock_next_card", {
+            "p_user_id": request.user_id,
+            "p_max_level": MAX_UNLOCK_LEVEL,
+            "p_required": REQUIRED_STREAK
+        }).execute()
+
+        if not response.data:
+            raise HTTPException(status_code=404, detail="Пайдаланушы табылған жоқ.")
 
-        print(f"Последние 3 `success` значения: {success_values}")
+        result = response.data[0]
+        unlocked_level = result["unlocked_level"]
 
-        # Проверяем все ли три ответа успешные true
-        if len(success_values) == 3 and all(success_values):
-            print("Все 3 ответа верные, открываем новую карточку!")
+        logger.info("Проверка открытия карточки", extra=fields(
+            user_id=request.user_id, unlocked=result["unlocked"], unlocked_level=unlocked_level
+        ))
 
-            new_unlocked_level = min(unlocked_level + 1, MAX_UNLOCK_LEVEL)
+        if result["unlocked"]:
+            # unlocked_level изменился — сбрасываем профиль во всех воркерах
+            await profiles.invalidate(request.user_id)
+            return {"message": f"Жаңа карта ашылды! Сіздің жаңа деңгейіңіз: {unlocked_level}"}
 
-            update_response = supabase.from_("users_progress").update({"unlocked_level": new_unlocked_level}).eq("user_id", request.user_id).execute()
+        if unlocked_level >= MAX_UNLOCK_LEVEL:
+            return {"message": f"Сіз барлық карточкаларды аштыңыз! ({MAX_UNLOCK_LEVEL})"}
 
-            print(f" Обновлен `unlocked_level`: {new_unlocked_level} | Ответ от Supabase: {update_response}")
+        return {"message": "Сіз барлық сұрақтарға дұрыс жауап берген жоқсыз."}
 
-            return {"message": f"Жаңа карта ашылды! Сіздің жаңа деңгейіңіз: {new_unlocked_level}"}
-        else:
-            return {"message": "Сіз барлық сұрақтарға дұрыс жауап берген жоқсыз."}
-    
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Қате: {str(e)}")
+        logger.error("Ошибка unlock_card", extra=fields(error=str(e)))
         raise HTTPException(status_code=500, detail=f"Қате: {str(e)}")
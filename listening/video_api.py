@@ -1,62 +1,235 @@
 import os
+import random
+import asyncio
+import logging
 import aiohttp
+from datetime import datetime, timezone
 from supabase import create_client
 from dotenv import load_dotenv
 from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import JSONResponse
 import html
 import re
 
+from services.resilience import upstream, client_timeout, UpstreamError, UpstreamUnavailable
+from services.profile_cache import profiles
+from services.storage import storage
+from services.shared_state import state
+from services.single_flight import flights
+from services.db_budget import detached
+from services.logs import fields, setup_logging, stop_logging
+from services.response_cache import ResponseCache
+from services.metrics import registry
+from services.responses import FastJSONResponse
+
 load_dotenv()
 
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
+YOUTUBE_SEARCH_URL = os.getenv("YOUTUBE_SEARCH_URL", "https://www.googleapis.com/youtube/v3/search")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+VIDEO_CATALOG_REFRESH = os.getenv("VIDEO_CATALOG_REFRESH", "false").lower() == "true"
+VIDEO_CATALOG_REFRESH_HOURS = float(os.getenv("VIDEO_CATALOG_REFRESH_HOURS", 24))
+# Уровни × (темы + поиск без темы) = число поисков за обновление, по 100 единиц квоты каждый
+CATALOG_TOPICS = os.getenv(
+    "VIDEO_CATALOG_TOPICS",
+    "daily routine,travel,food,work,education,health,technology,environment,sport,music,family,shopping"
+).split(",")
+CATALOG_LEVELS = os.getenv("VIDEO_CATALOG_LEVELS", "A1,A2,B1,B2,C1,C2").split(",")
+CATALOG_RESULTS = 25      # Видео с одного поиска при обновлении каталога
+CATALOG_POOL = 50         # Из скольких свежих видео каталога выбираем случайные
+VIDEOS_PER_RESPONSE = 5
+
+YOUTUBE_SEARCH_COST = 100  # Единиц квоты YouTube Data API за один search.list
+VIDEO_CACHE_TTL = float(os.getenv("VIDEO_CACHE_TTL", 6 * 3600))
+VIDEO_CACHE_STALE = float(os.getenv("VIDEO_CACHE_STALE", 24 * 3600))
+
+video_cache = ResponseCache("youtube_videos", VIDEO_CACHE_TTL, VIDEO_CACHE_STALE)
+quota_saved = registry.counter(
+    "youtube_quota_saved_units_total", "Единицы квоты YouTube, сэкономленные кэшем /listening/videos", ())
+
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# "Невидимые" или "мусорные" символы, кроме emoji и ASCII — компилируем один раз
+JUNK_CHARS = re.compile(r'[^\x00-\x7F\u1F300-\u1F6FF\u2600-\u26FF]+')
+
 
 # 🔧 Очищаем название видео от мусора и неотображаемых символов
+# (вызывается при разборе ответа YouTube, до кэша — не на каждый запрос)
 def clean_title(title: str) -> str:
     title = html.unescape(title)  # Декодируем HTML сущности (&amp; -> & и т.д.)
-    
-    # Удаляем "невидимые" или "мусорные" символы, кроме emoji и ASCII
-    title = re.sub(r'[^\x00-\x7F\u1F300-\u1F6FF\u2600-\u26FF]+', '', title)
-
+    title = JUNK_CHARS.sub('', title)
     return title.strip()
 
 
-# 🔍 Получение видео с YouTube API
-async def fetch_youtube_videos(user_level, topic=None):
+# 🔍 Поиск видео в YouTube API (100 единиц квоты на запрос, независимо от maxResults)
+def youtube_query(user_level, topic=None) -> str:
     query = f"English listening {user_level}"
     if topic:
         query += f" {topic}"
+    return query
+
 
+async def search_youtube(query: str, max_results: int = 5) -> dict:
     url = (
-        f"https://www.googleapis.com/youtube/v3/search?part=snippet&q={query}&"
-        f"type=video&videoDuration=short&maxResults=5&key={YOUTUBE_API_KEY}"
+        f"{YOUTUBE_SEARCH_URL}?part=snippet&q={query}&"
+        f"type=video&videoDuration=short&maxResults={max_results}&key={YOUTUBE_API_KEY}"
     )
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                raise HTTPException(status_code=500, detail=f"Ошибка YouTube API: {await response.text()}")
-            
-            data = await response.json()
-            videos = []
-            for item in data.get("items", []):
-                video_id = item["id"].get("videoId")
-                raw_title = item["snippet"].get("title", "Без названия")
-                title = clean_title(raw_title)
-
-                if video_id:
-                    videos.append({
-                        "title": title,
-                        "video_url": f"https://www.youtube.com/watch?v={video_id}",
-                        "level": user_level
-                    })
-            return videos
+
+    async def search():
+        async with aiohttp.ClientSession(timeout=client_timeout("youtube")) as session:
+            async with session.get(url) as response:
+                if response.status != 200:
+                    raise UpstreamError(f"Ошибка YouTube API: {await response.text()}")
+                return await response.json()
+
+    # Дедлайн, breaker и bulkhead; если YouTube недоступен — последний удачный результат по этому запросу
+    return await upstream("youtube").call(search, cache_key=(query, max_results))
+
+
+def parse_videos(data: dict, user_level) -> list:
+    videos = []
+    for item in data.get("items", []):
+        video_id = item["id"].get("videoId")
+        raw_title = item["snippet"].get("title", "Без названия")
+        title = clean_title(raw_title)
+
+        if video_id:
+            videos.append({
+                "title": title,
+                "video_url": f"https://www.youtube.com/watch?v={video_id}",
+                "level": user_level
+            })
+    return videos
+
+
+async def search_videos(user_level, topic=None) -> list:
+    try:
+        data = await search_youtube(youtube_query(user_level, topic))
+    except (UpstreamError, UpstreamUnavailable) as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return parse_videos(data, user_level)
+
+
+# Одинаковый (уровень, тема) часами возвращает одни и те же видео — держим уже очищенный
+# результат в кэше (память воркера + общее хранилище) со stale-while-revalidate
+async def fetch_youtube_videos(user_level, topic=None):
+    topic = normalize_topic(topic)
+    videos, result = await video_cache.get((user_level, topic), lambda: search_videos(user_level, topic))
+    # stale-ответ запускает фоновый поиск, поэтому квоту экономит только hit
+    if result == "hit":
+        quota_saved.inc(amount=YOUTUBE_SEARCH_COST)
+    return videos
+
+
+# 📚 Каталог видео в listening_content (sql/007_listening_content_catalog.sql).
+# Фоновая задача (или `python -m listening.video_api` по cron) заранее собирает видео
+# по каждому уровню и теме из VIDEO_CATALOG_TOPICS; /videos отдаёт случайные видео
+# из каталога и ходит в YouTube только при промахе — найденное тоже попадает в каталог.
+def normalize_topic(topic) -> str:
+    return " ".join((topic or "").lower().split())
+
+
+def catalog_rows(videos: list, topic: str, query: str) -> list:
+    harvested_at = datetime.now(timezone.utc).isoformat()
+    rows = {}
+    for video in videos:
+        # Одно видео — одна строка, даже если поиск вернул его дважды
+        rows[video["video_url"]] = {
+            **video,
+            "video_id": video["video_url"].rsplit("v=", 1)[-1],
+            "topic": topic,
+            "required_words": 50,
+            "source_query": query,
+            "harvested_at": harvested_at,
+        }
+    return list(rows.values())
+
+
+async def catalog_videos(user_level, topic=None) -> list:
+    rows = await storage.catalog_videos(user_level, normalize_topic(topic), CATALOG_POOL)
+    return random.sample(rows, min(VIDEOS_PER_RESPONSE, len(rows)))
+
+
+async def remember_videos(user_level, topic, videos: list):
+    topic = normalize_topic(topic)
+    try:
+        await storage.upsert_catalog_videos(catalog_rows(videos, topic, youtube_query(user_level, topic)))
+    except Exception as e:
+        logger.warning("⚠️ Не удалось сохранить видео в каталог", extra=fields(level=user_level, topic=topic, error=str(e)))
+
+
+async def harvest(user_level, topic: str, summary: dict):
+    """Поиск по одной теме и запись найденного в каталог; ошибки считаются в summary."""
+    query = youtube_query(user_level, topic)
+    summary["searches"] += 1
+    try:
+        videos = parse_videos(await search_youtube(query, max_results=CATALOG_RESULTS), user_level)
+    except (UpstreamError, UpstreamUnavailable) as e:
+        summary["failed"] += 1
+        logger.warning("⚠️ Ошибка поиска видео для каталога", extra=fields(level=user_level, topic=topic, error=str(e)))
+        return
+    if not videos:
+        return
+    try:
+        await storage.upsert_catalog_videos(catalog_rows(videos, topic, query))
+    except Exception as e:
+        # Ошибка БД (PostgREST/asyncpg) по одной теме не прерывает обход остальных
+        summary["storage_failed"] += 1
+        logger.warning("⚠️ Ошибка записи каталога видео", extra=fields(level=user_level, topic=topic, error=str(e)))
+        return
+    summary["videos"] += len(videos)
+
+
+async def refresh_catalog() -> dict:
+    """Обходит все уровни и темы каталога. Ошибка одной темы (поиск или запись) не останавливает остальные."""
+    summary = {"searches": 0, "videos": 0, "failed": 0, "storage_failed": 0}
+    topics = [""] + [normalize_topic(topic) for topic in CATALOG_TOPICS if topic.strip()]
+    for user_level in CATALOG_LEVELS:
+        for topic in topics:
+            await harvest(user_level, topic, summary)
+    logger.info("📚 Каталог видео обновлён", extra=fields(**summary))
+    return summary
+
+
+class CatalogRefresher:
+    """Периодическое обновление каталога. Между воркерами обновление идёт не чаще
+    раза в interval: общий token bucket в services/shared_state.py."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        while True:
+            allowed, retry_after = await state.token_bucket("video_catalog_refresh", 1, 1 / self.interval)
+            if allowed:
+                try:
+                    with detached():
+                        await refresh_catalog()
+                except Exception as e:
+                    logger.error("Ошибка обновления каталога видео", extra=fields(error=str(e)))
+                retry_after = self.interval
+            await asyncio.sleep(retry_after)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+catalog_refresher = CatalogRefresher(VIDEO_CATALOG_REFRESH_HOURS * 3600)
 
 
 # 🔗 GET /videos
@@ -66,17 +239,31 @@ async def get_videos(user_id: str, topic: str = Query(None)):
         if not user_id:
             raise HTTPException(status_code=400, detail="user_id обязателен")
         
-        response = supabase.from_("users_progress").select("level").eq("user_id", user_id).single().execute()
-        if not response.data:
+        user_level = await profiles.get_level(user_id)
+        if not user_level:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        user_level = response.data["level"]
-        videos = await fetch_youtube_videos(user_level, topic)
+        videos = await catalog_videos(user_level, topic)
+        if not videos:
+            # Промах каталога — живой поиск; результат сохраняем в фоне, следующий запрос попадёт в каталог
+            videos = await fetch_youtube_videos(user_level, topic)
+            if videos:
+                with detached():
+                    flights.launch(
+                        ("remember_videos", user_level, normalize_topic(topic)),
+                        lambda: remember_videos(user_level, topic, videos)
+                    )
         
         if not videos:
-            return JSONResponse(content={"videos": [], "message": "Видео не найдены. Попробуйте изменить тему."}, media_type="application/json; charset=utf-8")
+            return FastJSONResponse(content={"videos": [], "message": "Видео не найдены. Попробуйте изменить тему."})
         
-        return JSONResponse(content={"videos": videos}, media_type="application/json; charset=utf-8")
+        return FastJSONResponse(content={"videos": videos})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    print(asyncio.run(refresh_catalog()))
+    stop_logging()
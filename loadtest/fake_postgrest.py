@@ -0,0 +1,266 @@
+import json
+import threading
+from uuid import uuid4
+from datetime import datetime, timezone
+
+# Таблицы Supabase в памяти и разбор запросов PostgREST в том объёме,
+# в котором их строит postgrest-py в этом проекте: фильтры eq/neq/gt/gte/lt/lte/in/is,
+# select по колонкам, order, limit/offset, single(), insert/upsert/update/delete и две RPC.
+# Фильтр or=(...) (курсор /get_history) не поддерживается и игнорируется.
+
+# Первичные ключи — для upsert без on_conflict
+PRIMARY_KEYS = {
+    "users_progress": ("user_id",),
+    "user_topics": ("user_id", "topic"),
+    "word_translations": ("word",),
+}
+
+LEVELS = ["A1", "A2", "B1", "B2", "C1"]
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def parse_value(raw: str):
+    if raw.startswith('"') and raw.endswith('"'):
+        return raw[1:-1]
+    return raw
+
+
+def as_text(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return "" if value is None else str(value)
+
+
+def compare(value, operator: str, raw: str) -> bool:
+    if operator == "is":
+        if raw == "null":
+            return value is None
+        return as_text(value) == raw
+    if operator == "in":
+        options = [parse_value(item.strip()) for item in raw.strip("()").split(",") if item.strip()]
+        return as_text(value) in options
+    if value is None:
+        return False
+    expected = parse_value(raw)
+    text = as_text(value)
+    if operator == "eq":
+        return text == expected
+    if operator == "neq":
+        return text != expected
+    # Сравнение чисел как чисел, остальное (даты ISO, строки) — как строк
+    try:
+        left, right = float(text), float(expected)
+    except ValueError:
+        left, right = text, expected
+    return {
+        "gt": left > right,
+        "gte": left >= right,
+        "lt": left < right,
+        "lte": left <= right,
+    }.get(operator, True)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def table(self, name: str) -> list:
+        return self.tables.setdefault(name, [])
+
+    # ---------- Данные для нагрузочного прогона ----------
+
+    def seed_catalog(self, topics_per_level: int = 20, words: int = 50):
+        with self.lock:
+            for level in LEVELS:
+                for i in range(topics_per_level):
+                    self.table("topics_by_level").append({"level": level, "topic": f"{level} topic {i}"})
+            for i in range(words):
+                self.table("vocabulary_super").append({
+                    "id": i + 1, "word": f"word{i}", "level": LEVELS[i % len(LEVELS)]
+                })
+
+    def seed_user(self, user_id: str, level: str = "B1"):
+        with self.lock:
+            self.table("users_basic").append({"id": user_id, "email": f"{user_id}@example.com"})
+            self.table("users_progress").append({
+                "user_id": user_id, "level": level, "unlocked_level": 0, "success_streak": 0
+            })
+            for word_id in (1, 2, 3):
+                self.table("user_vocabulary_progress").append({
+                    "user_id": user_id, "word_id": word_id, "is_read": True
+                })
+
+    # ---------- Разбор запроса ----------
+
+    @staticmethod
+    def split_params(query: list) -> tuple:
+        """query — список (ключ, значение). Возвращает (фильтры, служебные параметры)."""
+        filters, options = [], {}
+        for key, value in query:
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                options[key] = value
+            elif key in ("or", "and"):
+                continue
+            else:
+                operator, _, raw = value.partition(".")
+                negate = operator == "not"
+                if negate:
+                    operator, _, raw = raw.partition(".")
+                filters.append((key, operator, raw, negate))
+        return filters, options
+
+    @staticmethod
+    def matches(row: dict, filters: list) -> bool:
+        for column, operator, raw, negate in filters:
+            if compare(row.get(column), operator, raw) == negate:
+                return False
+        return True
+
+    @staticmethod
+    def project(rows: list, select: str) -> list:
+        if not select or select.strip() == "*":
+            return [dict(row) for row in rows]
+        columns = [column.strip() for column in select.split(",") if column.strip()]
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    @staticmethod
+    def sort(rows: list, order: str) -> list:
+        # order=updated_at.desc,topic.desc — применяем ключи с конца (устойчивая сортировка)
+        for part in reversed([p for p in order.split(",") if p]):
+            column, *modifiers = part.split(".")
+            descending = "desc" in modifiers
+            rows.sort(key=lambda row: (row.get(column) is None, as_text(row.get(column))), reverse=descending)
+        return rows
+
+    def fill_defaults(self, table: str, row: dict) -> dict:
+        row = {key: (now_iso() if value == "now()" else value) for key, value in row.items()}
+        if table not in PRIMARY_KEYS:
+            row.setdefault("id", str(uuid4()))
+        if table in ("user_transcripts", "chat_history"):
+            row.setdefault("created_at", now_iso())
+        return row
+
+    # ---------- Операции ----------
+
+    def select(self, table: str, query: list) -> list:
+        filters, options = self.split_params(query)
+        with self.lock:
+            rows = [row for row in self.table(table) if self.matches(row, filters)]
+        if "order" in options:
+            rows = self.sort(rows, options["order"])
+        offset = int(options.get("offset", 0))
+        if "limit" in options:
+            rows = rows[offset:offset + int(options["limit"])]
+        elif offset:
+            rows = rows[offset:]
+        return self.project(rows, options.get("select"))
+
+    def insert(self, table: str, query: list, body, upsert: bool) -> list:
+        _, options = self.split_params(query)
+        rows = body if isinstance(body, list) else [body]
+        keys = tuple(options["on_conflict"].split(",")) if "on_conflict" in options else PRIMARY_KEYS.get(table, ("id",))
+        result = []
+        with self.lock:
+            data = self.table(table)
+            for row in rows:
+                row = self.fill_defaults(table, row)
+                existing = None
+                if upsert:
+                    existing = next((r for r in data if all(r.get(k) == row.get(k) for k in keys)), None)
+                if existing is not None:
+                    existing.update(row)
+                    result.append(dict(existing))
+                else:
+                    data.append(row)
+                    result.append(dict(row))
+        return result
+
+    def update(self, table: str, query: list, body: dict) -> list:
+        filters, _ = self.split_params(query)
+        result = []
+        with self.lock:
+            for row in self.table(table):
+                if self.matches(row, filters):
+                    row.update(body)
+                    result.append(dict(row))
+        return result
+
+    def delete(self, table: str, query: list) -> list:
+        filters, _ = self.split_params(query)
+        with self.lock:
+            data = self.table(table)
+            removed = [row for row in data if self.matches(row, filters)]
+            data[:] = [row for row in data if not self.matches(row, filters)]
+        return removed
+
+    def rpc(self, name: str, params: dict):
+        # Повторяет функции из sql/003_listening_success_streak.sql и sql/008_get_user_profile.sql
+        with self.lock:
+            progress = next((r for r in self.table("users_progress") if r["user_id"] == params.get("p_user_id")), None)
+            if name == "get_user_profile":
+                if progress is None:
+                    return None
+                basic = next((r for r in self.table("users_basic") if r["id"] == params["p_user_id"]), None)
+                return {
+                    "level": progress["level"],
+                    "unlocked_level": progress["unlocked_level"],
+                    "email": basic["email"] if basic else None,
+                }
+            if name == "record_listening_results":
+                if progress is None:
+                    return None
+                streak = progress.get("success_streak", 0)
+                for result in params.get("p_results", []):
+                    streak = streak + 1 if result else 0
+                progress["success_streak"] = streak
+                return streak
+            if name == "unlock_next_card":
+                if progress is None:
+                    return []
+                max_level = params["p_max_level"]
+                if progress.get("success_streak", 0) >= params.get("p_required", 3) and progress["unlocked_level"] < max_level:
+                    progress["unlocked_level"] = min(progress["unlocked_level"] + 1, max_level)
+                    progress["success_streak"] = 0
+                    return [{"unlocked": True, "unlocked_level": progress["unlocked_level"]}]
+                return [{"unlocked": False, "unlocked_level": progress["unlocked_level"]}]
+        raise KeyError(name)
+
+    def handle(self, method: str, path: str, query: list, headers: dict, body: bytes) -> tuple:
+        """Обрабатывает запрос к /rest/v1/... Возвращает (статус, JSON-совместимое тело)."""
+        self.requests += 1
+        target = path.split("/rest/v1/", 1)[-1].strip("/")
+        payload = json.loads(body) if body else None
+        prefer = headers.get("prefer", "")
+
+        if target.startswith("rpc/"):
+            try:
+                return 200, self.rpc(target[4:], payload or {})
+            except KeyError:
+                return 404, {"code": "PGRST202", "message": f"Could not find the function {target[4:]}", "details": None, "hint": None}
+
+        if method == "GET":
+            rows = self.select(target, query)
+        elif method == "POST":
+            rows = self.insert(target, query, payload, upsert="resolution=" in prefer)
+        elif method == "PATCH":
+            rows = self.update(target, query, payload or {})
+        elif method == "DELETE":
+            rows = self.delete(target, query)
+        else:
+            return 405, {"message": f"{method} not supported"}
+
+        if "vnd.pgrst.object" in headers.get("accept", ""):
+            if len(rows) != 1:
+                return 406, {
+                    "code": "PGRST116",
+                    "message": "JSON object requested, multiple (or no) rows returned",
+                    "details": f"The result contains {len(rows)} rows",
+                    "hint": None,
+                }
+            return 200, rows[0]
+        return (201 if method == "POST" else 200), rows
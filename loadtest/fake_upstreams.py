@@ -0,0 +1,246 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+
+from aiohttp import web
+
+from loadtest.fake_postgrest import FakeDatabase
+from services.smtp_stub import SMTPStub
+
+# Локальные заглушки всех внешних сервисов на одном HTTP-порту:
+#   /rest/v1/...                  — PostgREST (Supabase)
+#   /v1/chat/completions          — OpenAI (с задержкой и stream=true)
+#   /deepgram/v1/listen           — Deepgram
+#   /listennotes/api/v2/search    — ListenNotes (аудио ссылаются на /audio/...)
+#   /youtube/v3/search            — YouTube Data API
+#   /translate/v2                 — Google Translate
+# плюс SMTPStub для писем. Работают в отдельном потоке со своим event loop:
+# клиент Supabase синхронный и блокирует loop приложения, поэтому заглушки
+# не могут жить в том же loop.
+
+# Задержки по умолчанию (мс) — порядок величин реальных сервисов
+DEFAULT_LATENCY_MS = {
+    "postgrest": 3,
+    "openai": 400,
+    "deepgram": 800,
+    "listennotes": 150,
+    "youtube": 100,
+    "translate": 40,
+    "audio": 20,
+}
+
+TRANSCRIPT = (
+    "Welcome to the English learning podcast. Today we talk about daily routines. "
+    "Many people wake up early and drink a cup of coffee before work. "
+    "A healthy breakfast gives you energy for the whole morning. "
+    "Some students practice new words on the bus and listen to podcasts. "
+    "In the evening it is a good idea to read a short story in English. "
+    "Regular practice is the key to learning a language quickly."
+)
+
+QUESTIONS = {
+    "questions": [
+        {"question": "What do many people drink before work?",
+         "answer": "They drink a cup of coffee.", "key_facts": ["cup of coffee", "before work"]},
+        {"question": "What gives you energy for the morning?",
+         "answer": "A healthy breakfast gives energy.", "key_facts": ["healthy breakfast", "energy"]},
+        {"question": "What is the key to learning a language?",
+         "answer": "Regular practice is the key.", "key_facts": ["regular practice"]},
+    ]
+}
+
+ARTICLE = " ".join(
+    ["Language acquisition has long been a subject of academic inquiry."] +
+    ["Researchers observe that sustained exposure to authentic material improves comprehension."] * 20
+)
+
+
+def fake_completion(messages: list) -> str:
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    user = next((m["content"] for m in messages if m["role"] == "user"), "")
+    if "comprehension questions" in system:
+        return json.dumps(QUESTIONS)
+    if "JSON" in system or "JSON" in user:
+        # Проверка ответа: результат детерминирован по тексту запроса
+        correct = int(hashlib.sha256(user.encode("utf-8")).hexdigest(), 16) % 2 == 0
+        return json.dumps({"correct": correct, "feedback": "" if correct else "Жауап толық емес."}, ensure_ascii=False)
+    if "IELTS" in system or "IELTS" in user:
+        return ARTICLE
+    return "Hi! 😊 Let's practice English today. What would you like to talk about?"
+
+
+class FakeUpstreams:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: dict = None,
+                 latency_scale: float = 1.0, jitter: float = 0.2):
+        self.host = host
+        self.port = port
+        self.latency_ms = {**DEFAULT_LATENCY_MS, **(latency_ms or {})}
+        self.latency_scale = latency_scale
+        self.jitter = jitter
+        self.db = FakeDatabase()
+        self.smtp = SMTPStub(host)
+        self.calls = {}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def env(self) -> dict:
+        """Переменные окружения, направляющие приложение на заглушки."""
+        return {
+            "SUPABASE_URL": self.base_url,
+            "SUPABASE_KEY": "loadtest.fake.key",
+            "OPENAI_API_BASE": f"{self.base_url}/v1",
+            "OPENAI_API_KEY": "sk-loadtest",
+            "DEEPGRAM_URL": f"{self.base_url}/deepgram/v1/listen",
+            "DEEPGRAM_API_KEY": "loadtest",
+            "LISTENNOTES_SEARCH_URL": f"{self.base_url}/listennotes/api/v2/search",
+            "LISTEN_API_KEY": "loadtest",
+            "YOUTUBE_SEARCH_URL": f"{self.base_url}/youtube/v3/search",
+            "YOUTUBE_API_KEY": "loadtest",
+            "GOOGLE_TRANSLATE_URL": f"{self.base_url}/translate/v2",
+            "GOOGLE_TRANSLATE_API": "loadtest",
+            "MAIL_SERVER": self.smtp.host,
+            "MAIL_PORT": str(self.smtp.port),
+            "MAIL_SSL_TLS": "false",
+            "MAIL_USERNAME": "loadtest@example.com",
+            "MAIL_PASSWORD": "loadtest",
+            "MAIL_FROM": "loadtest@example.com",
+            "JWT_SECRET_KEY": "loadtest",
+            "LLM_BACKEND": "openai",
+        }
+
+    async def delay(self, service: str):
+        self.calls[service] = self.calls.get(service, 0) + 1
+        latency = self.latency_ms.get(service, 0) * self.latency_scale
+        if latency:
+            latency *= 1 + random.uniform(-self.jitter, self.jitter)
+            await asyncio.sleep(latency / 1000)
+
+    # ---------- Обработчики ----------
+
+    async def postgrest(self, request: web.Request) -> web.Response:
+        await self.delay("postgrest")
+        body = await request.read()
+        headers = {key.lower(): value for key, value in request.headers.items()}
+        status, payload = self.db.handle(request.method, request.path, list(request.query.items()), headers, body)
+        return web.json_response(payload, status=status)
+
+    async def openai(self, request: web.Request) -> web.StreamResponse:
+        data = await request.json()
+        content = fake_completion(data.get("messages", []))
+        prompt_tokens = sum(len(m.get("content") or "") for m in data.get("messages", [])) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+
+        if not data.get("stream"):
+            await self.delay("openai")
+            return web.json_response({
+                "id": f"chatcmpl-{random.getrandbits(48):x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": data.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            })
+
+        # stream=true: задержка до первого токена, затем куски по словам (SSE)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await self.delay("openai")
+        words = content.split(" ")
+        per_chunk = self.latency_ms.get("openai_chunk", 10) * self.latency_scale / 1000
+        for i, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-stream", "object": "chat.completion.chunk", "model": data.get("model"),
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(per_chunk)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def deepgram(self, request: web.Request) -> web.Response:
+        await request.read()
+        await self.delay("deepgram")
+        return web.json_response({"results": {"channels": [{"alternatives": [{"transcript": TRANSCRIPT}]}]}})
+
+    async def listennotes(self, request: web.Request) -> web.Response:
+        await self.delay("listennotes")
+        query = request.query.get("q", "")
+        results = [{
+            "title_original": f"{query} episode {i}",
+            "description_original": "Learn English with short lessons and practice every day.",
+            "audio_length_sec": 300 + i,
+            "audio": f"{self.base_url}/audio/{i}.mp3",
+            "image": f"{self.base_url}/audio/{i}.jpg",
+        } for i in range(5)]
+        return web.json_response({"results": results})
+
+    async def audio(self, request: web.Request) -> web.Response:
+        await self.delay("audio")
+        return web.Response(body=b"\xff\xfb" + b"\x00" * 2046, content_type="audio/mpeg")
+
+    async def youtube(self, request: web.Request) -> web.Response:
+        await self.delay("youtube")
+        query = request.query.get("q", "")
+        items = [{"id": {"videoId": f"vid{i:08d}"}, "snippet": {"title": f"{query} &amp; video {i}"}} for i in range(5)]
+        return web.json_response({"items": items})
+
+    async def translate(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        await self.delay("translate")
+        return web.json_response({"data": {"translations": [{"translatedText": f"{data.get('q')} ({data.get('target')})"}]}})
+
+    # ---------- Запуск в отдельном потоке ----------
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_route("*", "/rest/v1/{tail:.*}", self.postgrest)
+        app.router.add_post("/v1/chat/completions", self.openai)
+        app.router.add_post("/deepgram/v1/listen", self.deepgram)
+        app.router.add_get("/listennotes/api/v2/search", self.listennotes)
+        app.router.add_get("/audio/{name}", self.audio)
+        app.router.add_get("/youtube/v3/search", self.youtube)
+        app.router.add_post("/translate/v2", self.translate)
+        return app
+
+    async def _serve(self):
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        await self.smtp.start()
+        self._ready.set()
+
+    def start(self) -> "FakeUpstreams":
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._serve())
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-upstreams", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            await self.smtp.stop()
+            await self._runner.cleanup()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
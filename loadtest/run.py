@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+from uuid import uuid4
+
+import httpx
+
+from loadtest.fake_upstreams import FakeUpstreams
+
+# Нагрузочный прогон полностью офлайн: main.app поднимается в uvicorn и ходит
+# только в локальные заглушки (loadtest/fake_upstreams.py).
+# Каждый виртуальный пользователь проходит сценарии по кругу, на каждый сценарий — новый user_id:
+#   get_topics → generate_article → translate ×3 → practice/start → chat ×2 →
+#   videos → podcasts → (ждём вопросы) → check_answer → unlock_card
+#
+#   python -m loadtest.run --users 20 --duration 60
+#   python -m loadtest.run --users 50 --journeys 2 --latency-scale 0.5 --json report.json
+#
+# Кассеты (services/cassettes.py): --record пишет ответы внешних сервисов в JSONL,
+# --replay отдаёт их из файла (с записанными задержками × --latency-scale) — в заглушки
+# тогда ходит только Supabase. Кассету можно записать и на боевых API и гонять прогон на ней.
+#   python -m loadtest.run --users 5 --journeys 1 --record cassettes/journey.jsonl
+#   python -m loadtest.run --users 50 --journeys 2 --replay cassettes/journey.jsonl
+
+TRANSCRIPTION_WAIT = 60  # Сколько секунд ждём фоновую транскрипцию подкастов
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # route -> [(статус, задержка)]
+        self.failed_journeys = 0
+        self.journeys = 0
+
+    def add(self, route: str, status: int, latency: float):
+        self.samples.setdefault(route, []).append((status, latency))
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        total = 0
+        for route, samples in sorted(self.samples.items()):
+            latencies = [latency for _, latency in samples]
+            statuses = {}
+            for status, _ in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            total += len(samples)
+            routes[route] = {
+                "requests": len(samples),
+                "errors": sum(1 for status, _ in samples if status >= 400 or status == 0),
+                "statuses": statuses,
+                "rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            }
+        return {
+            "elapsed_sec": round(elapsed, 2),
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 2) if elapsed else 0,
+            "journeys": self.journeys,
+            "failed_journeys": self.failed_journeys,
+            "routes": routes,
+        }
+
+
+async def call(client: httpx.AsyncClient, recorder: Recorder, method: str, route: str, name: str = None,
+               **kwargs) -> httpx.Response:
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, route, **kwargs)
+        status = response.status_code
+    except httpx.HTTPError:
+        response, status = None, 0
+    recorder.add(name or route, status, time.perf_counter() - start)
+    return response
+
+
+def ok(response) -> bool:
+    return response is not None and response.status_code < 400
+
+
+async def journey(client: httpx.AsyncClient, recorder: Recorder, fakes: FakeUpstreams):
+    user_id = str(uuid4())
+    fakes.db.seed_user(user_id)
+
+    response = await call(client, recorder, "POST", "/reading/get_topics", json={"user_id": user_id})
+    topics = response.json().get("topics") if ok(response) else None
+    if not topics:
+        return False
+    topic = topics[0]
+
+    response = await call(client, recorder, "POST", "/reading/generate_article", json={"user_id": user_id, "topic": topic})
+    if not ok(response):
+        return False
+    words = response.json()["article"].split()[:3]
+    for word in words:
+        await call(client, recorder, "POST", "/reading/translate_google", json={"word": word.strip(".,")})
+    await call(client, recorder, "POST", "/reading/mark_as_read", json={"user_id": user_id, "topic": topic})
+
+    await call(client, recorder, "POST", "/practice/start", json={"user_id": user_id})
+    for message in ("Hello! I want to practice.", "Мен ағылшынша сөйлегім келеді"):
+        await call(client, recorder, "POST", "/practice/chat", json={"user_id": user_id, "message": message})
+
+    listening_topic = "daily routine"
+    await call(client, recorder, "GET", "/listening/videos", params={"user_id": user_id, "topic": listening_topic})
+    response = await call(client, recorder, "GET", "/listening/podcasts", params={"user_id": user_id, "topic": listening_topic})
+    if not ok(response):
+        return False
+
+    # Транскрипция идёт в фоне — ждём, пока появятся вопросы по трём подкастам
+    deadline = time.monotonic() + TRANSCRIPTION_WAIT
+    while time.monotonic() < deadline:
+        response = await call(client, recorder, "GET", "/listening/questions", params={"user_id": user_id, "topic": listening_topic})
+        if ok(response) and len(response.json()["podcasts"]) >= 3:
+            break
+        await asyncio.sleep(0.5)
+    else:
+        return False
+
+    answers = [
+        "People drink a cup of coffee before work.",
+        "A healthy breakfast gives energy for the morning.",
+        "I think it is about music.",
+    ]
+    response = await call(client, recorder, "POST", "/listening/check_answer",
+                          json={"user_id": user_id, "topic": listening_topic, "answers": answers})
+    if not ok(response):
+        return False
+    await call(client, recorder, "POST", "/listening/unlock_card", json={"user_id": user_id})
+    await call(client, recorder, "GET", f"/statistic/user/{user_id}/stats", name="/statistic/user/{user_id}/stats")
+    return True
+
+
+async def virtual_user(client, recorder, fakes, stop_at: float, journeys: int):
+    done = 0
+    while time.monotonic() < stop_at and (journeys is None or done < journeys):
+        try:
+            success = await journey(client, recorder, fakes)
+        except Exception:
+            success = False
+        recorder.journeys += 1
+        if not success:
+            recorder.failed_journeys += 1
+        done += 1
+
+
+async def run(args) -> dict:
+    fakes = FakeUpstreams(
+        latency_ms={"openai": args.openai_latency_ms} if args.openai_latency_ms is not None else None,
+        latency_scale=args.latency_scale,
+    ).start()
+    fakes.db.seed_catalog()
+
+    # Модули приложения читают окружение при импорте — выставляем его до import main
+    os.environ.update(fakes.env())
+    os.environ.update({"LOG_LEVEL": args.log_level})
+    if args.record:
+        os.environ.update({"CASSETTE_MODE": "record", "CASSETTE_PATH": args.record})
+    elif args.replay:
+        # Темы и user_id в прогоне случайные — точного совпадения запросов не будет
+        os.environ.update({"CASSETTE_MODE": "replay", "CASSETTE_PATH": args.replay, "CASSETTE_MATCH": "nearest",
+                           "CASSETTE_LATENCY_SCALE": str(args.latency_scale)})
+    import uvicorn
+    import main
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+        start = time.monotonic()
+        stop_at = start + args.duration
+        await asyncio.gather(*[
+            virtual_user(client, recorder, fakes, stop_at, args.journeys) for _ in range(args.users)
+        ])
+        elapsed = time.monotonic() - start
+
+    server.should_exit = True
+    await server_task
+    fakes.stop()
+
+    report = recorder.report(elapsed)
+    report["upstream_calls"] = dict(fakes.calls)
+    report["db_requests"] = fakes.db.requests
+    if args.record or args.replay:
+        from services.cassettes import cassette
+        report["cassette"] = {"recorded": cassette.recorded, "replayed": cassette.replayed, "misses": cassette.misses}
+    return report
+
+
+def print_report(report: dict):
+    print(f"\nВремя: {report['elapsed_sec']} с | запросов: {report['requests']} | "
+          f"{report['throughput_rps']} rps | сценариев: {report['journeys']} (неудачных: {report['failed_journeys']})")
+    print(f"{'route':32} {'req':>6} {'err':>5} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, row in report["routes"].items():
+        print(f"{route:32} {row['requests']:>6} {row['errors']:>5} {row['rps']:>7} "
+              f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8}")
+    print(f"Вызовы заглушек: {report['upstream_calls']} | запросов к БД: {report['db_requests']}")
+    if "cassette" in report:
+        print(f"Кассета: {report['cassette']}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Офлайн нагрузочный прогон по пользовательским сценариям")
+    parser.add_argument("--users", type=int, default=10, help="Одновременных виртуальных пользователей")
+    parser.add_argument("--duration", type=float, default=60, help="Длительность прогона, с")
+    parser.add_argument("--journeys", type=int, default=None, help="Сценариев на пользователя (вместо длительности)")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Множитель задержек заглушек")
+    parser.add_argument("--openai-latency-ms", type=float, default=None, help="Задержка ответа OpenAI, мс")
+    parser.add_argument("--log-level", default="WARNING")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="PATH", help="Записать ответы внешних сервисов в кассету")
+    cassette.add_argument("--replay", metavar="PATH", help="Отдавать ответы внешних сервисов из кассеты")
+    parser.add_argument("--json", help="Сохранить отчёт в JSON-файл")
+    args = parser.parse_args()
+    if args.journeys is not None:
+        args.duration = float("inf")
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if report["failed_journeys"] else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
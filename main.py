@@ -1,32 +1,51 @@
+import importlib
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
   
 # Импортируем роутеры
 from routers import reset_password
+from routers import admin
 from listening.unlock_card import router as unlock_router
 from listening.check_answer import router as check_answer_router
 from listening.podcasts_api import router as podcasts_router
 from listening.video_api import router as videos_router
+from listening import video_api
 from listening.speech_to_text import router as speech_router
 from reading.article import router as article_router
 
 from statistic_for_user.statistic import router as statistic_user
 from reading.google_translate import router as google_translate_router
 from practice.chat import router as chat_router
+from practice.chat import chat_buffer
+from services.llm_gateway import llm
+from services import resilience
+from services.shared_state import state
+from services.single_flight import flights
+from services.metrics import registry, MetricsMiddleware, instrument_supabase
+from services.logs import setup_logging, stop_logging, RequestIdMiddleware
+from services import profiler
+from services.db_budget import DbBudgetMiddleware
+from services.cassettes import cassette
+from services.storage import storage
+from services.profile_cache import profiles
+from services.responses import FastJSONResponse, ResponseMiddleware
 
 
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from slowapi.middleware import SlowAPIMiddleware
 from slowapi.errors import RateLimitExceeded
-from fastapi.responses import JSONResponse
 
 
 
 
-app = FastAPI()
+# Логи пишутся в stderr фоновым потоком через очередь
+setup_logging()
+
+# Ответы по умолчанию — быстрый JSON (services/responses.py)
+app = FastAPI(default_response_class=FastJSONResponse)
 
 
 # Установлю лимит на отправку reset password для почт
@@ -36,7 +55,7 @@ app.add_middleware(SlowAPIMiddleware)
 
 @app.exception_handler(RateLimitExceeded)
 async def rate_limit_handler(request, exc):
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=429,
         content={"detail": "Сіз тым жиі сұраныс жібердіңіз. Кейінірек қайталап көріңіз."}
     )
@@ -61,6 +80,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Сжатие br/gzip и ETag/304 для GET — внутри метрик, чтобы 304 и сжатые ответы попадали в статистику
+app.add_middleware(ResponseMiddleware)
+
+# Число и время обращений к БД на запрос, бюджеты маршрутов
+app.add_middleware(DbBudgetMiddleware)
+# Профайлер запросов подключается, только если задан ADMIN_TOKEN или PROFILE_SAMPLE_RATE
+if profiler.enabled():
+    app.add_middleware(profiler.ProfilerMiddleware)
+# Метрики по маршрутам — снаружи всех слоёв, кроме request_id: учитывают всё время запроса
+# и статус, который ушёл клиенту (в том числе 500 от бюджета БД)
+app.add_middleware(MetricsMiddleware)
+# request_id для логов — снаружи всех остальных слоёв (добавлен последним)
+app.add_middleware(RequestIdMiddleware)
+
 # Подключаем все маршруты
 app.include_router(reset_password.router, prefix="/password", tags=["Password"])
 app.include_router(unlock_router, prefix="/listening", tags=["Unlock Card"])
@@ -73,8 +106,85 @@ app.include_router(article_router, prefix="/reading", tags=["Reading"])
 app.include_router(statistic_user, prefix="/statistic", tags=["Statistic"])
 app.include_router(google_translate_router, prefix="/reading", tags=["Translate"])
 app.include_router(chat_router, prefix="/practice", tags=["Chat"])
+app.include_router(admin.router, prefix="/admin", include_in_schema=False)
+
+
+# Фоновые воркеры: очередь писем сброса пароля и буфер записи истории чата.
+# При остановке письма дожидаются отправки, а буфер чата сбрасывается в БД
+@app.on_event("startup")
+async def start_background_workers():
+    await reset_password.outbox.start()
+    await chat_buffer.start()
+    await profiles.start()
+    if video_api.VIDEO_CATALOG_REFRESH:
+        await video_api.catalog_refresher.start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await chat_buffer.stop()
+    await video_api.catalog_refresher.stop()
+    await reset_password.outbox.stop()
+    await llm.close()
+    await state.close()
+    await storage.close()
+    cassette.close()
+    stop_logging()
+
+
+# Состояние circuit breaker'ов и счётчики по внешним сервисам
+@app.get("/health/upstreams", include_in_schema=False)
+async def upstreams_health():
+    return resilience.stats()
 
 
 @app.get("/")
 def root():
     return {"message": "FastAPI сервер работает!"}
+
+
+# 📊 Метрики Prometheus
+# Запросы к Supabase мерим во всех модулях, у которых свой клиент
+SUPABASE_MODULES = (
+    "routers.reset_password", "listening.unlock_card", "listening.check_answer",
+    "listening.podcasts_api", "listening.video_api", "listening.speech_to_text",
+    "reading.article", "statistic_for_user.statistic", "practice.chat", "services.storage",
+)
+for module_name in SUPABASE_MODULES:
+    instrument_supabase(importlib.import_module(module_name).supabase)
+
+registry.collected(
+    "upstream_circuit_state", "Состояние circuit breaker (1 — текущее)", ("upstream", "state"),
+    lambda: {
+        (name, state_name): int(item.breaker.state == state_name)
+        for name, item in resilience.UPSTREAMS.items()
+        for state_name in (resilience.CLOSED, resilience.OPEN, resilience.HALF_OPEN)
+    })
+registry.collected(
+    "upstream_in_flight", "Вызовы внешнего сервиса в процессе", ("upstream",),
+    lambda: {(name,): item.in_flight for name, item in resilience.UPSTREAMS.items()})
+registry.collected(
+    "upstream_events_total", "Счётчики внешних сервисов: calls, failures, timeouts, rejected, stale_served",
+    ("upstream", "event"),
+    lambda: {
+        (name, event): value
+        for name, item in resilience.UPSTREAMS.items()
+        for event, value in item.counters.items()
+    },
+    kind="counter")
+registry.collected(
+    "queue_depth", "Глубина фоновых очередей", ("queue",),
+    lambda: {("mail_outbox",): reset_password.outbox.queue.qsize(), ("chat_buffer",): chat_buffer.depth(),
+             ("chat_dead_letters",): len(chat_buffer.dead_letters)})
+registry.collected(
+    "single_flight_calls_total", "Single-flight: started — новый вызов, shared — присоединились к идущему",
+    ("result",),
+    lambda: {("started",): flights.started, ("shared",): flights.shared},
+    kind="counter")
+registry.collected(
+    "profile_cache_size", "Профилей пользователей в кэше воркера", (),
+    lambda: {(): profiles.size()})
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
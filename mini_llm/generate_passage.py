@@ -1,19 +1,14 @@
-import openai
+import asyncio
 import pandas as pd 
 import json
 from tqdm import tqdm
-import time
-from dotenv import load_dotenv
-import os
-
 from dotenv import load_dotenv
 import os
 
+# Запуск из корня проекта: python -m mini_llm.generate_passage
 load_dotenv(dotenv_path=r"C:\app_english_back\.env")  
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-openai.api_key = OPENAI_API_KEY 
+from services.llm_gateway import llm, LLMError
 
 
 df = pd.read_csv(r"C:\app_english_back\mini_llm\IELTS_Reading_Topics.csv")
@@ -34,12 +29,12 @@ Requirements:
 
 """
 
-def generate_passage(topic):
+async def generate_passage(topic):
     prompt = build_prompt(topic)
     try:
-        response = openai.ChatCompletion.create(
-            model = "gpt-3.5-turbo",
-            messages = [
+        text = await llm.chat(
+            "gpt-3.5-turbo",
+            [
                 {"role": "system", "content": "You are an IELTS academic text generator."},
                 {"role": "user", "content": prompt}
 
@@ -48,18 +43,22 @@ def generate_passage(topic):
             max_tokens = 600,
 
         )
-        return response['choices'][0]['message']['content'].strip()
-    except Exception as e:
+        return text.strip()
+    except LLMError as e:
         print(f"Error for topic '{topic}': {e}")
         return None
 
-with open("ielts_dataset.jsonl", "w", encoding = "utf-8") as f_out:
-    for topic in tqdm(topics[:10]):
-        text = generate_passage(topic)
-        if text:
-            item = {
-                "prompt": f"Write an IELTS Reading passage about: {topic}",
-                "response": text
-            }
-            f_out.write(json.dumps(item, ensure_ascii = False) + "\n")
-            time.sleep(1.2)
\ No newline at end of file
+async def main():
+    with open("ielts_dataset.jsonl", "w", encoding = "utf-8") as f_out:
+        for topic in tqdm(topics[:10]):
+            text = await generate_passage(topic)
+            if text:
+                item = {
+                    "prompt": f"Write an IELTS Reading passage about: {topic}",
+                    "response": text
+                }
+                f_out.write(json.dumps(item, ensure_ascii = False) + "\n")
+                await asyncio.sleep(1.2)
+    await llm.close()
+
+asyncio.run(main())
\ No newline at end of file
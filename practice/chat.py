@@ -1,30 +1,54 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, Depends
 from supabase import create_client, Client
 import os
-import openai
-import sys
-import io
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+import json
+import base64
 from fastapi import Query
-from fastapi.responses import JSONResponse
-from datetime import datetime
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from uuid import UUID
+
+from practice.chat_buffer import ChatWriteBuffer
+from services.llm_gateway import llm
+from services.admission import admit
+from services.storage import storage
+from services.profile_cache import profiles
+from services.responses import FastJSONResponse, dumps
+from reading.article import postgrest_quote
 
 router = APIRouter()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-openai.api_key = OPENAI_API_KEY
+
+# Размер страницы при потоковой выдаче истории
+HISTORY_STREAM_PAGE = 200
+
+# Сообщения пишутся в chat_history пачками в фоне (запуск и остановка — в main.py)
+chat_buffer = ChatWriteBuffer(storage)
 
 def save_message(user_id: str, role: str, message: str):
-    supabase.table("chat_history").insert({
-        "user_id": user_id,
-        "role": role,
-        "message": message,
-        "timestamp": datetime.utcnow().isoformat()
-    }).execute()
+    chat_buffer.add(user_id, role, message)
+
+# user_id приходит из тела запроса: сообщение с чужим форматом или несуществующим
+# пользователем БД не примет (uuid, FK) — такое в буфер записи не кладём
+async def known_user(user_id) -> bool:
+    try:
+        UUID(str(user_id))
+    except ValueError:
+        return False
+    return await profiles.get(user_id) is not None
+
+# История из БД + ещё не записанные сообщения из буфера (без дублей)
+def merge_pending(user_id: str, history: list) -> list:
+    seen = {(item["role"], item["message"], item["timestamp"][:19]) for item in history}
+    pending = [
+        item for item in chat_buffer.pending_for(user_id)
+        if (item["role"], item["message"], item["timestamp"][:19]) not in seen
+    ]
+    return history + pending
 
 @router.post("/start")
 async def start_chat(request: Request):
@@ -34,6 +58,8 @@ async def start_chat(request: Request):
 
     if not user_id:
         return {"error": "user_id is required"}
+    if not await known_user(user_id):
+        return {"error": "user not found"}
 
     # ✅ 1. Получаем word_id из прогресса
     vocab_progress = supabase.table("user_vocabulary_progress") \
@@ -67,11 +93,7 @@ async def start_chat(request: Request):
     readings = [item["topic"] for item in readings_resp.data or []][-5:]
 
     # ✅ 5. Level
-    level_resp = supabase.table("users_progress") \
-        .select("level") \
-        .eq("user_id", user_id) \
-        .execute()
-    user_level = level_resp.data[0]["level"] if level_resp.data else "A1"
+    user_level = await profiles.get_level(user_id) or "A1"
 
     # ✅ 6. Промпт
     prompt = f"""
@@ -126,18 +148,13 @@ NEVER treat "Analyze My Data" as a regular learning topic like 'Tenses' or 'Quiz
 Begin the conversation by greeting the student and referencing their progress. Then suggest a learning activity or ask a related question.
 """
 
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "system", "content": prompt}]
-    )
-
-    ai_reply = response["choices"][0]["message"]["content"]
+    ai_reply = await llm.chat("gpt-3.5-turbo", [{"role": "system", "content": prompt}])
 
     save_message(user_id, "assistant", ai_reply)
 
-    return JSONResponse(content={"reply": ai_reply}, media_type="application/json; charset=utf-8")
+    return FastJSONResponse(content={"reply": ai_reply})
 
-@router.post("/chat")
+@router.post("/chat", dependencies=[Depends(admit("chat", "openai"))])
 async def continue_chat(request: Request):
     data = await request.json()
     user_id = data.get("user_id")
@@ -145,6 +162,8 @@ async def continue_chat(request: Request):
 
     if not user_id or not message:
         return {"error": "user_id and message are required"}
+    if not await known_user(user_id):
+        return {"error": "user not found"}
 
     try:
         # 💾 Сохраняем сообщение пользователя
@@ -152,13 +171,13 @@ async def continue_chat(request: Request):
 
         # 🧠 Получаем историю сообщений
         history_resp = supabase.table("chat_history") \
-            .select("role, message") \
+            .select("role, message, timestamp") \
             .eq("user_id", user_id) \
             .order("timestamp", desc=False) \
             .limit(20) \
             .execute()
 
-        history = history_resp.data if history_resp.data else []
+        history = merge_pending(user_id, history_resp.data or [])[:20]
 
         # 🧩 Формируем сообщения
         messages = [{"role": "system", "content": """
@@ -196,36 +215,96 @@ If they write in Kazakh, kindly translate and explain how to say it correctly in
         messages.append({"role": "user", "content": message})
 
         # 🤖 Запрос к OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages
-        )
-
-        ai_reply = response["choices"][0]["message"]["content"]
+        ai_reply = await llm.chat("gpt-3.5-turbo", messages)
 
         # 💾 Сохраняем ответ AI
         save_message(user_id, "assistant", ai_reply)
 
-        return JSONResponse(content={"reply": ai_reply}, media_type="application/json; charset=utf-8")
+        return FastJSONResponse(content={"reply": ai_reply})
 
     except Exception as e:
         return {"error": f"OpenAI error: {str(e)}"}
 
 
 
-@router.get("/chat/history")
-async def get_chat_history(user_id: str = Query(...)):
+# Курсор истории чата — (timestamp, id) сообщения: timestamp не уникален
+# (сообщения пишутся пачками), поэтому сообщения с одной меткой различаем по id
+def encode_chat_cursor(item: dict) -> str:
+    raw = json.dumps([item["timestamp"], item["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_chat_cursor(cursor: str) -> tuple:
+    """(timestamp, id); курсор старого формата — просто timestamp — даёт (timestamp, None)."""
     try:
-        response = supabase.table("chat_history") \
-            .select("role, message, timestamp") \
-            .eq("user_id", user_id) \
-            .order("timestamp", desc=False) \
-            .execute()
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(timestamp), str(message_id)
+    except (ValueError, TypeError):
+        return cursor, None
+
+# operator — lt (старее курсора) или gt (новее курсора)
+def apply_chat_cursor(query, operator: str, cursor: str):
+    timestamp, message_id = decode_chat_cursor(cursor)
+    if message_id is None:
+        return getattr(query, operator)("timestamp", timestamp)
+    timestamp, message_id = postgrest_quote(timestamp), postgrest_quote(message_id)
+    return query.or_(f"timestamp.{operator}.{timestamp},and(timestamp.eq.{timestamp},id.{operator}.{message_id})")
+
+# Страница истории чата: after — сообщения новее курсора (по возрастанию),
+# иначе — последние сообщения старше before (тоже по возрастанию).
+# Заданы оба — сообщения между курсорами, начиная с after
+def fetch_history_page(user_id: str, before: Optional[str], after: Optional[str], limit: int) -> list:
+    query = supabase.table("chat_history") \
+        .select("id, role, message, timestamp") \
+        .eq("user_id", user_id)
+
+    if before:
+        query = apply_chat_cursor(query, "lt", before)
+    if after:
+        query = apply_chat_cursor(query, "gt", after)
+        response = query.order("timestamp", desc=False).order("id", desc=False).limit(limit).execute()
+        return response.data or []
+
+    response = query.order("timestamp", desc=True).order("id", desc=True).limit(limit).execute()
+    return list(reversed(response.data or []))
+
+
+# NDJSON-поток истории (до before, если задан): читаем таблицу страницами, в памяти держим одну страницу.
+# Генератор синхронный — Starlette крутит его в threadpool и не блокирует event loop.
+def stream_history(user_id: str, before: Optional[str], after: Optional[str]):
+    while True:
+        page = fetch_history_page(user_id, before, after, HISTORY_STREAM_PAGE)
+        for item in page:
+            yield dumps(item) + b"\n"
+        if len(page) < HISTORY_STREAM_PAGE:
+            break
+        after = encode_chat_cursor(page[-1])
 
-        if not response.data:
-            return {"history": []}
 
-        return JSONResponse(content={"history": response.data}, media_type="application/json; charset=utf-8")
+@router.get("/chat/history")
+async def get_chat_history(
+    user_id: str = Query(...),
+    before: Optional[str] = Query(None),
+    after: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    stream: bool = Query(False)
+):
+    try:
+        # Отдаём историю вместе с сообщениями, которые ещё лежат в буфере записи
+        await chat_buffer.flush()
+
+        if stream:
+            return StreamingResponse(stream_history(user_id, before, after), media_type="application/x-ndjson; charset=utf-8")
+
+        history = fetch_history_page(user_id, before, after, limit)
+        if not history:
+            return {"history": [], "next_before": None, "next_after": None}
+
+        # Курсоры для следующих страниц: старее первого и новее последнего сообщения
+        return FastJSONResponse(content={
+            "history": history,
+            "next_before": encode_chat_cursor(history[0]) if len(history) == limit and not after else None,
+            "next_after": encode_chat_cursor(history[-1])
+        })
 
     except Exception as e:
         return {"error": str(e)}
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+
+from services.logs import fields
+from services.storage import is_row_error
+
+# Отложенная (write-behind) запись сообщений чата.
+# save_message больше не ходит в Supabase на каждое сообщение: сообщения всех
+# пользователей копятся в памяти и пишутся одной многострочной вставкой —
+# по размеру пачки или по таймеру, а при остановке приложения буфер сбрасывается.
+# Запись идёт через storage.insert_chat_messages (services/storage.py).
+# Если пачку отвергла сама БД (неверный user_id, нарушение FK), пачка делится пополам,
+# пока не останутся отдельные плохие строки — они уходят в dead_letters и в лог,
+# остальные записываются. При недоступности БД пачка возвращается в очередь целиком.
+
+logger = logging.getLogger(__name__)
+
+
+class ChatWriteBuffer:
+    def __init__(self, storage, max_batch: int = 100, flush_interval: float = 0.5, max_pending: int = 10000,
+                 max_dead_letters: int = 1000):
+        self.storage = storage
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending = []
+        self._in_flight = []
+        self._last_timestamp = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.dead_letters = deque(maxlen=max_dead_letters)
+        self.inserts = 0
+        self.rows_written = 0
+
+    def add(self, user_id: str, role: str, message: str) -> dict:
+        # Метка времени ставится при добавлении и строго растёт в пределах пользователя,
+        # поэтому порядок сообщений в chat_history совпадает с порядком реплик
+        timestamp = datetime.utcnow()
+        last = self._last_timestamp.get(user_id)
+        if last is not None and timestamp <= last:
+            timestamp = last + timedelta(microseconds=1)
+        self._last_timestamp[user_id] = timestamp
+
+        row = {
+            "user_id": user_id,
+            "role": role,
+            "message": message,
+            "timestamp": timestamp.isoformat()
+        }
+        self._pending.append(row)
+
+        if len(self._pending) > self.max_pending:
+            dropped = self._pending.pop(0)
+            logger.warning("⚠️ Буфер чата переполнен, сообщение потеряно", extra=fields(user_id=dropped["user_id"]))
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        return row
+
+    def pending_for(self, user_id: str) -> list:
+        """Ещё не записанные в БД сообщения пользователя (в том числе пишущиеся прямо сейчас)."""
+        return [row for row in self._in_flight + self._pending if row["user_id"] == user_id]
+
+    def depth(self) -> int:
+        """Сколько сообщений ждёт записи в БД."""
+        return len(self._in_flight) + len(self._pending)
+
+    async def _write(self, batch: list, handled: list):
+        """Пишет пачку; в handled попадают записанные и отвергнутые строки."""
+        try:
+            await self.storage.insert_chat_messages(batch)
+        except Exception as e:
+            if not is_row_error(e):
+                raise
+            if len(batch) == 1:
+                # Строку БД не примет никогда — не держим из-за неё остальные сообщения
+                self.dead_letters.append(batch[0])
+                handled.append(batch[0])
+                logger.error("Сообщение чата отвергнуто БД", extra=fields(user_id=batch[0]["user_id"], error=str(e)))
+                return
+            middle = len(batch) // 2
+            await self._write(batch[:middle], handled)
+            await self._write(batch[middle:], handled)
+            return
+        handled.extend(batch)
+        self.inserts += 1
+        self.rows_written += len(batch)
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:len(batch)]
+                self._in_flight = batch
+                handled = []
+                try:
+                    await self._write(batch, handled)
+                except Exception as e:
+                    # БД недоступна: возвращаем ещё не записанные строки в начало очереди,
+                    # попробуем на следующем сбросе
+                    done = {id(row) for row in handled}
+                    self._pending[:0] = [row for row in batch if id(row) not in done]
+                    logger.error("Ошибка записи истории чата", extra=fields(rows=len(batch), error=str(e)))
+                    break
+                finally:
+                    self._in_flight = []
+                self._prune_timestamps()
+
+    def _prune_timestamps(self):
+        # Метка нужна, только пока у пользователя есть незаписанные сообщения;
+        # иначе словарь растёт с каждым новым пользователем. Если часы ещё не догнали
+        # последнюю метку (её сдвигали на микросекунды вперёд), оставляем её до следующего сброса
+        now = datetime.utcnow()
+        waiting = {row["user_id"] for row in self._pending}
+        for user_id, last in list(self._last_timestamp.items()):
+            if user_id not in waiting and last < now:
+                del self._last_timestamp[user_id]
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -1,28 +1,35 @@
 import os
 import json
+import logging
 import random
-import openai
 from supabase import create_client
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 from datetime import datetime
 import re
 
-from typing import List
+from typing import List, Optional
 import re
+import base64
+
+from services.llm_gateway import llm
+from services.single_flight import flights
+from services.admission import admit
+from services.logs import fields
+from services.storage import storage
+from services.profile_cache import profiles
 
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-openai.api_key = OPENAI_API_KEY
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class PrepareWordCacheRequest(BaseModel):
     text: str
@@ -41,10 +48,18 @@ class MarkAsReadRequest(BaseModel):
 
 class HistoryRequest(BaseModel):
     user_id: str
+    cursor: Optional[str] = None       # next_cursor из предыдущей страницы
+    limit: int = Field(20, ge=1, le=100)
+    include_content: bool = False      # Текст статей по умолчанию не отдаём — только список
+
+class HistoryItemRequest(BaseModel):
+    user_id: str
+    topic: str
 
 #  Логирование
 def log_message(label, data):
-    print(f"{label}: {json.dumps(data, ensure_ascii=False, indent=2) if isinstance(data, dict) else data}")
+    # Сериализация в JSON — в фоновом потоке логирования, не в обработчике запроса
+    logger.info(label, extra=fields(data=data))
 
 # Получение 3 случайных непрочитанных тем
 def get_random_unread_topics(user_id: str, level: str) -> list:
@@ -64,10 +79,9 @@ async def get_topics(request: TopicRequest):
     try:
         log_message("Запрос get_topics от user_id", request.user_id)
 
-        user_response = supabase.from_("users_progress").select("level").eq("user_id", request.user_id).maybe_single().execute()
-        if not user_response.data:
+        user_level = await profiles.get_level(request.user_id)
+        if not user_level:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
-        user_level = user_response.data["level"]
 
         new_topics = get_random_unread_topics(request.user_id, user_level)
         if not new_topics:
@@ -76,76 +90,78 @@ async def get_topics(request: TopicRequest):
         return {"topics": new_topics}
 
     except Exception as e:
-        log_message("Ошибка в get_topics", str(e))
+        logger.error("Ошибка в get_topics", extra=fields(error=str(e)))
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
+# Поиск готовой или генерация новой статьи для (user_id, topic)
+async def build_article(user_id: str, topic: str) -> dict:
+    # Проверка — статья уже существует?
+    existing_article_resp = supabase.from_("user_topics") \
+        .select("content") \
+        .eq("user_id", user_id) \
+        .eq("topic", topic) \
+        .maybe_single() \
+        .execute()
+
+    if existing_article_resp and existing_article_resp.data:
+        content = existing_article_resp.data.get("content")
+        if content:
+            return {"article": content}
+
+    # Получаем уровень пользователя
+    user_level = await profiles.get_level(user_id)
+    if not user_level:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    # Генерация статьи
+    prompt = f"""
+    Write an academic IELTS Reading-style article on the topic: "{topic}".
+    Requirements:
+    - Length: 250–300 words
+    - Formal academic tone
+    - Structured in paragraphs
+    - No questions or bullet points
+    """
+
+    article_text = (await llm.chat(
+        "gpt-4o-mini",
+        [
+            {"role": "system", "content": "You are an IELTS Reading assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=500,
+        temperature=0.7
+    )).strip()
+
+    # ✅ Вставка или обновление статьи
+    await storage.upsert_user_topic({
+        "user_id": user_id,
+        "topic": topic,
+        "content": article_text,
+        "read": False,
+        "level": user_level,
+        "updated_at": datetime.utcnow().isoformat()
+    })
+
+    return {"article": article_text}
+
 # Генерация статьи
-@router.post("/generate_article")
+@router.post("/generate_article", dependencies=[Depends(admit("generate_article", "openai"))])
 async def generate_article(request: GenerateArticleRequest):
     try:
         log_message("Запрос на генерацию статьи", request.dict())
 
         topic = re.sub(r'\s+', ' ', request.topic.strip())
 
-        # Проверка — статья уже существует?
-        existing_article_resp = supabase.from_("user_topics") \
-            .select("content") \
-            .eq("user_id", request.user_id) \
-            .eq("topic", topic) \
-            .maybe_single() \
-            .execute()
-
-        if existing_article_resp and existing_article_resp.data:
-            content = existing_article_resp.data.get("content")
-            if content:
-                return {"article": content}
-
-        # Получаем уровень пользователя
-        user_response = supabase.from_("users_progress") \
-            .select("level") \
-            .eq("user_id", request.user_id) \
-            .maybe_single() \
-            .execute()
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="Пользователь не найден")
-        user_level = user_response.data["level"]
-
-        # Генерация статьи
-        prompt = f"""
-        Write an academic IELTS Reading-style article on the topic: "{topic}".
-        Requirements:
-        - Length: 250–300 words
-        - Formal academic tone
-        - Structured in paragraphs
-        - No questions or bullet points
-        """
-
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an IELTS Reading assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500,
-            temperature=0.7
+        # Одновременные запросы той же статьи (двойной тап, повтор по таймауту)
+        # ждут одну генерацию вместо нескольких вызовов LLM
+        return await flights.do(
+            ("generate_article", request.user_id, topic),
+            lambda: build_article(request.user_id, topic)
         )
 
-        article_text = response["choices"][0]["message"]["content"].strip()
-
-        # ✅ Вставка или обновление статьи
-        supabase.from_("user_topics").upsert({
-            "user_id": request.user_id,
-            "topic": topic,
-            "content": article_text,
-            "read": False,
-            "level": user_level,
-            "updated_at": datetime.utcnow().isoformat()
-        }).execute()
-
-        return {"article": article_text}
-
     except Exception as e:
-        log_message("Ошибка в generate_article", str(e))
+        logger.error("Ошибка в generate_article", extra=fields(error=str(e)))
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
 
@@ -164,31 +180,107 @@ async def mark_as_read(request: MarkAsReadRequest):
             .execute()
         return {"status": "marked as read"}
     except Exception as e:
-        log_message("Ошибка в mark_as_read", str(e))
+        logger.error("Ошибка в mark_as_read", extra=fields(error=str(e)))
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
-# Получить историю прочитанного
+# Курсор истории — (updated_at, topic) последней отданной записи.
+# updated_at может быть null (старые записи) — в курсоре он null, а не строка "None"
+def encode_history_cursor(updated_at: Optional[str], topic: str) -> str:
+    raw = json.dumps([updated_at, topic], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_history_cursor(cursor: str) -> tuple:
+    try:
+        updated_at, topic = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return (None if updated_at is None else str(updated_at)), str(topic)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Неверный cursor")
+
+# Значение для фильтров PostgREST в or=(...): в кавычках, чтобы запятые,
+# точки и скобки в темах и датах не ломали синтаксис
+def postgrest_quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+# Получить историю прочитанного (keyset-пагинация по (updated_at, topic));
+# записи без updated_at идут в конце истории
 @router.post("/get_history")
 async def get_history(request: HistoryRequest):
     try:
         log_message("Запрос истории прочитанных тем", request.dict())
 
+        columns = "topic, content, read, level, updated_at" if request.include_content else "topic, read, level, updated_at"
+        query = supabase.from_("user_topics") \
+            .select(columns) \
+            .eq("user_id", request.user_id) \
+            .eq("read", True)
+
+        if request.cursor:
+            updated_at, topic = decode_history_cursor(request.cursor)
+            if updated_at is None:
+                # Курсор уже среди записей без updated_at — дальше только они
+                query = query.is_("updated_at", "null").lt("topic", topic)
+            else:
+                updated_at, topic = postgrest_quote(updated_at), postgrest_quote(topic)
+                query = query.or_(
+                    f"updated_at.lt.{updated_at},and(updated_at.eq.{updated_at},topic.lt.{topic}),updated_at.is.null"
+                )
+
+        # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+        response = query \
+            .order("updated_at", desc=True, nullsfirst=False) \
+            .order("topic", desc=True) \
+            .limit(request.limit + 1) \
+            .execute()
+
+        rows = response.data or []
+        if not rows and not request.cursor:
+            return {"history": [], "next_cursor": None, "message": "История пуста"}
+
+        page = rows[:request.limit]
+        next_cursor = None
+        if len(rows) > request.limit:
+            last = page[-1]
+            next_cursor = encode_history_cursor(last["updated_at"], last["topic"])
+
+        return {"history": page, "next_cursor": next_cursor}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Ошибка в get_history", extra=fields(error=str(e)))
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+def load_history_item(user_id: str, topic: str) -> dict:
+    try:
         response = supabase.from_("user_topics") \
             .select("topic, content, read, level, updated_at") \
-            .eq("user_id", request.user_id) \
-            .eq("read", True) \
-            .order("updated_at", desc=True) \
+            .eq("user_id", user_id) \
+            .eq("topic", topic) \
+            .maybe_single() \
             .execute()
 
-        if not response.data:
-            return {"history": [], "message": "История пуста"}
+        if not response or not response.data:
+            raise HTTPException(status_code=404, detail="Статья не найдена")
 
-        return {"history": response.data}
+        return response.data
 
+    except HTTPException:
+        raise
     except Exception as e:
-        log_message("Ошибка в get_history", str(e))
+        logger.error("Ошибка в get_history_item", extra=fields(error=str(e)))
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
+# Текст одной статьи из истории
+@router.post("/get_history_item")
+async def get_history_item(request: HistoryItemRequest):
+    return load_history_item(request.user_id, request.topic)
+
+# То же через GET: сгенерированная статья не меняется, поэтому повторный
+# запрос с If-None-Match получает 304 без тела (services/responses.py)
+@router.get("/history_item")
+async def get_history_item_cached(user_id: str, topic: str):
+    return load_history_item(user_id, topic)
+
 
 @router.post("/prepare_word_cache")
 async def prepare_word_cache(request: PrepareWordCacheRequest):
@@ -225,5 +317,5 @@ async def prepare_word_cache(request: PrepareWordCacheRequest):
         }
 
     except Exception as e:
-        log_message("Ошибка в prepare_word_cache", str(e))
+        logger.error("Ошибка в prepare_word_cache", extra=fields(error=str(e)))
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
\ No newline at end of file
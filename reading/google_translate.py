@@ -1,15 +1,17 @@
 import os
-import requests
+import aiohttp
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from services.resilience import upstream, client_timeout, UpstreamError, UpstreamUnavailable
+
 load_dotenv()
 
 router = APIRouter()
 
 GOOGLE_TRANSLATE_API_KEY = os.getenv("GOOGLE_TRANSLATE_API")
-GOOGLE_TRANSLATE_URL = "https://translation.googleapis.com/language/translate/v2"
+GOOGLE_TRANSLATE_URL = os.getenv("GOOGLE_TRANSLATE_URL", "https://translation.googleapis.com/language/translate/v2")
 
 
 class TranslateRequest(BaseModel):
@@ -17,32 +19,45 @@ class TranslateRequest(BaseModel):
     target_lang: str = "kk"  # по умолчанию перевод на казахский
 
 
-@router.post("/translate_google")
-async def translate_google(request: TranslateRequest):
-    if not GOOGLE_TRANSLATE_API_KEY:
-        raise HTTPException(status_code=500, detail="Google API ключ не найден")
-
-    try:
-        response = requests.post(
+async def request_translation(word: str, target_lang: str) -> dict:
+    async with aiohttp.ClientSession(timeout=client_timeout("google_translate")) as session:
+        async with session.post(
             GOOGLE_TRANSLATE_URL,
             params={"key": GOOGLE_TRANSLATE_API_KEY},
             json={
-                "q": request.word,
-                "target": request.target_lang,
+                "q": word,
+                "target": target_lang,
                 "format": "text",
                 "source": "en",
             },
-        )
-        response.encoding = 'utf-8'
-        data = response.json()
+        ) as response:
+            data = await response.json(content_type=None)
+            # 5xx — деградация сервиса (учитывается breaker'ом), 4xx — ошибка запроса
+            if response.status >= 500:
+                raise UpstreamError(f"Google Translate API: {response.status}")
+            if "error" in data:
+                raise HTTPException(status_code=400, detail=data["error"]["message"])
+            return data
+
 
-        if "error" in data:
-            raise HTTPException(status_code=400, detail=data["error"]["message"])
+@router.post("/translate_google")
+async def translate_google(request: TranslateRequest):
+    if not GOOGLE_TRANSLATE_API_KEY:
+        raise HTTPException(status_code=500, detail="Google API ключ не найден")
+
+    try:
+        # Если Google Translate недоступен — отдаём последний удачный перевод этого слова
+        data = await upstream("google_translate").call(
+            lambda: request_translation(request.word, request.target_lang),
+            cache_key=(request.word.lower(), request.target_lang)
+        )
 
         translation = data["data"]["translations"][0]["translatedText"]
         return {"translation": translation}
 
+    except HTTPException:
+        raise
+    except (UpstreamError, UpstreamUnavailable) as e:
+        raise HTTPException(status_code=503, detail=f"Ошибка перевода: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка перевода: {e}")
-
-
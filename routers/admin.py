@@ -0,0 +1,54 @@
+import hmac
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import PlainTextResponse
+
+from services import profiler, profile_cache
+
+# Служебные эндпоинты. Доступ — по заголовку X-Admin-Token, равному ADMIN_TOKEN;
+# без ADMIN_TOKEN в окружении эндпоинты отвечают 404.
+
+router = APIRouter()
+
+
+def check_admin(token: str):
+    if not profiler.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # Байты, а не str: compare_digest на str с не-ASCII падает TypeError (500 вместо 403)
+    if not token or not hmac.compare_digest(token.encode("utf-8"), profiler.ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Доступ запрещён")
+
+
+def find_profile(profile_id: str):
+    profile = profiler.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return profile
+
+
+# Список сохранённых профилей запросов (новые — первыми)
+@router.get("/profiles")
+async def list_profiles(x_admin_token: str = Header(None)):
+    check_admin(x_admin_token)
+    return {"profiles": [profile.to_dict(full=False) for profile in reversed(profiler.profiles)]}
+
+
+# Профиль целиком: таймлайн вызовов и самые частые стеки
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, x_admin_token: str = Header(None)):
+    check_admin(x_admin_token)
+    return find_profile(profile_id).to_dict()
+
+
+# Свёрнутые стеки для flamegraph.pl или speedscope
+@router.get("/profiles/{profile_id}/folded")
+async def get_profile_folded(profile_id: str, x_admin_token: str = Header(None)):
+    check_admin(x_admin_token)
+    return PlainTextResponse(find_profile(profile_id).folded())
+
+
+# Сброс кэша профиля после смены уровня вне этого сервиса (например, прямой записью в Supabase)
+@router.post("/users/{user_id}/invalidate_profile")
+async def invalidate_user_profile(user_id: str, x_admin_token: str = Header(None)):
+    check_admin(x_admin_token)
+    await profile_cache.profiles.invalidate(user_id)
+    return {"status": "invalidated"}
@@ -1,7 +1,6 @@
 import os
 from dotenv import load_dotenv
 from fastapi import APIRouter, HTTPException
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
 from supabase import create_client, Client
@@ -13,6 +12,8 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from starlette.requests import Request 
 
+from services.mail_outbox import MailOutbox
+
 from slowapi import Limiter
 
 # Создаем экземпляр лимитера
@@ -43,16 +44,20 @@ class EmailConfig:
     MAIL_PORT = int(os.getenv("MAIL_PORT", 465))
     MAIL_SERVER = os.getenv("MAIL_SERVER")
     MAIL_STARTTLS = False  # Для Yandex False
-    MAIL_SSL_TLS = True    # Используем SSL/TLS
-
-conf = ConnectionConfig(
-    MAIL_USERNAME=EmailConfig.MAIL_USERNAME,
-    MAIL_PASSWORD=EmailConfig.MAIL_PASSWORD,
-    MAIL_FROM=EmailConfig.MAIL_FROM,
-    MAIL_PORT=EmailConfig.MAIL_PORT,
-    MAIL_SERVER=EmailConfig.MAIL_SERVER,
-    MAIL_STARTTLS=EmailConfig.MAIL_STARTTLS,
-    MAIL_SSL_TLS=EmailConfig.MAIL_SSL_TLS
+    MAIL_SSL_TLS = os.getenv("MAIL_SSL_TLS", "true").lower() == "true"  # SSL/TLS (false — для локального SMTP stand-in)
+    MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", 2))            # Сколько постоянных SMTP-соединений держим
+    MAIL_RATE_PER_SEC = float(os.getenv("MAIL_RATE_PER_SEC", 2))
+
+# Очередь писем: запускается и останавливается вместе с приложением (main.py)
+outbox = MailOutbox(
+    hostname=EmailConfig.MAIL_SERVER,
+    port=EmailConfig.MAIL_PORT,
+    username=EmailConfig.MAIL_USERNAME,
+    password=EmailConfig.MAIL_PASSWORD,
+    sender=EmailConfig.MAIL_FROM,
+    use_tls=EmailConfig.MAIL_SSL_TLS,
+    workers=EmailConfig.MAIL_WORKERS,
+    rate_per_sec=EmailConfig.MAIL_RATE_PER_SEC
 )
 
 router = APIRouter()
@@ -75,18 +80,16 @@ def create_reset_token(email: str):
     token = jwt.encode({"sub": email, "exp": expire}, JWT_SECRET_KEY, algorithm="HS256")
     return token
 
-# Функция отправки email с токеном
-async def send_reset_email(email: str, token: str):
+# Функция постановки email с токеном в очередь (отправляет воркер outbox)
+def send_reset_email(email: str, token: str) -> bool:
     # Замените этот URL на ваш реальный ngrok или доменный URL
     reset_link = f"http://13.60.11.238:8000/password/reset-password?token={token}"
-    message = MessageSchema(
+    return outbox.enqueue(
+        recipient=email,
         subject="QazaqLingva қосымшасы - Аккаунтың құпиясөзін қалпына келтіру",
-        recipients=[email],
         body=f"Құпиясөзді қалпына келтіру үшін келесі сілтемеге өтіңіз: {reset_link}",
         subtype="html"
     )
-    fm = FastMail(conf)
-    await fm.send_message(message)
 
 # Маршрут для запроса сброса пароля (отправка email)
 @router.post("/forgot/")
@@ -96,11 +99,22 @@ async def forgot_password(request: Request, forgot_request: ForgotPasswordReques
     if not email:
         raise HTTPException(status_code=400, detail="Email обязателен")
     token = create_reset_token(email)
-    await send_reset_email(email, token)
+    if not send_reset_email(email, token):
+        raise HTTPException(status_code=503, detail="Сервер бос емес. Кейінірек қайталап көріңіз.")
     return {"message": "Если такой email существует, ссылка была отправлена"}
 
 
 
+# Поиск id пользователя по email (индекс users_basic_email_key, sql/004_users_basic_email_index.sql)
+def get_user_id_by_email(email: str):
+    response = supabase.table("users_basic") \
+        .select("id") \
+        .eq("email", email) \
+        .limit(1) \
+        .execute()
+    return response.data[0]["id"] if response.data else None
+
+
 # Маршрут для изменения пароля (обновление в Supabase)
 @router.post("/reset-password/")
 async def reset_password(request: ResetPasswordRequest):
@@ -111,13 +125,11 @@ async def reset_password(request: ResetPasswordRequest):
         if not email:
             raise HTTPException(status_code=400, detail="Неверный токен")
         
-        # Получаем всех пользователей (метод list_users() возвращает список объектов)
-        all_users = supabase.auth.admin.list_users()
-        # Фильтруем пользователей по email
-        matching_users = [user for user in all_users if hasattr(user, "email") and user.email == email]
-        if not matching_users:
+        # Ищем id пользователя по email через уникальный индекс users_basic.email,
+        # а не перебором всех пользователей из auth.admin.list_users()
+        uid = get_user_id_by_email(email)
+        if not uid:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
-        uid = matching_users[0].id
         
         # Обновляем пароль в Supabase, передавая данные как словарь
         supabase.auth.admin.update_user_by_id(uid, {"password": request.new_password})
@@ -0,0 +1,74 @@
+import math
+
+from fastapi import HTTPException, Request
+
+from services.shared_state import state
+
+# Контроль допуска к дорогим эндпоинтам (OpenAI, Deepgram, ListenNotes):
+#   - token bucket на пользователя: capacity запросов подряд, дальше per_minute в минуту;
+#   - глобальный лимит одновременных запросов к каждому внешнему сервису на все воркеры.
+# Отказ — 429 с заголовком Retry-After.
+
+USER_LIMITS = {
+    "chat": {"capacity": 20, "per_minute": 10},
+    "generate_article": {"capacity": 5, "per_minute": 2},
+    "check_answer": {"capacity": 10, "per_minute": 5},
+    "podcasts": {"capacity": 5, "per_minute": 2},
+}
+
+UPSTREAM_CAPS = {
+    "openai": 64,
+    "listennotes": 16,
+}
+
+RETRY_AFTER_BUSY = 1  # Через сколько секунд повторить, если занят глобальный лимит
+
+
+async def get_user_key(request: Request) -> str:
+    # user_id приходит в query (GET) или в JSON-теле (POST); без него — лимит по IP
+    user_id = request.query_params.get("user_id")
+    if not user_id and request.method == "POST":
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            user_id = body.get("user_id")
+    if user_id:
+        return f"user:{user_id}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def admit(route: str, upstream: str = None):
+    """Зависимость FastAPI: проверяет лимит пользователя и занимает глобальный слот upstream
+    на время запроса."""
+    limits = USER_LIMITS[route]
+
+    async def dependency(request: Request):
+        key = await get_user_key(request)
+        allowed, retry_after = await state.token_bucket(
+            f"{route}:{key}", limits["capacity"], limits["per_minute"] / 60.0
+        )
+        if not allowed:
+            raise HTTPException(
+                status_code=429,
+                detail="Сіз тым жиі сұраныс жібердіңіз. Кейінірек қайталап көріңіз.",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+
+        if upstream is None:
+            yield
+            return
+
+        if not await state.acquire_slot(upstream, UPSTREAM_CAPS[upstream]):
+            raise HTTPException(
+                status_code=429,
+                detail="Сервер бос емес. Кейінірек қайталап көріңіз.",
+                headers={"Retry-After": str(RETRY_AFTER_BUSY)}
+            )
+        try:
+            yield
+        finally:
+            await state.release_slot(upstream)
+
+    return dependency
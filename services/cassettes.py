@@ -0,0 +1,182 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+# Запись и воспроизведение ответов внешних сервисов (кассеты JSONL).
+#   CASSETTE_MODE=record — каждый вызов через Upstream.call (OpenAI, Deepgram, ListenNotes,
+#                          YouTube, Translate) и проверка/скачивание аудио пишутся в CASSETTE_PATH:
+#                          запрос, ответ (или ошибка) и задержка; ключи и токены вырезаются.
+#   CASSETTE_MODE=replay — те же вызовы отдаются из кассеты без сети, с записанной задержкой,
+#                          умноженной на CASSETTE_LATENCY_SCALE (0 — без задержки).
+# Одинаковые запросы воспроизводятся по кругу в порядке записи.
+# Для нагрузочных прогонов, где запросы отличаются (случайная тема, новый user_id), —
+# CASSETTE_MATCH=nearest.
+
+load_dotenv()
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off")
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassettes/upstreams.jsonl")
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", 1.0))
+# exact — только точное совпадение запроса; nearest — при промахе берём запись того же сервиса
+# с самым длинным общим началом запроса (тот же промпт/шаблон, другая тема или user_id)
+CASSETTE_MATCH = os.getenv("CASSETTE_MATCH", "exact")
+
+REDACTED = "***"
+SECRET_KEYS = re.compile(r"authorization|.*api[-_]?key|key|(access_|refresh_|auth_)?token|.*secret.*|.*password.*",
+                         re.IGNORECASE)
+SECRET_PATTERNS = [
+    re.compile(r"sk-[A-Za-z0-9_\-]{8,}"),
+    re.compile(r"(?i)((?:api_?)?key=)[^&\s\"']+"),
+    re.compile(r"(?i)(token\s+)[A-Za-z0-9_\-\.]{8,}"),
+    re.compile(r"(?i)(bearer\s+)[A-Za-z0-9_\-\.]{8,}"),
+]
+
+
+def scrub(value):
+    if isinstance(value, dict):
+        return {k: (REDACTED if SECRET_KEYS.fullmatch(str(k)) else scrub(v)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [scrub(item) for item in value]
+    if isinstance(value, str):
+        for pattern in SECRET_PATTERNS:
+            value = pattern.sub(lambda m: (m.group(1) if m.groups() else "") + REDACTED, value)
+        return value
+    return value
+
+
+def canonical(value) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def request_key(kind: str, name: str, request) -> str:
+    return hashlib.sha256(canonical([kind, name, request]).encode("utf-8")).hexdigest()
+
+
+def encode_error(exc: Exception) -> dict:
+    if isinstance(exc, HTTPException):
+        return {"type": "HTTPException", "status_code": exc.status_code, "detail": exc.detail}
+    return {
+        "type": type(exc).__name__,
+        "message": str(exc),
+        "retryable": getattr(exc, "retryable", True),
+        "status": getattr(exc, "status", None),
+    }
+
+
+def decode_error(error: dict) -> Exception:
+    # Импорт внутри функции: resilience и llm_gateway сами импортируют этот модуль
+    from services.resilience import UpstreamError
+    from services.llm_gateway import LLMError
+
+    if error["type"] == "HTTPException":
+        return HTTPException(status_code=error["status_code"], detail=error["detail"])
+    if error["type"] == "LLMError":
+        return LLMError(error["message"], retryable=error["retryable"], status=error["status"])
+    # Остальное (UpstreamError, ошибки сети) воспроизводим как UpstreamError — его ловят все вызывающие
+    return UpstreamError(error["message"])
+
+
+# Тело аудио в кассету не пишем (мегабайты): сохраняем только размер, а при воспроизведении
+# отдаём заглушку — дальше она уходит в Deepgram, ответ которого тоже берётся из кассеты
+def body_size(data: bytes) -> dict:
+    return {"size": len(data)}
+
+
+def body_placeholder(response: dict) -> bytes:
+    return b"\x00" if response["size"] else b""
+
+
+class Cassette:
+    def __init__(self, mode: str, path: str, latency_scale: float = 1.0, match: str = "exact"):
+        self.mode = mode
+        self.path = path
+        self.latency_scale = latency_scale
+        self.match = match
+        self._entries = {}
+        self._by_name = {}  # (kind, name) -> [(запрос в JSON, ключ)] для CASSETTE_MATCH=nearest
+        self._nearest = {}
+        self._positions = {}
+        self._file = None
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if mode == "replay":
+            self.load()
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    if entry["key"] not in self._entries:
+                        self._by_name.setdefault((entry["kind"], entry["name"]), []).append(
+                            (canonical(entry["request"]), entry["key"])
+                        )
+                    self._entries.setdefault(entry["key"], []).append(entry)
+
+    def _nearest_key(self, kind: str, name: str, request, key: str):
+        if key not in self._nearest:
+            raw = canonical(request)
+            candidates = self._by_name.get((kind, name), [])
+            self._nearest[key] = max(
+                candidates, key=lambda item: len(os.path.commonprefix([raw, item[0]])), default=(None, None)
+            )[1]
+        return self._nearest[key]
+
+    def _write(self, entry: dict):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+        self.recorded += 1
+
+    async def intercept(self, kind: str, name: str, request, factory, encode=None, decode=None):
+        """Вызывает factory() (record/off) или отдаёт записанный ответ (replay).
+        encode/decode — преобразование результата в JSON и обратно (например, bytes → размер)."""
+        if self.mode not in ("record", "replay") or request is None:
+            return await factory()
+
+        request = scrub(request)
+        key = request_key(kind, name, request)
+
+        if self.mode == "replay":
+            if key not in self._entries and self.match == "nearest":
+                key = self._nearest_key(kind, name, request, key) or key
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                raise decode_error({"type": "miss", "message": f"{kind}/{name}: нет записи в кассете"})
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            entry = entries[position % len(entries)]
+            self.replayed += 1
+            if entry["latency"] and self.latency_scale:
+                await asyncio.sleep(entry["latency"] * self.latency_scale)
+            if "error" in entry:
+                raise decode_error(entry["error"])
+            return decode(entry["response"]) if decode else entry["response"]
+
+        start = time.perf_counter()
+        entry = {"key": key, "kind": kind, "name": name, "request": request}
+        try:
+            result = await factory()
+        except Exception as e:
+            entry.update(error=scrub(encode_error(e)), latency=round(time.perf_counter() - start, 4))
+            self._write(entry)
+            raise
+        entry.update(response=scrub(encode(result) if encode else result), latency=round(time.perf_counter() - start, 4))
+        self._write(entry)
+        return result
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+cassette = Cassette(CASSETTE_MODE, CASSETTE_PATH, CASSETTE_LATENCY_SCALE, CASSETTE_MATCH)
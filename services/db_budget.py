@@ -0,0 +1,158 @@
+import os
+import json
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+from services.metrics import registry, route_label, db_hooks
+from services.logs import fields
+
+# Учёт обращений к БД (Supabase/PostgREST) в рамках одного запроса.
+# Каждый запрос к БД считается в контексте текущего HTTP-запроса; в ответ добавляются
+# заголовки X-DB-Roundtrips и X-DB-Time-Ms, а число обращений сравнивается с бюджетом маршрута.
+# DB_BUDGET_STRICT=true (для тестов и нагрузочных прогонов) — превышение бюджета
+# превращает ответ в 500, чтобы регрессия по числу запросов не доехала до прода.
+# Повтор одного и того же table/operation REPEATED_QUERY_THRESHOLD раз и больше — признак N+1.
+
+load_dotenv()
+DB_BUDGET_STRICT = os.getenv("DB_BUDGET_STRICT", "false").lower() == "true"
+
+DEFAULT_BUDGET = 10
+REPEATED_QUERY_THRESHOLD = 3
+
+# Сколько обращений к БД разрешено маршруту за один запрос — при холодном кэше профиля
+DB_BUDGETS = {
+    "/statistic/user/{user_id}/stats": 6,
+    "/practice/start": 5,
+    "/practice/chat": 2,
+    "/listening/unlock_card": 1,
+    "/listening/check_answer": 5,
+    "/listening/questions": 1,
+    "/listening/podcasts": 1,
+    "/listening/videos": 2,
+    "/reading/get_topics": 3,
+    "/reading/generate_article": 3,
+    "/reading/mark_as_read": 1,
+    "/reading/get_history": 1,
+    "/reading/get_history_item": 1,
+    "/reading/history_item": 1,
+    "/reading/prepare_word_cache": 2,
+    "/password/forgot/": 1,
+    "/password/reset-password/": 1,
+}
+
+logger = logging.getLogger(__name__)
+
+db_usage = ContextVar("db_usage", default=None)
+
+roundtrips_per_request = registry.histogram(
+    "db_roundtrips_per_request", "Обращений к БД за один HTTP-запрос", ("route",),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55))
+db_time_per_request = registry.histogram(
+    "db_time_per_request_seconds", "Суммарное время обращений к БД за один HTTP-запрос", ("route",))
+budget_exceeded = registry.counter(
+    "db_budget_exceeded_total", "Запросы, превысившие бюджет обращений к БД", ("route",))
+repeated_queries = registry.counter(
+    "db_repeated_queries_total", "Повторяющиеся обращения к одной таблице в запросе (возможный N+1)",
+    ("route", "table", "operation"))
+
+
+class DbUsage:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.targets = Counter()
+
+
+def record_roundtrip(table: str, operation: str, duration: float):
+    usage = db_usage.get()
+    if usage is not None:
+        usage.count += 1
+        usage.time += duration
+        usage.targets[(table, operation)] += 1
+
+
+db_hooks.append(record_roundtrip)
+
+
+@contextmanager
+def detached():
+    """Фоновые задачи, запущенные внутри блока, не учитываются в бюджете текущего запроса."""
+    token = db_usage.set(None)
+    try:
+        yield
+    finally:
+        db_usage.reset(token)
+
+
+def budget_for(route: str) -> int:
+    return DB_BUDGETS.get(route, DEFAULT_BUDGET)
+
+
+class DbBudgetMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        usage = DbUsage()
+        rejected = [False]
+
+        async def send_with_usage(message):
+            if rejected[0]:
+                return
+            if message["type"] == "http.response.start":
+                route = route_label(scope)
+                headers = [
+                    (b"x-db-roundtrips", str(usage.count).encode()),
+                    (b"x-db-time-ms", f"{usage.time * 1000:.1f}".encode()),
+                ]
+                if DB_BUDGET_STRICT and usage.count > budget_for(route):
+                    # Подменяем ответ: тело исходного ответа дальше не отправляем
+                    rejected[0] = True
+                    body = json.dumps({
+                        "detail": f"DB budget exceeded: {usage.count} > {budget_for(route)}",
+                        "route": route,
+                        "queries": {f"{operation} {table}": count for (table, operation), count in usage.targets.items()},
+                    }, ensure_ascii=False).encode("utf-8")
+                    await send({
+                        "type": "http.response.start",
+                        "status": 500,
+                        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + headers,
+                    })
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        token = db_usage.set(usage)
+        try:
+            await self.app(scope, receive, send_with_usage)
+        finally:
+            db_usage.reset(token)
+            self.report(route_label(scope), usage)
+
+    @staticmethod
+    def report(route: str, usage: DbUsage):
+        roundtrips_per_request.observe(usage.count, route)
+        if usage.count:
+            db_time_per_request.observe(usage.time, route)
+
+        budget = budget_for(route)
+        if usage.count > budget:
+            budget_exceeded.inc(route)
+            logger.warning("Превышен бюджет обращений к БД", extra=fields(
+                route=route, roundtrips=usage.count, budget=budget
+            ))
+
+        for (table, operation), count in usage.targets.items():
+            if count >= REPEATED_QUERY_THRESHOLD:
+                repeated_queries.inc(route, table, operation)
+                logger.warning("Возможный N+1: повторяющиеся запросы к БД", extra=fields(
+                    route=route, table=table, operation=operation, count=count
+                ))
@@ -0,0 +1,239 @@
+import os
+import time
+import json
+import random
+import asyncio
+import hashlib
+from collections import deque
+
+import aiohttp
+import openai
+from dotenv import load_dotenv
+
+from services.resilience import upstream, UpstreamUnavailable, UpstreamError
+from services.metrics import llm_latency, llm_tokens
+
+# Общий асинхронный шлюз к LLM.
+# Все вызовы OpenAI идут через llm.chat(...): общий пул соединений, лимиты
+# одновременных запросов и токенов в минуту на модель, повторы с джиттером
+# на 429/5xx и метрики по токенам и задержке каждого вызова.
+# Каждая попытка проходит через breaker и bulkhead upstream("openai").
+# LLM_BACKEND=fake включает детерминированный фейковый бэкенд для тестов.
+
+load_dotenv()
+
+DEFAULT_LIMITS = {
+    "gpt-4o-mini": {"concurrency": 16, "tpm": 200000},
+    "gpt-3.5-turbo": {"concurrency": 16, "tpm": 160000},
+}
+FALLBACK_LIMITS = {"concurrency": 8, "tpm": 60000}
+
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30))
+LATENCY_WINDOW = 1000  # Сколько последних задержек храним на модель
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, retryable: bool = False, status: int = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status = status
+
+
+class OpenAIBackend:
+    """Реальный OpenAI через общий aiohttp-пул (openai.aiosession)."""
+
+    def __init__(self, api_key: str, pool_size: int = 100):
+        openai.api_key = api_key
+        self.pool_size = pool_size
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        return self._session
+
+    async def chat(self, model: str, messages: list, timeout: float, **params) -> dict:
+        # openai.aiosession — ContextVar, поэтому выставляем его на время вызова
+        token = openai.aiosession.set(self._get_session())
+        try:
+            response = await openai.ChatCompletion.acreate(
+                model=model, messages=messages, request_timeout=timeout, **params
+            )
+        except (openai.error.RateLimitError, openai.error.ServiceUnavailableError,
+                openai.error.Timeout, openai.error.APIConnectionError, openai.error.TryAgain) as e:
+            raise LLMError(str(e), retryable=True, status=getattr(e, "http_status", None))
+        except openai.error.APIError as e:
+            status = getattr(e, "http_status", None)
+            raise LLMError(str(e), retryable=status is None or status >= 500, status=status)
+        except openai.error.OpenAIError as e:
+            raise LLMError(str(e), retryable=False, status=getattr(e, "http_status", None))
+        finally:
+            openai.aiosession.reset(token)
+
+        return {
+            "content": response["choices"][0]["message"]["content"],
+            "prompt_tokens": response.get("usage", {}).get("prompt_tokens", 0),
+            "completion_tokens": response.get("usage", {}).get("completion_tokens", 0),
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class FakeBackend:
+    """Детерминированный бэкенд для тестов: один и тот же запрос — один и тот же ответ.
+    responder(model, messages) -> str позволяет подставить свои ответы."""
+
+    def __init__(self, responder=None, latency: float = 0.0):
+        self.responder = responder
+        self.latency = latency
+        self.calls = []
+
+    async def chat(self, model: str, messages: list, timeout: float, **params) -> dict:
+        self.calls.append({"model": model, "messages": messages, **params})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.responder is not None:
+            content = self.responder(model, messages)
+        else:
+            digest = hashlib.sha256(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+            content = f"[{model}] fake reply {digest[:12]}"
+
+        return {
+            "content": content,
+            "prompt_tokens": estimate_tokens(messages),
+            "completion_tokens": len(content) // 4 + 1,
+        }
+
+    async def close(self):
+        pass
+
+
+def estimate_tokens(messages: list) -> int:
+    # Грубая оценка: ~4 символа на токен
+    return sum(len(m.get("content") or "") for m in messages) // 4 + 1
+
+
+class TokenBucket:
+    """Лимит токенов в минуту: ведро ёмкостью tpm, пополняется на tpm/60 в секунду."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: int):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class LLMGateway:
+    def __init__(self, backend, limits: dict = None, max_retries: int = MAX_RETRIES, timeout: float = REQUEST_TIMEOUT):
+        self.backend = backend
+        self.limits = limits if limits is not None else DEFAULT_LIMITS
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._semaphores = {}
+        self._buckets = {}
+        self.metrics = {}
+
+    def _limits_for(self, model: str) -> dict:
+        return self.limits.get(model, FALLBACK_LIMITS)
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self._limits_for(model)["concurrency"])
+        return self._semaphores[model]
+
+    def _bucket(self, model: str) -> TokenBucket:
+        if model not in self._buckets:
+            self._buckets[model] = TokenBucket(self._limits_for(model)["tpm"])
+        return self._buckets[model]
+
+    def _model_metrics(self, model: str) -> dict:
+        if model not in self.metrics:
+            self.metrics[model] = {
+                "calls": 0, "errors": 0, "retries": 0,
+                "prompt_tokens": 0, "completion_tokens": 0,
+                "latency_sum": 0.0, "latency_max": 0.0,
+                "latencies": deque(maxlen=LATENCY_WINDOW),
+            }
+        return self.metrics[model]
+
+    async def chat(self, model: str, messages: list, **params) -> str:
+        """Отправляет запрос в модель и возвращает текст ответа. После исчерпания
+        повторов или при неповторяемой ошибке бросает LLMError."""
+        stats = self._model_metrics(model)
+        await self._bucket(model).acquire(estimate_tokens(messages) + params.get("max_tokens", 0))
+
+        async with self._semaphore(model):
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                try:
+                    try:
+                        result = await upstream("openai").call(
+                            lambda: self.backend.chat(model, messages, timeout=self.timeout, **params),
+                            request={"model": model, "messages": messages, **params}
+                        )
+                    except UpstreamUnavailable as e:
+                        # Breaker разомкнут — повторять бессмысленно; таймаут — можно повторить
+                        raise LLMError(str(e), retryable=e.retryable)
+                    except UpstreamError as e:
+                        # Например, запроса нет в кассете при CASSETTE_MODE=replay
+                        raise LLMError(str(e), retryable=False)
+                except LLMError as e:
+                    llm_latency.observe(time.perf_counter() - start, model, "error")
+                    if not e.retryable or attempt == self.max_retries:
+                        stats["errors"] += 1
+                        raise
+                    stats["retries"] += 1
+                    # Экспоненциальная пауза с полным джиттером
+                    await asyncio.sleep(random.uniform(0, min(0.5 * 2 ** attempt, 20)))
+                    continue
+
+                latency = time.perf_counter() - start
+                llm_latency.observe(latency, model, "ok")
+                llm_tokens.inc(model, "prompt", amount=result["prompt_tokens"])
+                llm_tokens.inc(model, "completion", amount=result["completion_tokens"])
+                stats["calls"] += 1
+                stats["prompt_tokens"] += result["prompt_tokens"]
+                stats["completion_tokens"] += result["completion_tokens"]
+                stats["latency_sum"] += latency
+                stats["latency_max"] = max(stats["latency_max"], latency)
+                stats["latencies"].append(latency)
+                return result["content"]
+
+    def stats(self) -> dict:
+        """Метрики по моделям: вызовы, ошибки, токены, p50/p95 задержки (сек)."""
+        report = {}
+        for model, stats in self.metrics.items():
+            latencies = sorted(stats["latencies"])
+            report[model] = {key: value for key, value in stats.items() if key != "latencies"}
+            report[model]["latency_p50"] = latencies[len(latencies) // 2] if latencies else 0.0
+            report[model]["latency_p95"] = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+        return report
+
+    async def close(self):
+        await self.backend.close()
+
+
+def create_gateway() -> LLMGateway:
+    if os.getenv("LLM_BACKEND", "openai") == "fake":
+        return LLMGateway(FakeBackend())
+    return LLMGateway(OpenAIBackend(os.getenv("OPENAI_API_KEY")))
+
+
+llm = create_gateway()
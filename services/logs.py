@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import logging
+from uuid import uuid4
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+# Структурное логирование без блокировки event loop.
+# Запись кладётся в очередь (put_nowait), а в stderr её пишет фоновый поток QueueListener.
+# Каждая строка — JSON с request_id текущего запроса.
+# Построчные отладочные сообщения (по каждому подкасту, по каждому ответу) сэмплируются:
+#   logger.debug("...", extra=sampled(title=title))
+
+load_dotenv()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+LOG_QUEUE_SIZE = 10000
+
+request_id_var = ContextVar("request_id", default="-")
+
+_listener = None
+
+
+def fields(**values) -> dict:
+    """extra для logger: дополнительные поля JSON-записи."""
+    return {"fields": values}
+
+
+def sampled(rate: float = None, **values) -> dict:
+    """extra для logger: запись попадёт в лог с вероятностью rate (по умолчанию LOG_SAMPLE_RATE)."""
+    return {"fields": values, "sample": LOG_SAMPLE_RATE if rate is None else rate}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    # Сэмплирование и request_id — до постановки в очередь, пока мы в контексте запроса
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample", None)
+        if rate is not None and random.random() >= rate:
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Никогда не ждёт: при переполненной очереди запись отбрасывается и считается."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Форматирование (json, traceback) делает фоновый поток; здесь только фиксируем текст
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(JsonFormatter())
+
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    # uvicorn пишет в свои обработчики — направляем его логи в ту же очередь
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    # httpx (клиент Supabase) пишет INFO на каждый запрос к БД — на горячем пути это лишнее
+    for name in ("httpx", "httpcore", "hpack"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, writer, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    # Дописываем всё, что осталось в очереди
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """Берёт X-Request-ID из запроса (или создаёт новый), кладёт в контекст логов и возвращает в ответе."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        if not request_id or not request_id.isprintable():
+            request_id = uuid4().hex[:16]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import random
+import time
+from email.message import EmailMessage
+
+import aiosmtplib
+
+from services.logs import fields
+
+# Очередь исходящих писем.
+# Эндпоинт кладёт письмо в очередь и сразу отвечает, а воркеры отправляют письма
+# через постоянные авторизованные SMTP-соединения (по одному на воркер),
+# с повторами и ограничением частоты отправки.
+
+logger = logging.getLogger(__name__)
+
+
+class MailOutbox:
+    def __init__(self, hostname: str, port: int, username: str, password: str, sender: str,
+                 use_tls: bool = True, workers: int = 2, max_retries: int = 3,
+                 rate_per_sec: float = 2.0, queue_size: int = 1000, idle_timeout: float = 60.0):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        self.use_tls = use_tls
+        self.workers = workers
+        self.max_retries = max_retries
+        self.min_interval = 1.0 / rate_per_sec if rate_per_sec else 0.0
+        self.idle_timeout = idle_timeout
+
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self._rate_lock = asyncio.Lock()
+        self._next_send_at = 0.0
+        self.sent = 0
+        self.failed = 0
+
+    def enqueue(self, recipient: str, subject: str, body: str, subtype: str = "html") -> bool:
+        """Ставит письмо в очередь. False — очередь переполнена."""
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = recipient
+        message["Subject"] = subject
+        message.set_content(body, subtype=subtype)
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Дожидается отправки оставшихся писем (не дольше drain_timeout) и закрывает соединения."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _new_connection(self) -> aiosmtplib.SMTP:
+        return aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            username=self.username or None,
+            password=self.password or None,
+            use_tls=self.use_tls,
+            start_tls=False if self.use_tls else None,
+            timeout=30,
+        )
+
+    async def _wait_rate_slot(self):
+        # Равномерно распределяем отправку, чтобы всплеск сбросов не упёрся в лимиты SMTP
+        async with self._rate_lock:
+            now = time.monotonic()
+            delay = self._next_send_at - now
+            self._next_send_at = max(now, self._next_send_at) + self.min_interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _worker(self):
+        smtp = None
+        last_used = 0.0
+        try:
+            while True:
+                message = await self.queue.get()
+                try:
+                    for attempt in range(self.max_retries + 1):
+                        try:
+                            # Соединение, простоявшее дольше idle_timeout, сервер мог уже закрыть
+                            if smtp is not None and (not smtp.is_connected or time.monotonic() - last_used > self.idle_timeout):
+                                await self._close(smtp)
+                                smtp = None
+                            if smtp is None:
+                                smtp = self._new_connection()
+                                await smtp.connect()
+
+                            await self._wait_rate_slot()
+                            await smtp.send_message(message)
+                            last_used = time.monotonic()
+                            self.sent += 1
+                            break
+                        except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                            await self._close(smtp)
+                            smtp = None
+                            if attempt == self.max_retries:
+                                self.failed += 1
+                                logger.error("Письмо не отправлено", extra=fields(to=message["To"], error=str(e)))
+                                break
+                            # Экспоненциальная пауза с джиттером
+                            await asyncio.sleep(min(2 ** attempt, 30) * (0.5 + random.random()))
+                finally:
+                    self.queue.task_done()
+        finally:
+            await self._close(smtp)
+
+    @staticmethod
+    async def _close(smtp):
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError):
+            smtp.close()
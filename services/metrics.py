@@ -0,0 +1,250 @@
+import time
+from bisect import bisect_left
+
+import httpx
+
+from services.profiler import record_span
+
+# Метрики в текстовом формате Prometheus (GET /metrics).
+# Счётчики и гистограммы обновляются прямо в коде (одна операция со словарём),
+# а значения, которые и так хранятся в объектах (очереди, breaker'ы, кэши),
+# собираются функциями-коллекторами только в момент запроса /metrics.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labelvalues, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.values = {}  # labelvalues -> [счётчики по корзинам..., sum, count]
+
+    def observe(self, value: float, *labelvalues):
+        series = self.values.get(labelvalues)
+        if series is None:
+            series = self.values[labelvalues] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labelvalues, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _labels(self.labelnames, labelvalues, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labelnames, labelvalues, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            plain = _labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{plain} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{plain} {series[-1]}")
+        return lines
+
+
+class Collected:
+    """Метрика, значения которой при каждом /metrics отдаёт функция collect() -> {labelvalues: value}."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple, collect, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.collect = collect
+        self.kind = kind
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, value in self.collect().items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self.metrics.get(name) or self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.get(name) or self._add(Histogram(name, help, labelnames, buckets))
+
+    def collected(self, name: str, help: str, labelnames: tuple, collect, kind: str = "gauge") -> Collected:
+        return self._add(Collected(name, help, labelnames, collect, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # Сломавшийся коллектор не должен ронять весь /metrics
+                lines.append(f"# {metric.name}: collect failed: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP-запросы по маршруту, методу и статусу", ("route", "method", "status"))
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("route", "method"))
+supabase_latency = registry.histogram(
+    "supabase_request_duration_seconds", "Запросы к Supabase (PostgREST) по таблице и операции",
+    ("table", "operation", "status"))
+postgres_latency = registry.histogram(
+    "postgres_query_duration_seconds", "Прямые запросы к Postgres (asyncpg) по таблице и операции",
+    ("table", "operation", "status"))
+upstream_latency = registry.histogram(
+    "upstream_request_duration_seconds", "Вызовы внешних сервисов (Deepgram, ListenNotes, YouTube, Translate, OpenAI)",
+    ("upstream", "outcome"))
+llm_latency = registry.histogram(
+    "llm_request_duration_seconds", "Вызовы LLM по модели (одна попытка)", ("model", "outcome"))
+llm_tokens = registry.counter("llm_tokens_total", "Токены LLM по модели", ("model", "kind"))
+cache_requests = registry.counter("cache_requests_total", "Обращения к кэшам: hit/miss", ("cache", "result"))
+
+
+def route_label(scope) -> str:
+    # Неизвестные пути сводим в одну метку, чтобы не раздувать число рядов.
+    # Метка — шаблон сработавшего маршрута (/statistic/user/{user_id}/stats, /static/{path}),
+    # а не путь с подставленными именами: значение параметра может встречаться в пути и ещё раз
+    prefix = mount_prefix(scope)
+    route = scope.get("route")
+    if route is not None:
+        # FastAPI подключает роутеры лениво: в scope["route"] — маршрут без префикса include_router,
+        # полный шаблон лежит в контексте выбранного маршрута
+        context = scope.get("fastapi", {}).get("effective_route_context")
+        template = getattr(context, "path_format", None) or getattr(route, "path_format", None)
+        if template is not None:
+            return prefix + template
+    if prefix:
+        # Mount (StaticFiles) не кладёт маршрут в scope — остаётся только префикс монтирования
+        return prefix + "/{path}"
+    return "unmatched"
+
+
+def mount_prefix(scope) -> str:
+    """Часть root_path, добавленная Mount; префикс прокси (--root-path) в метку не входит."""
+    app_root_path = scope.get("app_root_path")
+    if app_root_path is None:
+        return ""
+    return scope.get("root_path", "")[len(app_root_path):]
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: считает запросы и время по шаблону маршрута (/podcasts, а не /podcasts?user_id=...)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = route_label(scope)
+            method = scope["method"]
+            http_requests.inc(route, method, str(status[0]))
+            http_latency.observe(time.perf_counter() - start, route, method)
+
+
+POSTGREST_OPERATIONS = {"GET": "select", "HEAD": "count", "PATCH": "update", "DELETE": "delete"}
+
+# Дополнительные обработчики каждого запроса к БД: hook(table, operation, duration)
+db_hooks = []
+
+
+def postgrest_target(request: httpx.Request) -> tuple:
+    # /rest/v1/<table> или /rest/v1/rpc/<function>
+    path = request.url.path.split("/rest/v1/", 1)[-1].strip("/")
+    if path.startswith("rpc/"):
+        return path[4:], "rpc"
+    if request.method == "POST":
+        prefer = request.headers.get("prefer", "")
+        return path, "upsert" if "resolution=" in prefer else "insert"
+    return path, POSTGREST_OPERATIONS.get(request.method, request.method.lower())
+
+
+class TimedTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport):
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = self.transport.handle_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            duration = time.perf_counter() - start
+            table, operation = postgrest_target(request)
+            supabase_latency.observe(duration, table, operation, status)
+            record_span("supabase", f"{operation} {table}", start, duration, status)
+            for hook in db_hooks:
+                hook(table, operation, duration)
+
+    def close(self):
+        self.transport.close()
+
+
+def instrument_supabase(client):
+    """Подменяет транспорт httpx у PostgREST-клиента supabase, чтобы мерить каждый запрос."""
+    session = client.postgrest.session
+    if not isinstance(session._transport, TimedTransport):
+        session._transport = TimedTransport(session._transport)
+    return client
@@ -0,0 +1,87 @@
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from services.storage import storage
+from services.shared_state import state
+from services.single_flight import flights
+from services.metrics import cache_requests
+
+# Кэш профиля пользователя (level, unlocked_level, email) в памяти воркера.
+# Уровень нужен почти каждому маршруту, а меняется редко — вместо запроса к БД
+# на каждый вызов профиль живёт PROFILE_CACHE_TTL секунд.
+# Запись уровня (unlock_card, смена level) вызывает invalidate(user_id): событие уходит
+# в канал PROFILE_CHANNEL (services/shared_state.py) и сбрасывает профиль во всех воркерах.
+
+load_dotenv()
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", 600))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", 10000))
+
+PROFILE_CHANNEL = "profile_invalidate"
+
+
+class ProfileCache:
+    def __init__(self, storage, ttl: float = PROFILE_CACHE_TTL, max_size: int = PROFILE_CACHE_SIZE):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_size = max_size
+        self._profiles = OrderedDict()
+        self._loading = {}  # user_id -> метка идущей загрузки (одна на пользователя — single-flight)
+
+    def _drop(self, user_id: str):
+        self._profiles.pop(user_id, None)
+        # Загрузка этого пользователя, начатая до сброса, не кладёт результат в кэш (мог устареть);
+        # загрузки других пользователей сброс не затрагивает
+        self._loading.pop(user_id, None)
+
+    async def _load(self, user_id: str):
+        token = object()
+        self._loading[user_id] = token
+        try:
+            profile = await self.storage.get_profile(user_id)
+        finally:
+            current = self._loading.get(user_id)
+            if current is token:
+                del self._loading[user_id]
+        # Отсутствующего пользователя не кэшируем — профиль может появиться сразу после регистрации
+        if profile is not None and current is token:
+            self._profiles[user_id] = (time.monotonic() + self.ttl, profile)
+            self._profiles.move_to_end(user_id)
+            while len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+        return profile
+
+    async def get(self, user_id: str):
+        """Профиль {level, unlocked_level, email} или None, если пользователя нет."""
+        profile = self.peek(user_id)
+        if profile is not None:
+            cache_requests.inc("profile", "hit")
+            return profile
+        cache_requests.inc("profile", "miss")
+        # Одновременные промахи по одному пользователю — один запрос к БД
+        return await flights.do(("profile", user_id), lambda: self._load(user_id))
+
+    def peek(self, user_id: str):
+        """Профиль из кэша без обращения к БД; None — в кэше нет или устарел."""
+        cached = self._profiles.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        return None
+
+    async def get_level(self, user_id: str):
+        profile = await self.get(user_id)
+        return profile["level"] if profile else None
+
+    async def invalidate(self, user_id: str):
+        self._drop(user_id)
+        await state.publish(PROFILE_CHANNEL, user_id)
+
+    async def start(self):
+        await state.subscribe(PROFILE_CHANNEL, self._drop)
+
+    def size(self) -> int:
+        return len(self._profiles)
+
+
+profiles = ProfileCache(storage)
@@ -0,0 +1,177 @@
+import os
+import sys
+import hmac
+import time
+import random
+import threading
+from uuid import uuid4
+from collections import deque, Counter
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+# Сэмплирующий профайлер отдельных запросов (выключен по умолчанию).
+# Включается для запроса заголовком X-Profile: <ADMIN_TOKEN> или случайно с долей PROFILE_SAMPLE_RATE.
+# Пока идёт профилируемый запрос, фоновый поток каждые PROFILE_INTERVAL_MS снимает стек
+# потока event loop (sys._current_frames) — получаем «свёрнутые» стеки для flamegraph.
+# Параллельно записывается таймлайн вызовов внешних сервисов и Supabase (record_span).
+# Профили хранятся в памяти (последние PROFILE_KEEP) и отдаются через /admin/profiles.
+#
+# Стек снимается с потока event loop целиком, поэтому при параллельных запросах
+# в профиль попадают и чужие корутины — таймлайн при этом только свой.
+
+load_dotenv()
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+PROFILE_KEEP = 50
+MAX_STACK_DEPTH = 64
+
+current_profile = ContextVar("current_profile", default=None)
+
+profiles = deque(maxlen=PROFILE_KEEP)
+
+
+def enabled() -> bool:
+    return bool(ADMIN_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+
+class Profile:
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.samples = Counter()
+        self.timeline = []
+
+    def to_dict(self, full: bool = True) -> dict:
+        data = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "status": self.status,
+            "samples": sum(self.samples.values()),
+        }
+        if full:
+            data["timeline"] = self.timeline
+            data["top_stacks"] = [{"stack": stack, "samples": count} for stack, count in self.samples.most_common(20)]
+        return data
+
+    def folded(self) -> str:
+        """Свёрнутые стеки (формат flamegraph.pl / speedscope): «a;b;c количество»."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.items()) + "\n"
+
+
+def record_span(kind: str, name: str, start: float, duration: float, outcome: str = "ok"):
+    """Добавляет вызов в таймлайн текущего профиля; без профиля — ничего не делает."""
+    profile = current_profile.get()
+    if profile is not None:
+        profile.timeline.append({
+            "kind": kind,
+            "name": name,
+            "start_ms": round((start - profile.start) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+            "outcome": outcome,
+        })
+
+
+def fold_stack(frame) -> str:
+    parts = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class Sampler:
+    """Один фоновый поток на процесс; работает, только пока есть активные профили."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._active = {}  # profile.id -> (profile, id потока event loop)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def attach(self, profile: Profile, thread_id: int):
+        with self._lock:
+            self._active[profile.id] = (profile, thread_id)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def detach(self, profile: Profile):
+        with self._lock:
+            self._active.pop(profile.id, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                active = list(self._active.values())
+            frames = sys._current_frames()
+            for profile, thread_id in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    profile.samples[fold_stack(frame)] += 1
+            time.sleep(self.interval)
+
+
+sampler = Sampler(PROFILE_INTERVAL)
+
+
+def should_profile(scope) -> str:
+    """Причина профилирования запроса или None."""
+    if ADMIN_TOKEN:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                # Сравнение за постоянное время, как в routers/admin.py; байты — чтобы не-ASCII не ронял compare_digest
+                return "header" if hmac.compare_digest(value, ADMIN_TOKEN.encode("utf-8")) else None
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def get_profile(profile_id: str):
+    for profile in profiles:
+        if profile.id == profile_id:
+            return profile
+    return None
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        reason = should_profile(scope) if scope["type"] == "http" else None
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"], reason)
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        token = current_profile.set(profile)
+        sampler.attach(profile, threading.get_ident())
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            sampler.detach(profile)
+            current_profile.reset(token)
+            profile.duration = time.perf_counter() - profile.start
+            profiles.append(profile)
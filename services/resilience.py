@@ -0,0 +1,222 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+import aiohttp
+from fastapi import HTTPException
+
+from services.metrics import upstream_latency
+from services.logs import fields
+from services.profiler import record_span
+from services.cassettes import cassette
+
+# Защита от деградации внешних сервисов (OpenAI, Deepgram, ListenNotes, YouTube, Google Translate).
+# Каждый вызов идёт через upstream(name).call(...):
+#   - дедлайн на весь вызов;
+#   - bulkhead — не больше max_concurrency одновременных вызовов сервиса;
+#   - circuit breaker — после серии ошибок сервис «размыкается» и запросы
+#     сразу получают отказ, а через reset_timeout пропускается один пробный вызов;
+#   - при ошибке или разомкнутом breaker отдаём последний удачный ответ по cache_key (stale).
+# В режиме записи/воспроизведения (services/cassettes.py) factory() пишется в кассету
+# или подменяется записанным ответом — breaker, bulkhead и метрики работают как обычно.
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(Exception):
+    """Сервис недоступен (breaker разомкнут, bulkhead переполнен или ошибка), а stale-ответа нет."""
+
+    def __init__(self, name: str, reason: str, retryable: bool = False):
+        super().__init__(f"{name}: {reason}")
+        self.name = name
+        self.reason = reason
+        self.retryable = retryable
+
+
+class UpstreamError(Exception):
+    """Ошибка ответа внешнего сервиса (например, 5xx), которая учитывается breaker'ом."""
+
+
+def is_failure(exc: Exception) -> bool:
+    # Ошибки клиента (4xx, неповторяемые ошибки LLM) не говорят о деградации сервиса
+    if isinstance(exc, HTTPException):
+        return exc.status_code >= 500
+    if hasattr(exc, "retryable"):
+        return exc.retryable
+    return True
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        # В полуоткрытом состоянии пропускаем ровно один пробный вызов
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        # Пробный вызов не дошёл до сервиса или отменён (bulkhead, CancelledError) — разрешаем следующий
+        self._probe_in_flight = False
+
+
+class Upstream:
+    def __init__(self, name: str, timeout: float, max_concurrency: int, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0, queue_timeout: float = 1.0,
+                 stale_ttl: float = 24 * 3600, stale_size: int = 1000):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.stale_ttl = stale_ttl
+        self.stale_size = stale_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self._semaphore = None
+        self._stale = OrderedDict()
+        self.in_flight = 0
+        self.counters = {"calls": 0, "failures": 0, "timeouts": 0, "rejected": 0, "stale_served": 0}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _remember(self, cache_key, value):
+        self._stale[cache_key] = (time.monotonic(), value)
+        self._stale.move_to_end(cache_key)
+        while len(self._stale) > self.stale_size:
+            self._stale.popitem(last=False)
+
+    def _fallback(self, cache_key, reason: str, exc: Exception = None, retryable: bool = False):
+        if cache_key is not None and cache_key in self._stale:
+            stored_at, value = self._stale[cache_key]
+            if time.monotonic() - stored_at <= self.stale_ttl:
+                self.counters["stale_served"] += 1
+                logger.warning("⚠️ Сервис недоступен, отдаём сохранённый ответ", extra=fields(upstream=self.name, reason=reason))
+                return value
+        if exc is not None:
+            raise exc
+        raise UpstreamUnavailable(self.name, reason, retryable)
+
+    def _record(self, start: float, outcome: str):
+        duration = time.perf_counter() - start
+        upstream_latency.observe(duration, self.name, outcome)
+        record_span("upstream", self.name, start, duration, outcome)
+
+    async def call(self, factory, cache_key=None, request=None):
+        """Выполняет factory() с дедлайном, bulkhead и breaker.
+        cache_key — ключ для stale-ответа при недоступности сервиса.
+        request — описание запроса для кассеты (по умолчанию cache_key)."""
+        if request is None:
+            request = cache_key
+        if not self.breaker.allow():
+            self.counters["rejected"] += 1
+            return self._fallback(cache_key, "circuit open")
+
+        semaphore = self._get_semaphore()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.breaker.release_probe()
+            self.counters["rejected"] += 1
+            return self._fallback(cache_key, "bulkhead full")
+        except BaseException:
+            # Отмена (клиент отключился) пока ждали слот: иначе пробный вызов «висит» и breaker не закрыть
+            self.breaker.release_probe()
+            raise
+
+        self.in_flight += 1
+        self.counters["calls"] += 1
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(
+                cassette.intercept("upstream", self.name, request, factory), timeout=self.timeout
+            )
+        except asyncio.TimeoutError:
+            self._record(start, "timeout")
+            self.counters["timeouts"] += 1
+            self.counters["failures"] += 1
+            self.breaker.record_failure()
+            return self._fallback(cache_key, f"timeout {self.timeout}s", retryable=True)
+        except Exception as e:
+            self._record(start, "error")
+            if not is_failure(e):
+                self.breaker.record_success()
+                raise
+            self.counters["failures"] += 1
+            self.breaker.record_failure()
+            return self._fallback(cache_key, str(e), exc=e)
+        except BaseException:
+            # Отмена вызова — не сбой сервиса; пробный вызов освобождаем, отмену пробрасываем
+            self._record(start, "cancelled")
+            self.breaker.release_probe()
+            raise
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+
+        self._record(start, "ok")
+        self.breaker.record_success()
+        if cache_key is not None:
+            self._remember(cache_key, result)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            **self.counters,
+        }
+
+
+UPSTREAMS = {
+    "openai": Upstream("openai", timeout=60, max_concurrency=32, queue_timeout=30),
+    "deepgram": Upstream("deepgram", timeout=120, max_concurrency=8, queue_timeout=60),
+    "listennotes": Upstream("listennotes", timeout=10, max_concurrency=8),
+    "youtube": Upstream("youtube", timeout=10, max_concurrency=8),
+    "google_translate": Upstream("google_translate", timeout=5, max_concurrency=16),
+}
+
+
+def upstream(name: str) -> Upstream:
+    return UPSTREAMS[name]
+
+
+def stats() -> dict:
+    return {name: item.stats() for name, item in UPSTREAMS.items()}
+
+
+# Таймаут для aiohttp-сессий, чтобы зависшее соединение не держало воркер дольше дедлайна
+def client_timeout(name: str) -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(total=UPSTREAMS[name].timeout)
@@ -0,0 +1,92 @@
+import time
+import json
+import logging
+from collections import OrderedDict
+
+from services.shared_state import state
+from services.single_flight import flights
+from services.db_budget import detached
+from services.metrics import cache_requests
+from services.logs import fields
+
+# Кэш ответов с TTL и stale-while-revalidate, в два уровня:
+# память воркера и общее хранилище (services/shared_state.py, Redis при REDIS_URL).
+#   возраст < ttl                — свежий ответ (hit);
+#   ttl <= возраст < ttl + stale — отдаём сохранённое сразу и обновляем в фоне (stale);
+#   иначе или нет записи         — загружаем (miss); одновременные промахи — одна загрузка.
+# Ошибки загрузки не кэшируются. Значения должны сериализоваться в JSON.
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    def __init__(self, name: str, ttl: float, stale_ttl: float, max_size: int = 1000):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self._local = OrderedDict()
+
+    def _key(self, key) -> str:
+        return f"cache:{self.name}:{json.dumps(key, ensure_ascii=False)}"
+
+    def _remember(self, key: str, entry: dict):
+        self._local[key] = entry
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    async def _lookup(self, key: str):
+        entry = self._local.get(key)
+        if entry is not None:
+            return entry
+        try:
+            raw = await state.get(key)
+        except Exception as e:
+            # Общее хранилище недоступно — работаем только с памятью воркера
+            logger.warning("⚠️ Ошибка чтения общего кэша", extra=fields(cache=self.name, error=str(e)))
+            return None
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        self._remember(key, entry)
+        return entry
+
+    async def _load(self, key: str, loader):
+        value = await loader()
+        # Время записи — по часам, а не monotonic: запись читают и другие воркеры
+        entry = {"stored_at": time.time(), "value": value}
+        self._remember(key, entry)
+        try:
+            await state.set(key, json.dumps(entry, ensure_ascii=False), ttl=self.ttl + self.stale_ttl)
+        except Exception as e:
+            logger.warning("⚠️ Ошибка записи общего кэша", extra=fields(cache=self.name, error=str(e)))
+        return value
+
+    async def _revalidate(self, key: str, loader):
+        try:
+            await self._load(key, loader)
+        except Exception as e:
+            # Остаётся прежний ответ до конца stale-окна
+            logger.warning("⚠️ Не удалось обновить кэш", extra=fields(cache=self.name, error=str(e)))
+
+    async def get(self, key, loader):
+        """Значение по key: из кэша или через loader() (корутина без аргументов).
+        Возвращает (значение, результат: hit | stale | miss)."""
+        key = self._key(key)
+        entry = await self._lookup(key)
+        if entry is not None:
+            age = time.time() - entry["stored_at"]
+            if age < self.ttl:
+                cache_requests.inc(self.name, "hit")
+                return entry["value"], "hit"
+            if age < self.ttl + self.stale_ttl:
+                cache_requests.inc(self.name, "stale")
+                # Фоновое обновление не относится к текущему запросу (бюджет БД) и не дублируется
+                with detached():
+                    flights.launch(("revalidate", key), lambda: self._revalidate(key, loader))
+                return entry["value"], "stale"
+
+        cache_requests.inc(self.name, "miss")
+        value = await flights.do(("cache", key), lambda: self._load(key, loader))
+        return value, "miss"
@@ -0,0 +1,196 @@
+import os
+import json
+import zlib
+import hashlib
+from dotenv import load_dotenv
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:  # без orjson — стандартный json
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # без brotli — только gzip
+    brotli = None
+
+from services.metrics import registry, route_label
+
+# Слой ответов для всего приложения:
+#   FastJSONResponse   — класс ответа по умолчанию: orjson (если установлен) вместо json.dumps,
+#                        UTF-8 без \u-экранирования кириллицы и без лишних пробелов;
+#   ResponseMiddleware — сжатие br/gzip по Accept-Encoding для ответов от COMPRESS_MIN_SIZE байт
+#                        (потоковые ответы сжимаются по кускам) и сильный ETag для GET:
+#                        хэш тела ответа; совпал If-None-Match — 304 без тела.
+# Неизменяемое содержимое (статья из истории, вопросы по транскрипциям, каталог тем)
+# при повторном запросе отдаётся как 304 — клиент берёт его из своего кэша.
+
+load_dotenv()
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
+RESPONSE_ETAGS = os.getenv("RESPONSE_ETAGS", "1") != "0"
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+compressed_responses = registry.counter(
+    "http_responses_compressed_total", "Сжатые ответы по кодировке", ("encoding",))
+compression_saved = registry.counter(
+    "http_compression_saved_bytes_total", "Байты, сэкономленные сжатием ответов", ("encoding",))
+not_modified = registry.counter(
+    "http_not_modified_total", "Ответы 304 по If-None-Match", ("route",))
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    # charset явно: иначе часть HTTP-клиентов читает тело не как UTF-8
+    media_type = "application/json; charset=utf-8"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def negotiate(accept_encoding: str):
+    """br или gzip — что клиент принимает (q > 0), с предпочтением br; иначе None."""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compressor(encoding: str):
+    """Функция compress(chunk, final) -> bytes: каждый кусок сбрасывается сразу,
+    чтобы потоковый ответ (ndjson) доходил до клиента без задержки."""
+    if encoding == "br":
+        state = brotli.Compressor(quality=BROTLI_QUALITY)
+        return lambda chunk, final: state.process(chunk) + (state.finish() if final else state.flush())
+
+    # wbits=31 — формат gzip; время в заголовке нулевое, поэтому одно тело всегда даёт одни байты
+    state = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return lambda chunk, final: state.compress(chunk) + state.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def make_etag(body: bytes, encoding=None) -> str:
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    # Сжатое и несжатое тело — разные представления, у сильного ETag они различаются
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match сравнивается слабо: W/"x" совпадает с "x"
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def compressible(headers) -> bool:
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES) and "content-encoding" not in headers
+
+
+class ResponseMiddleware:
+    def __init__(self, app, min_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = negotiate(request_headers.get("accept-encoding", ""))
+        conditional = RESPONSE_ETAGS and scope["method"] == "GET"
+        if encoding is None and not conditional:
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = request_headers.get("if-none-match")
+        start = None
+        compress = None
+
+        async def send_with_encoding(message):
+            nonlocal start, compress
+            if message["type"] == "http.response.start":
+                # Заголовки отправим вместе с первым куском тела — от него зависят ETag и сжатие
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start is not None:
+                start["headers"] = list(start.get("headers", []))
+                headers = MutableHeaders(raw=start["headers"])
+                start_message, start = start, None
+
+                if more_body:
+                    # Потоковый ответ: ETag не считаем, сжимаем по мере отправки
+                    if encoding is not None and compressible(headers):
+                        compress = compressor(encoding)
+                        del headers["content-length"]
+                        headers["content-encoding"] = encoding
+                        headers.add_vary_header("Accept-Encoding")
+                        compressed_responses.inc(encoding)
+                    await send(start_message)
+                else:
+                    await self._send_whole(scope, start_message, headers, body, encoding, conditional, if_none_match, send)
+                    return
+
+            if compress is not None:
+                body = compress(body, not more_body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_with_encoding)
+
+    async def _send_whole(self, scope, start, headers, body, encoding, conditional, if_none_match, send):
+        use_encoding = encoding if encoding is not None and len(body) >= self.min_size and compressible(headers) else None
+        if use_encoding is not None:
+            headers.add_vary_header("Accept-Encoding")
+
+        if conditional and start["status"] == 200 and "etag" not in headers and compressible(headers):
+            headers["etag"] = make_etag(body, use_encoding)
+            if "cache-control" not in headers:
+                # Клиент хранит ответ, но перед использованием сверяет ETag
+                headers["cache-control"] = "private, no-cache"
+            if if_none_match and etag_matches(if_none_match, headers["etag"]):
+                not_modified.inc(route_label(scope))
+                for name in ("content-type", "content-length"):
+                    del headers[name]
+                await send({"type": "http.response.start", "status": 304, "headers": headers.raw})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        if use_encoding is not None:
+            compressed = compressor(use_encoding)(body, True)
+            compressed_responses.inc(use_encoding)
+            compression_saved.inc(use_encoding, amount=max(len(body) - len(compressed), 0))
+            body = compressed
+            headers["content-encoding"] = use_encoding
+            headers["content-length"] = str(len(body))
+
+        await send(start)
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,215 @@
+import os
+import time
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+from services.logs import fields
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # redis нужен только при заданном REDIS_URL
+    redis = None
+
+# Общее состояние между воркерами uvicorn (лимиты, счётчики).
+# При заданном REDIS_URL состояние хранится в Redis и видно всем воркерам;
+# без него используется LocalStateBackend — локальная замена для тестов и разработки.
+# get/set — общий кэш значений (строк) с TTL.
+# publish/subscribe — канал событий между воркерами (например, сброс кэша профиля):
+# в Redis через PUBLISH/SUBSCRIBE, локально — вызов обработчиков в том же процессе.
+
+load_dotenv()
+REDIS_URL = os.getenv("REDIS_URL")
+
+LOCAL_VALUES_LIMIT = 10000
+
+logger = logging.getLogger(__name__)
+
+# Token bucket атомарно внутри Redis: возвращает {разрешено, через сколько секунд повторить}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+# Слоты одновременных запросов: проверка лимита и INCR — одной операцией.
+# TTL ставится только при создании ключа: продление на каждом захвате держало бы
+# «утёкшие» слоты вечно под постоянной нагрузкой
+ACQUIRE_SLOT_SCRIPT = """
+local count = tonumber(redis.call('GET', KEYS[1]) or '0')
+if count >= tonumber(ARGV[1]) then
+    return 0
+end
+if redis.call('INCR', KEYS[1]) == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+# Счётчик не уходит ниже нуля: ключ мог истечь по TTL, пока слот был занят.
+# На нуле ключ удаляется — следующий захват создаст его со свежим TTL
+RELEASE_SLOT_SCRIPT = """
+local count = tonumber(redis.call('GET', KEYS[1]) or '0')
+if count <= 1 then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+return redis.call('DECR', KEYS[1])
+"""
+
+
+class LocalStateBackend:
+    def __init__(self):
+        self._buckets = {}
+        self._slots = {}
+        self._values = {}
+        self._handlers = {}
+
+    async def token_bucket(self, key: str, capacity: float, rate: float, cost: float = 1.0) -> tuple:
+        """Списывает cost токенов из ведра key. Возвращает (разрешено, retry_after в секундах)."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        if tokens >= cost:
+            self._buckets[key] = (tokens - cost, now)
+            return True, 0.0
+        self._buckets[key] = (tokens, now)
+        return False, (cost - tokens) / rate
+
+    async def acquire_slot(self, key: str, limit: int, ttl: int = 300) -> bool:
+        """Занимает один из limit слотов key (глобальный лимит одновременных запросов)."""
+        if self._slots.get(key, 0) >= limit:
+            return False
+        self._slots[key] = self._slots.get(key, 0) + 1
+        return True
+
+    async def release_slot(self, key: str):
+        count = self._slots.get(key, 0) - 1
+        if count > 0:
+            self._slots[key] = count
+        else:
+            self._slots.pop(key, None)
+
+    async def get(self, key: str):
+        item = self._values.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ttl: float):
+        now = time.monotonic()
+        if len(self._values) >= LOCAL_VALUES_LIMIT:
+            # Чистим просроченные значения, которые больше никто не читал
+            self._values = {k: item for k, item in self._values.items() if item[0] > now}
+        self._values[key] = (now + ttl, value)
+
+    async def publish(self, channel: str, message: str):
+        for handler in self._handlers.get(channel, []):
+            handler(message)
+
+    async def subscribe(self, channel: str, handler):
+        """handler(message) вызывается на каждое сообщение канала, в том числе от этого же воркера."""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def close(self):
+        pass
+
+
+class RedisStateBackend:
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("Для REDIS_URL нужен пакет redis")
+        self.client = redis.from_url(url)
+        self._token_bucket = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._acquire_slot = self.client.register_script(ACQUIRE_SLOT_SCRIPT)
+        self._release_slot = self.client.register_script(RELEASE_SLOT_SCRIPT)
+        self._handlers = {}
+        self._pubsub = None
+        self._listener = None
+
+    async def token_bucket(self, key: str, capacity: float, rate: float, cost: float = 1.0) -> tuple:
+        allowed, retry_after = await self._token_bucket(keys=[f"bucket:{key}"], args=[capacity, rate, time.time(), cost])
+        return bool(int(allowed)), float(retry_after)
+
+    async def acquire_slot(self, key: str, limit: int, ttl: int = 300) -> bool:
+        # ttl страхует от «утёкших» слотов, если воркер упал, не освободив их
+        acquired = await self._acquire_slot(keys=[f"slots:{key}"], args=[limit, ttl])
+        return bool(int(acquired))
+
+    async def release_slot(self, key: str):
+        await self._release_slot(keys=[f"slots:{key}"])
+
+    async def get(self, key: str):
+        value = await self.client.get(f"value:{key}")
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self.client.set(f"value:{key}", value, ex=max(1, int(ttl)))
+
+    async def publish(self, channel: str, message: str):
+        await self.client.publish(channel, message)
+
+    async def subscribe(self, channel: str, handler):
+        if self._pubsub is None:
+            self._pubsub = self.client.pubsub()
+        self._handlers.setdefault(channel, []).append(handler)
+        await self._pubsub.subscribe(channel)
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                async for item in self._pubsub.listen():
+                    if item["type"] != "message":
+                        continue
+                    channel = item["channel"].decode() if isinstance(item["channel"], bytes) else item["channel"]
+                    message = item["data"].decode() if isinstance(item["data"], bytes) else item["data"]
+                    for handler in self._handlers.get(channel, []):
+                        handler(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Обрыв соединения с Redis — переподписываемся через секунду
+                logger.warning("⚠️ Ошибка подписки Redis", extra=fields(error=str(e)))
+                await asyncio.sleep(1)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self.client.aclose()
+
+
+def create_state_backend():
+    if REDIS_URL:
+        return RedisStateBackend(REDIS_URL)
+    return LocalStateBackend()
+
+
+state = create_state_backend()
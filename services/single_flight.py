@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+from services.logs import fields
+
+# Single-flight: одновременные вызовы с одинаковым ключом разделяют одну
+# выполняющуюся задачу. Двойной тап или повтор запроса клиентом по таймауту
+# не запускают ту же дорогую работу (LLM, ListenNotes, Deepgram) второй раз.
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.shared = 0
+
+    def _start(self, key, factory, background: bool = False) -> asyncio.Task:
+        # Работа идёт отдельной задачей: отмена одного из ожидающих не отменяет её для остальных
+        task = asyncio.ensure_future(factory())
+        self._calls[key] = task
+        self.started += 1
+
+        def _done(finished):
+            if self._calls.get(key) is finished:
+                del self._calls[key]
+            # Помечаем исключение как полученное, даже если все ожидающие уже отменены
+            if finished.cancelled():
+                return
+            error = finished.exception()
+            # Ошибку фоновой задачи (launch) больше никто не увидит — пишем её в лог
+            if error is not None and background:
+                logger.error("❌ Фоновая задача завершилась с ошибкой",
+                             extra=fields(flight=str(key), error=str(error)), exc_info=error)
+
+        task.add_done_callback(_done)
+        return task
+
+    async def do(self, key, factory):
+        """Выполняет factory() один раз на ключ; остальные вызовы ждут тот же результат
+        (или то же исключение)."""
+        task = self._calls.get(key)
+        if task is None:
+            task = self._start(key, factory)
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def launch(self, key, factory) -> bool:
+        """Фоновая задача без ожидания результата. False — такая задача уже выполняется."""
+        if key in self._calls:
+            self.shared += 1
+            return False
+        self._start(key, factory, background=True)
+        return True
+
+    def in_flight(self, key) -> bool:
+        return key in self._calls
+
+
+flights = SingleFlight()
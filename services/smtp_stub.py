@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+from email import message_from_bytes
+
+# Локальная замена SMTP-сервера для тестов и разработки.
+# Принимает любые логины, ничего не отправляет, а складывает письма в self.messages.
+#
+#   python -m services.smtp_stub --port 8025
+#   MAIL_SERVER=127.0.0.1 MAIL_PORT=8025 MAIL_SSL_TLS=false uvicorn main:app
+
+
+class SMTPStub:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.messages = []
+        self.connections = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 smtp-stub ready")
+        sender, recipients = None, []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+
+                if verb == "EHLO":
+                    await reply("250-smtp-stub")
+                    await reply("250-AUTH PLAIN LOGIN")
+                    await reply("250 8BITMIME")
+                elif verb == "HELO":
+                    await reply("250 smtp-stub")
+                elif verb == "AUTH":
+                    parts = command.split()
+                    mechanism = parts[1].upper() if len(parts) > 1 else ""
+                    if mechanism == "LOGIN":
+                        # Логин (если не пришёл сразу в команде) и пароль — отдельными строками
+                        prompts = ["334 UGFzc3dvcmQ6"] if len(parts) > 2 else ["334 VXNlcm5hbWU6", "334 UGFzc3dvcmQ6"]
+                    elif len(parts) == 2:
+                        prompts = ["334 "]
+                    else:
+                        prompts = []
+                    for prompt in prompts:
+                        await reply(prompt)
+                        await reader.readline()
+                    await reply("235 Authentication successful")
+                elif verb == "MAIL":
+                    sender, recipients = command.split(":", 1)[1].strip(), []
+                    await reply("250 OK")
+                elif verb == "RCPT":
+                    recipients.append(command.split(":", 1)[1].strip())
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    lines = []
+                    while True:
+                        data_line = await reader.readline()
+                        if data_line in (b".\r\n", b".\n", b""):
+                            break
+                        lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                    self.messages.append({
+                        "sender": sender,
+                        "recipients": recipients,
+                        "message": message_from_bytes(b"".join(lines)),
+                    })
+                    await reply("250 OK: queued")
+                elif verb in ("RSET", "NOOP"):
+                    await reply("250 OK")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host: str, port: int):
+    stub = await SMTPStub(host, port).start()
+    print(f"SMTP stub слушает {stub.host}:{stub.port}")
+    try:
+        while True:
+            count = len(stub.messages)
+            await asyncio.sleep(1)
+            for item in stub.messages[count:]:
+                print(f"📨 {item['recipients']}: {item['message']['Subject']}")
+    finally:
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный SMTP stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
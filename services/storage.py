@@ -0,0 +1,479 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+from datetime import datetime
+from uuid import UUID
+from supabase import create_client
+from dotenv import load_dotenv
+
+try:
+    import asyncpg
+except ImportError:  # asyncpg нужен только при заданном DATABASE_URL
+    asyncpg = None
+
+from services.metrics import postgres_latency, db_hooks
+from services.profiler import record_span
+from services.logs import fields
+
+# Хранилище для «горячих» запросов: профиль пользователя, upsert в user_topics,
+# чтение/обновление user_transcripts, вставка истории чата и каталог видео listening_content.
+# Все реализации дают один и тот же асинхронный интерфейс:
+#   PostgresStorage — напрямую в Postgres через asyncpg: пул соединений, подготовленные
+#                     запросы (кэш statement'ов asyncpg) и бинарный протокол, без HTTP и JSON PostgREST.
+#                     Если Postgres недоступен — запрос уходит в RestStorage;
+#   RestStorage     — клиент Supabase (PostgREST), как раньше; синхронные вызовы — в отдельном потоке;
+#   SqliteStorage   — локальная замена в памяти для офлайн-тестов.
+# STORAGE_BACKEND=auto выбирает Postgres при заданном DATABASE_URL и установленном asyncpg.
+
+load_dotenv()
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+DATABASE_URL = os.getenv("DATABASE_URL")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "auto")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 2))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+SQLITE_PATH = os.getenv("SQLITE_PATH", ":memory:")
+
+POSTGRES_RETRY_AFTER = 30  # Сколько секунд не пытаемся подключиться к Postgres после ошибки
+
+# Колонки user_transcripts, которые можно запрашивать через latest_transcripts
+TRANSCRIPT_COLUMNS = (
+    "id", "user_id", "podcast_title", "transcript", "term_stats", "questions", "topic", "success", "created_at"
+)
+JSON_COLUMNS = ("term_stats", "questions")
+CATALOG_COLUMNS = ("title", "video_url", "video_id", "level", "topic", "required_words", "source_query", "harvested_at")
+
+logger = logging.getLogger(__name__)
+
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+def check_columns(columns: tuple):
+    unknown = set(columns) - set(TRANSCRIPT_COLUMNS)
+    if unknown:
+        raise ValueError(f"Неизвестные колонки user_transcripts: {sorted(unknown)}")
+
+
+def is_row_error(error: Exception) -> bool:
+    """Ошибка из-за данных строки (неверный формат, нарушение ограничения), а не недоступность БД."""
+    if isinstance(error, sqlite3.IntegrityError):
+        return True
+    # asyncpg.DataError — значение не кодируется в тип колонки (например, не-uuid)
+    if asyncpg is not None and isinstance(error, asyncpg.DataError):
+        return True
+    # SQLSTATE: asyncpg — sqlstate, PostgREST — code; класс 22 — неверные данные, 23 — ограничения
+    code = getattr(error, "sqlstate", None) or getattr(error, "code", None)
+    return isinstance(code, str) and code[:2] in ("22", "23")
+
+
+def is_connection_error(error: Exception) -> bool:
+    """Postgres недоступен или соединение оборвалось (а не ошибка самого запроса)."""
+    if asyncpg is not None and isinstance(error, asyncpg.DataError):
+        return False  # DataError — подкласс InterfaceError, но это ошибка данных
+    connection_errors = (OSError, asyncio.TimeoutError)
+    if asyncpg is not None:
+        connection_errors += (asyncpg.PostgresConnectionError, asyncpg.InterfaceError)
+    return isinstance(error, connection_errors)
+
+
+def plain_row(record) -> dict:
+    # uuid и даты приводим к строкам — как в ответах PostgREST
+    row = {}
+    for key, value in dict(record).items():
+        if isinstance(value, UUID):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        row[key] = value
+    return row
+
+
+class RestStorage:
+    """Запросы через PostgREST (клиент Supabase)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def _run(self, query):
+        # Клиент Supabase синхронный — выполняем вне event loop
+        return await asyncio.to_thread(query)
+
+    async def get_profile(self, user_id: str):
+        # users_progress + users_basic одним обращением (sql/008_get_user_profile.sql)
+        response = await self._run(lambda: self.client.rpc("get_user_profile", {"p_user_id": user_id}).execute())
+        return response.data or None
+
+    async def upsert_user_topic(self, row: dict):
+        await self._run(lambda: self.client.from_("user_topics").upsert(row).execute())
+
+    async def latest_transcripts(self, user_id: str, topic: str, columns: tuple, limit: int = 3) -> list:
+        check_columns(columns)
+        response = await self._run(
+            lambda: self.client.from_("user_transcripts")
+            .select(", ".join(columns))
+            .eq("user_id", user_id)
+            .eq("topic", topic)
+            .order("created_at", desc=True)
+            .limit(limit)
+            .execute()
+        )
+        return response.data or []
+
+    async def set_transcript_results(self, results: list):
+        # PostgREST не умеет обновить строки разными значениями одним запросом
+        for transcript_id, success in results:
+            await self._run(
+                lambda: self.client.from_("user_transcripts").update({"success": success}).eq("id", transcript_id).execute()
+            )
+
+    async def insert_chat_messages(self, rows: list):
+        await self._run(lambda: self.client.table("chat_history").insert(rows).execute())
+
+    async def catalog_videos(self, level: str, topic: str, limit: int) -> list:
+        response = await self._run(
+            lambda: self.client.from_("listening_content")
+            .select("title, video_url, level")
+            .eq("level", level)
+            .eq("topic", topic)
+            .order("harvested_at", desc=True)
+            .limit(limit)
+            .execute()
+        )
+        return response.data or []
+
+    async def upsert_catalog_videos(self, rows: list):
+        await self._run(lambda: self.client.from_("listening_content").upsert(rows, on_conflict="level,topic,video_url").execute())
+
+    async def close(self):
+        pass
+
+
+class PostgresStorage:
+    """Прямое подключение к Postgres; при недоступности — fallback (RestStorage)."""
+
+    def __init__(self, dsn: str, fallback, min_size: int = DB_POOL_MIN, max_size: int = DB_POOL_MAX):
+        self.dsn = dsn
+        self.fallback = fallback
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+        self._down_until = 0.0
+
+    @staticmethod
+    async def _init_connection(conn):
+        # jsonb приходит как dict/list, а не строкой
+        await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+    async def _get_pool(self):
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn, min_size=self.min_size, max_size=self.max_size, init=self._init_connection,
+                        # Через pgbouncer в режиме transaction подготовленные запросы не переживают
+                        # смену соединения — тогда кэш statement'ов нужно выключить (0)
+                        statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE", 100)),
+                    )
+        return self._pool
+
+    def _mark_down(self, error: Exception):
+        self._down_until = time.monotonic() + POSTGRES_RETRY_AFTER
+        logger.warning("⚠️ Postgres недоступен, запросы идут через PostgREST", extra=fields(error=str(error)))
+
+    async def _run(self, table: str, operation: str, query, fallback, idempotent: bool = True):
+        if time.monotonic() < self._down_until:
+            return await fallback()
+
+        start = time.perf_counter()
+        try:
+            pool = await self._get_pool()
+            conn = await pool.acquire()
+        except Exception as e:
+            self._record(table, operation, start, "error")
+            if not is_connection_error(e):
+                raise
+            # Запрос ещё не отправлен — его можно выполнить через PostgREST
+            self._mark_down(e)
+            return await fallback()
+
+        try:
+            result = await query(conn)
+        except Exception as e:
+            self._record(table, operation, start, "error")
+            if is_connection_error(e):
+                self._mark_down(e)
+                # Соединение оборвалось после отправки запроса — он мог уже выполниться.
+                # Повтор через PostgREST безопасен для чтения и идемпотентной записи,
+                # неидемпотентная (вставка чата) получает ошибку и решает сама
+                if idempotent:
+                    return await fallback()
+            raise
+        finally:
+            await pool.release(conn)
+        self._record(table, operation, start, "ok")
+        return result
+
+    @staticmethod
+    def _record(table: str, operation: str, start: float, status: str):
+        duration = time.perf_counter() - start
+        postgres_latency.observe(duration, table, operation, status)
+        record_span("postgres", f"{operation} {table}", start, duration, status)
+        for hook in db_hooks:
+            hook(table, operation, duration)
+
+    async def get_profile(self, user_id: str):
+        async def query(conn):
+            record = await conn.fetchrow(
+                """
+                select p.level, p.unlocked_level, b.email
+                from users_progress p left join users_basic b on b.id = p.user_id
+                where p.user_id = $1
+                limit 1
+                """,
+                user_id,
+            )
+            return dict(record) if record else None
+
+        return await self._run("users_progress", "select", query, lambda: self.fallback.get_profile(user_id))
+
+    async def upsert_user_topic(self, row: dict):
+        updated_at = row.get("updated_at")
+        if isinstance(updated_at, str):
+            updated_at = datetime.fromisoformat(updated_at)
+        await self._run(
+            "user_topics", "upsert",
+            lambda conn: conn.execute(
+                """
+                insert into user_topics (user_id, topic, content, read, level, updated_at)
+                values ($1, $2, $3, $4, $5, $6)
+                on conflict (user_id, topic) do update
+                set content = excluded.content, read = excluded.read,
+                    level = excluded.level, updated_at = excluded.updated_at
+                """,
+                row["user_id"], row["topic"], row.get("content"), row.get("read", False), row.get("level"), updated_at,
+            ),
+            lambda: self.fallback.upsert_user_topic(row),
+        )
+
+    async def latest_transcripts(self, user_id: str, topic: str, columns: tuple, limit: int = 3) -> list:
+        check_columns(columns)
+        sql = (
+            f"select {', '.join(columns)} from user_transcripts "
+            "where user_id = $1 and topic = $2 order by created_at desc limit $3"
+        )
+
+        async def query(conn):
+            return [plain_row(record) for record in await conn.fetch(sql, user_id, topic, limit)]
+
+        return await self._run(
+            "user_transcripts", "select", query,
+            lambda: self.fallback.latest_transcripts(user_id, topic, columns, limit),
+        )
+
+    async def set_transcript_results(self, results: list):
+        if not results:
+            return
+        # Все строки одним UPDATE вместо запроса на каждую
+        await self._run(
+            "user_transcripts", "update",
+            lambda conn: conn.execute(
+                """
+                update user_transcripts t set success = v.success
+                from unnest($1::uuid[], $2::boolean[]) as v(id, success)
+                where t.id = v.id
+                """,
+                [transcript_id for transcript_id, _ in results], [success for _, success in results],
+            ),
+            lambda: self.fallback.set_transcript_results(results),
+        )
+
+    async def insert_chat_messages(self, rows: list):
+        records = [
+            (row["user_id"], row["role"], row["message"], datetime.fromisoformat(row["timestamp"]))
+            for row in rows
+        ]
+        # Пачка сообщений — бинарным COPY, а не многострочным INSERT
+        await self._run(
+            "chat_history", "insert",
+            lambda conn: conn.copy_records_to_table(
+                "chat_history", records=records, columns=("user_id", "role", "message", "timestamp")
+            ),
+            lambda: self.fallback.insert_chat_messages(rows),
+            idempotent=False,
+        )
+
+    async def catalog_videos(self, level: str, topic: str, limit: int) -> list:
+        async def query(conn):
+            records = await conn.fetch(
+                """
+                select title, video_url, level from listening_content
+                where level = $1 and topic = $2
+                order by harvested_at desc
+                limit $3
+                """,
+                level, topic, limit,
+            )
+            return [dict(record) for record in records]
+
+        return await self._run(
+            "listening_content", "select", query, lambda: self.fallback.catalog_videos(level, topic, limit)
+        )
+
+    async def upsert_catalog_videos(self, rows: list):
+        records = [
+            tuple(datetime.fromisoformat(row[column]) if column == "harvested_at" else row.get(column)
+                  for column in CATALOG_COLUMNS)
+            for row in rows
+        ]
+        await self._run(
+            "listening_content", "upsert",
+            lambda conn: conn.executemany(
+                """
+                insert into listening_content (title, video_url, video_id, level, topic, required_words, source_query, harvested_at)
+                values ($1, $2, $3, $4, $5, $6, $7, $8)
+                on conflict (level, topic, video_url) do update
+                set title = excluded.title, source_query = excluded.source_query, harvested_at = excluded.harvested_at
+                """,
+                records,
+            ),
+            lambda: self.fallback.upsert_catalog_videos(rows),
+        )
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+SQLITE_SCHEMA = """
+create table if not exists users_basic (id text primary key, email text);
+create table if not exists users_progress (
+    user_id text primary key, level text, unlocked_level integer default 0, success_streak integer default 0
+);
+create table if not exists user_topics (
+    user_id text, topic text, content text, read integer default 0, level text, updated_at text,
+    primary key (user_id, topic)
+);
+create table if not exists user_transcripts (
+    id text primary key, user_id text, podcast_title text, transcript text, term_stats text,
+    questions text, topic text, success integer, created_at text
+);
+create table if not exists listening_content (
+    title text, video_url text, video_id text, level text, topic text default '',
+    required_words integer, source_query text, harvested_at text,
+    primary key (level, topic, video_url)
+);
+create table if not exists chat_history (
+    id integer primary key autoincrement, user_id text, role text, message text, timestamp text
+);
+"""
+
+
+class SqliteStorage:
+    """Локальная замена Postgres для офлайн-тестов (та же схема в упрощённом виде)."""
+
+    def __init__(self, path: str = ":memory:"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SQLITE_SCHEMA)
+
+    def insert_rows(self, table: str, rows: list):
+        """Заполнение таблиц в тестах."""
+        for row in rows:
+            row = {key: json.dumps(value) if key in JSON_COLUMNS else value for key, value in row.items()}
+            columns = ", ".join(row)
+            placeholders = ", ".join("?" for _ in row)
+            self.conn.execute(f"insert into {table} ({columns}) values ({placeholders})", tuple(row.values()))
+        self.conn.commit()
+
+    async def get_profile(self, user_id: str):
+        row = self.conn.execute(
+            "select p.level, p.unlocked_level, b.email from users_progress p "
+            "left join users_basic b on b.id = p.user_id where p.user_id = ? limit 1",
+            (user_id,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    async def upsert_user_topic(self, row: dict):
+        self.conn.execute(
+            """
+            insert into user_topics (user_id, topic, content, read, level, updated_at)
+            values (?, ?, ?, ?, ?, ?)
+            on conflict (user_id, topic) do update
+            set content = excluded.content, read = excluded.read,
+                level = excluded.level, updated_at = excluded.updated_at
+            """,
+            (row["user_id"], row["topic"], row.get("content"), row.get("read", False), row.get("level"), row.get("updated_at")),
+        )
+        self.conn.commit()
+
+    async def latest_transcripts(self, user_id: str, topic: str, columns: tuple, limit: int = 3) -> list:
+        check_columns(columns)
+        records = self.conn.execute(
+            f"select {', '.join(columns)} from user_transcripts "
+            "where user_id = ? and topic = ? order by created_at desc limit ?",
+            (user_id, topic, limit),
+        ).fetchall()
+        rows = []
+        for record in records:
+            row = dict(record)
+            for key in JSON_COLUMNS:
+                if row.get(key) is not None:
+                    row[key] = json.loads(row[key])
+            if row.get("success") is not None:
+                row["success"] = bool(row["success"])
+            rows.append(row)
+        return rows
+
+    async def set_transcript_results(self, results: list):
+        self.conn.executemany(
+            "update user_transcripts set success = ? where id = ?",
+            [(success, transcript_id) for transcript_id, success in results],
+        )
+        self.conn.commit()
+
+    async def insert_chat_messages(self, rows: list):
+        self.conn.executemany(
+            "insert into chat_history (user_id, role, message, timestamp) values (?, ?, ?, ?)",
+            [(row["user_id"], row["role"], row["message"], row["timestamp"]) for row in rows],
+        )
+        self.conn.commit()
+
+    async def catalog_videos(self, level: str, topic: str, limit: int) -> list:
+        records = self.conn.execute(
+            "select title, video_url, level from listening_content "
+            "where level = ? and topic = ? order by harvested_at desc limit ?",
+            (level, topic, limit),
+        ).fetchall()
+        return [dict(record) for record in records]
+
+    async def upsert_catalog_videos(self, rows: list):
+        self.conn.executemany(
+            f"insert or replace into listening_content ({', '.join(CATALOG_COLUMNS)}) "
+            f"values ({', '.join('?' for _ in CATALOG_COLUMNS)})",
+            [tuple(row.get(column) for column in CATALOG_COLUMNS) for row in rows],
+        )
+        self.conn.commit()
+
+    async def close(self):
+        self.conn.close()
+
+
+def create_storage():
+    rest = RestStorage(supabase)
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(SQLITE_PATH)
+    if STORAGE_BACKEND == "rest":
+        return rest
+    if DATABASE_URL and asyncpg is not None:
+        return PostgresStorage(DATABASE_URL, fallback=rest)
+    if STORAGE_BACKEND == "postgres":
+        logger.warning("⚠️ STORAGE_BACKEND=postgres, но нет DATABASE_URL или asyncpg — используем PostgREST")
+    return rest
+
+
+storage = create_storage()
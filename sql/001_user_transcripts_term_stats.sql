@@ -0,0 +1,3 @@
+-- Статистика термов транскрипции для локальной предпроверки ответов (listening/prescreen.py)
+alter table user_transcripts
+    add column if not exists term_stats jsonb;
@@ -0,0 +1,3 @@
+-- Вопросы на понимание с эталонными ответами и ключевыми фактами (listening/comprehension.py)
+alter table user_transcripts
+    add column if not exists questions jsonb;
@@ -0,0 +1,68 @@
+-- Серия подряд верных listening-ответов. Обновляется в /check_answer,
+-- а /unlock_card открывает карточку одним атомарным UPDATE и обнуляет серию.
+alter table users_progress
+    add column if not exists success_streak integer not null default 0;
+
+-- Перенос текущего состояния: последние 3 транскрипции пользователя успешные
+update users_progress p
+set success_streak = 3
+where (
+    select count(*) filter (where t.success)
+    from (
+        select success from user_transcripts
+        where user_id = p.user_id
+        order by created_at desc
+        limit 3
+    ) t
+) = 3;
+
+-- p_results — результаты проверки в хронологическом порядке (старые первыми)
+create or replace function record_listening_results(p_user_id uuid, p_results boolean[])
+returns integer
+language plpgsql
+as $$
+declare
+    result boolean;
+    streak integer;
+begin
+    select success_streak into streak
+    from users_progress
+    where user_id = p_user_id
+    for update;
+
+    if not found then
+        return null;
+    end if;
+
+    foreach result in array p_results loop
+        streak := case when result then streak + 1 else 0 end;
+    end loop;
+
+    update users_progress set success_streak = streak where user_id = p_user_id;
+    return streak;
+end;
+$$;
+
+-- Открывает следующую карточку, если серия >= p_required и лимит не достигнут.
+-- Одно условное UPDATE: конкурентный второй вызов после блокировки строки
+-- перепроверяет условие на уже обнулённой серии и ничего не меняет.
+create or replace function unlock_next_card(p_user_id uuid, p_max_level integer, p_required integer default 3)
+returns table (unlocked boolean, unlocked_level integer)
+language sql
+as $$
+    with updated as (
+        update users_progress
+        set unlocked_level = least(users_progress.unlocked_level + 1, p_max_level),
+            success_streak = 0
+        where users_progress.user_id = p_user_id
+          and users_progress.success_streak >= p_required
+          and users_progress.unlocked_level < p_max_level
+        returning users_progress.unlocked_level
+    )
+    select true, updated.unlocked_level from updated
+    union all
+    select false, p.unlocked_level
+    from users_progress p
+    where p.user_id = p_user_id
+      and not exists (select 1 from updated);
+$$;
@@ -0,0 +1,3 @@
+-- Уникальный индекс для поиска пользователя по email при сбросе пароля (routers/reset_password.py)
+create unique index if not exists users_basic_email_key
+    on users_basic (email);
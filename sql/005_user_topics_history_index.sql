@@ -0,0 +1,4 @@
+-- Индекс под keyset-пагинацию /reading/get_history: (updated_at, topic) по убыванию
+create index if not exists user_topics_history_idx
+    on user_topics (user_id, updated_at desc, topic desc)
+    where read;
@@ -0,0 +1,3 @@
+-- Индекс под курсорную выдачу /practice/chat/history (before/after по timestamp)
+create index if not exists chat_history_user_timestamp_idx
+    on chat_history (user_id, "timestamp");
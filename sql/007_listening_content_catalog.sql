@@ -0,0 +1,23 @@
+-- Каталог видео для /listening/videos (listening/video_api.py).
+-- Видео собираются заранее по уровням и темам; dedup — одно видео один раз на (уровень, тему).
+alter table listening_content
+    add column if not exists topic text not null default '',
+    add column if not exists video_id text,
+    add column if not exists source_query text,
+    add column if not exists harvested_at timestamptz not null default now();
+
+-- upload_youtube.py мог сохранить одно видео несколько раз (upsert без ключа, topic = ''):
+-- оставляем по одной строке на (уровень, тему, видео), иначе уникальный индекс не создать
+delete from listening_content a
+using listening_content b
+where a.level = b.level
+  and a.topic = b.topic
+  and a.video_url = b.video_url
+  and a.ctid < b.ctid;
+
+create unique index if not exists listening_content_level_topic_video_key
+    on listening_content (level, topic, video_url);
+
+-- Выборка каталога: уровень + тема, свежие первыми
+create index if not exists listening_content_level_topic_idx
+    on listening_content (level, topic, harvested_at desc);
@@ -0,0 +1,14 @@
+-- Профиль пользователя (services/profile_cache.py) одним запросом через PostgREST:
+-- level и unlocked_level из users_progress вместе с email из users_basic.
+-- null — пользователя нет. json, чтобы не зависеть от типов колонок
+create or replace function get_user_profile(p_user_id uuid)
+returns json
+language sql
+stable
+as $$
+    select json_build_object('level', p.level, 'unlocked_level', p.unlocked_level, 'email', b.email)
+    from users_progress p
+    left join users_basic b on b.id = p.user_id
+    where p.user_id = p_user_id
+    limit 1;
+$$;
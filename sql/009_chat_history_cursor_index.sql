@@ -0,0 +1,5 @@
+-- Курсор /practice/chat/history — (timestamp, id): у сообщений одной пачки timestamp может совпадать
+create index if not exists chat_history_user_timestamp_id_idx
+    on chat_history (user_id, "timestamp", id);
+
+drop index if exists chat_history_user_timestamp_idx;
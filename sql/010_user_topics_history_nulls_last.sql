@@ -0,0 +1,7 @@
+-- /reading/get_history сортирует updated_at desc nulls last (записи без updated_at — в конце),
+-- индекс из 005 (desc = nulls first) под такой порядок не подходит
+create index if not exists user_topics_history_nulls_last_idx
+    on user_topics (user_id, updated_at desc nulls last, topic desc)
+    where read;
+
+drop index if exists user_topics_history_idx;
@@ -5,6 +5,8 @@ from typing import Dict
 from supabase import create_client, Client
 import logging
 
+from services.profile_cache import profiles
+
 logging.basicConfig(level=logging.INFO)
 
 load_dotenv()
@@ -19,17 +21,14 @@ router = APIRouter()
 @router.get("/user/{user_id}/stats")
 async def get_user_stats(user_id: str) -> Dict:
     try:
-        user_response = supabase.table("users_basic").select("email").eq("id", user_id).single().execute()
-        if not user_response.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        email = user_response.data["email"]
-
-        user_progress_response = supabase.table("users_progress").select("level, unlocked_level").eq("user_id", user_id).single().execute()
-        if not user_progress_response.data:
+        # email, level и unlocked_level — из кэша профиля (services/profile_cache.py)
+        profile = await profiles.get(user_id)
+        if not profile:
             raise HTTPException(status_code=404, detail="User progress not found")
 
-        level = user_progress_response.data["level"]
-        unlocked_level = user_progress_response.data["unlocked_level"]
+        email = profile["email"]
+        level = profile["level"]
+        unlocked_level = profile["unlocked_level"]
 
         vocab_total = len(supabase.table("vocabulary_super").select("*").eq("level", level).execute().data)
         vocab_learned = len(supabase.table("user_vocabulary_progress").select("*").eq("user_id", user_id).eq("is_read", True).execute().data)
@@ -1,18 +1,31 @@
 import asyncio
-from fastapi_mail import FastMail, MessageSchema
-from settings import conf
+from services.mail_outbox import MailOutbox
+from services.smtp_stub import SMTPStub
 
+# Проверка очереди писем на локальном SMTP stand-in (реальные письма не уходят)
 async def send_test_email():
-    message = MessageSchema(
-        subject="Тестовое письмо от FastAPI",
-        recipients=["zhansarbaevvv@gmail.com"],  
-        body="Привет! Это тестовое письмо через Yandex SMTP (FastAPI).",
-        subtype="html"
+    stub = await SMTPStub().start()
+    outbox = MailOutbox(
+        hostname=stub.host,
+        port=stub.port,
+        username="test@example.com",
+        password="password",
+        sender="test@example.com",
+        use_tls=False,
+        workers=2,
+        rate_per_sec=0
     )
+    await outbox.start()
 
-    fm = FastMail(conf)
-    await fm.send_message(message)
-    print("Email отправлен!")
+    for i in range(5):
+        outbox.enqueue("user@example.com", f"Тестовое письмо #{i}", "Привет! Это тестовое письмо через очередь.")
+
+    await outbox.stop()
+    await stub.stop()
+
+    assert len(stub.messages) == 5, stub.messages
+    assert stub.connections <= 2, f"Соединения не переиспользуются: {stub.connections}"
+    print(f"Email отправлены: {len(stub.messages)}, SMTP-соединений: {stub.connections}")
 
 # Запуск асинхронной функции
 asyncio.run(send_test_email())
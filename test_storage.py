@@ -0,0 +1,72 @@
+import asyncio
+from services.storage import SqliteStorage
+
+# Контракт хранилища (services/storage.py) на SqliteStorage — без Postgres и Supabase.
+# PostgresStorage и RestStorage дают тот же интерфейс и те же формы строк.
+USER_ID = "00000000-0000-0000-0000-000000000001"
+
+
+async def check_storage(storage):
+    storage.insert_rows("users_basic", [{"id": USER_ID, "email": "user@example.com"}])
+    storage.insert_rows("users_progress", [{"user_id": USER_ID, "level": "B1", "unlocked_level": 2}])
+
+    # Профиль — одна строка из users_progress и users_basic; нет пользователя — None
+    assert await storage.get_profile(USER_ID) == {"level": "B1", "unlocked_level": 2, "email": "user@example.com"}
+    assert await storage.get_profile("00000000-0000-0000-0000-000000000002") is None
+
+    # Транскрипции: последние по created_at, JSON-колонки уже разобраны
+    storage.insert_rows("user_transcripts", [
+        {"id": f"t{i}", "user_id": USER_ID, "topic": "travel", "podcast_title": f"Podcast {i}",
+         "questions": [{"question": f"Q{i}"}], "created_at": f"2024-05-01T10:00:00.00{i}+00:00"}
+        for i in range(4)
+    ])
+    latest = await storage.latest_transcripts(USER_ID, "travel", ("id", "podcast_title", "questions"))
+    assert [row["id"] for row in latest] == ["t3", "t2", "t1"], latest
+    assert latest[0]["questions"] == [{"question": "Q3"}]
+
+    await storage.set_transcript_results([("t3", True), ("t2", False)])
+    latest = await storage.latest_transcripts(USER_ID, "travel", ("id", "success"), limit=2)
+    assert [row["success"] for row in latest] == [True, False], latest
+
+    try:
+        await storage.latest_transcripts(USER_ID, "travel", ("id", "password"))
+        raise AssertionError("неизвестная колонка должна отклоняться")
+    except ValueError:
+        pass
+
+    # upsert в user_topics перезаписывает статью по (user_id, topic)
+    await storage.upsert_user_topic({"user_id": USER_ID, "topic": "Food", "content": "v1", "level": "B1"})
+    await storage.upsert_user_topic({"user_id": USER_ID, "topic": "Food", "content": "v2", "level": "B1"})
+    topics = storage.conn.execute("select content from user_topics where user_id = ?", (USER_ID,)).fetchall()
+    assert [row["content"] for row in topics] == ["v2"]
+
+    # Сообщения чата — одной пачкой, порядок сохраняется
+    await storage.insert_chat_messages([
+        {"user_id": USER_ID, "role": role, "message": f"m{i}", "timestamp": f"2024-05-01T10:00:0{i}"}
+        for i, role in enumerate(["user", "assistant", "user"])
+    ])
+    messages = storage.conn.execute("select message from chat_history order by id").fetchall()
+    assert [row["message"] for row in messages] == ["m0", "m1", "m2"]
+
+    # Каталог видео: повторный upsert того же (level, topic, video_url) не дублирует строку
+    video = {"title": "Old", "video_url": "https://youtu.be/a", "video_id": "a", "level": "B1",
+             "topic": "travel", "source_query": "q", "harvested_at": "2024-05-01T10:00:00+00:00"}
+    await storage.upsert_catalog_videos([video])
+    await storage.upsert_catalog_videos([{**video, "title": "New", "harvested_at": "2024-05-02T10:00:00+00:00"}])
+    await storage.upsert_catalog_videos([{**video, "topic": "food"}])
+    assert await storage.catalog_videos("B1", "travel", 10) == [
+        {"title": "New", "video_url": "https://youtu.be/a", "level": "B1"}
+    ]
+    assert len(await storage.catalog_videos("B1", "food", 10)) == 1
+    assert await storage.catalog_videos("C1", "travel", 10) == []
+
+    await storage.close()
+
+
+def test_sqlite_storage_contract():
+    asyncio.run(check_storage(SqliteStorage()))
+
+
+if __name__ == "__main__":
+    test_sqlite_storage_contract()
+    print("Контракт хранилища выполнен")
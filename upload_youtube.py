@@ -48,7 +48,8 @@ def fetch_youtube_videos(user_level):
 
 def save_videos_to_supabase(videos):
     for video in videos:
-        supabase.table("listening_content").upsert(video).execute()
+        # Ключ каталога (sql/007_listening_content_catalog.sql): повтор видео обновляет строку
+        supabase.table("listening_content").upsert(video, on_conflict="level,topic,video_url").execute()
 
 
 if __name__ == "__main__":
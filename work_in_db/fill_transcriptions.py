@@ -1,20 +1,22 @@
 import os
-import openai
+import asyncio
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import time
 
+from services.llm_gateway import llm, LLMError
+
+# Запуск из корня проекта: python -m work_in_db.fill_transcriptions
+
 # Загружаем переменные окружения
 load_dotenv()
 
 # Ключи из .env
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # Подключаемся к Supabase
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-openai.api_key = OPENAI_API_KEY
 
 # ⚡ Получаем слово без транскрипции
 def fetch_word_without_transcription():
@@ -26,28 +28,27 @@ def update_transcription(word_id, transcription):
     supabase.table("vocabulary_super").update({"transcription": transcription}).eq("id", word_id).execute()
 
 # ⚡ Запрашиваем транскрипцию с форматом в [скобках]
-def get_transcription(word):
+async def get_transcription(word):
     prompt = f"Дай только IPA-транскрипцию слова {word} в квадратных скобках. Пример: [teɪbl]"
 
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",  # Используем дешевую и быструю модель
-            messages=[{"role": "user", "content": prompt}],
+        transcription = (await llm.chat(
+            "gpt-3.5-turbo",  # Используем дешевую и быструю модель
+            [{"role": "user", "content": prompt}],
             temperature=0  # Убираем случайные вариации
-        )
-        transcription = response["choices"][0]["message"]["content"].strip()
+        )).strip()
 
         # Проверяем, что ответ содержит [ ], если нет — добавляем
         if not transcription.startswith("[") or not transcription.endswith("]"):
             transcription = f"[{transcription}]"
 
         return transcription
-    except Exception as e:
+    except LLMError as e:
         print(f"❌ Ошибка OpenAI: {e}")
         return None
 
 # ⚡ Основной процесс (ускоренная обработка по 1 слову)
-def main():
+async def main():
     start_time = time.time()
     processed_count = 0
 
@@ -61,7 +62,7 @@ def main():
         word = word_data["word"]
 
         print(f"🔹 Обрабатываем: {word}...")
-        transcription = get_transcription(word)
+        transcription = await get_transcription(word)
 
         if transcription:
             update_transcription(word_id, transcription)
@@ -70,10 +71,11 @@ def main():
         else:
             print(f"❌ Ошибка для {word}")
 
-        time.sleep(0.2)  # Уменьшенная пауза для ускорения
+        await asyncio.sleep(0.2)  # Уменьшенная пауза для ускорения
 
     elapsed_time = time.time() - start_time
     print(f"⏳ Время выполнения: {elapsed_time:.2f} сек (~{elapsed_time/60:.2f} мин)")
+    await llm.close()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())